@@ -5,7 +5,6 @@
 
 import numpy as np
 from operator import itemgetter
-from shapely.geometry import Point, Polygon, MultiPoint
 
 class CPFrame:
 
@@ -43,6 +42,7 @@ class CPFrame:
     #                         integer 0 to n) and pixels not containing any outline with -1
     # output 2D array where all pixels contained within a cell are marked by the cell_id
     def assign_pix_to_cells(self, outlines_array):
+        from shapely.geometry import Point, Polygon
         k = 0
         min_max = self.get_cell_min_max()
         for cell in self.outlines_list:
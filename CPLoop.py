@@ -5,16 +5,45 @@
 
 # import packages
 import argparse
+import concurrent.futures
+import json
+import multiprocessing
 import pathlib
 import re
 import os
 import cv2
-from PyQt5 import QtCore, QtWidgets
 from cellpose import models, io
-from cellpose import __main__ as cpmain
-
-
-def main(image_list, gpu_bool, start_z=0, end_z=None, switch_z=None, start_model="TN3", switch_model="TN2", pretrained=None):
+import numpy as np
+
+import checkpoint
+import dataset_manifest
+
+REVIEW_FILE_NAME = "review_flagged.txt"      # list of the segmentations flagged in the review pass, one per line
+DIAMETER_CACHE_NAME = "cellpose_diameters.json"     # cache of the diameters estimated for each dataset and model
+SHARD_SIZE = 8          # default number of images in each shard segmented by a worker process (see segment_parallel)
+
+_model_registry = {}        # (model type, gpu, pretrained PATH) -> loaded Cellpose model
+_size_model_registry = {}   # (model type, gpu, model name) -> SizeModel of the model
+
+
+# segments the images of a folder (or a list of image PATHs) with Cellpose
+# input: image_list - PATH of the folder of images named with z__t__, or a list of image PATHs
+#        gpu_bool - boolean; if True, Cellpose is run on the GPU
+#        start_z, end_z - optional, inclusive range of the z layers to segment
+#        switch_z - optional, z layer to switch to switch_model on
+#        start_model, switch_model - Cellpose model types (see check_args)
+#        pretrained - optional, PATH of a self-trained model, used for models named "pretrained"
+#        batch_size, review - see segment_image and review_segmentations
+#        diameter_cache - PATH of the .json cache of the estimated diameters, None to always estimate the diameter
+#        workers - number of processes to segment in, if more than 1 the images are split into shards of consecutive
+#                  (t, z) images segmented in parallel without waiting for the user (see segment_parallel)
+#        track - boolean; if True, the segmentations are kept in memory and tracked with the CPTracker (main.py) once
+#                every image is segmented, without reading them back from .npy files (see track_segmentations), the
+#                images are segmented in batches (of SHARD_SIZE if batch_size is not set) without waiting for the user
+#        save - boolean; if True (default), the segmentations are saved as .npy files, can only be False with track
+# output: None, the segmentations are saved as z__t___seg.npy files, or with track the return value of the CPTracker
+def main(image_list, gpu_bool, start_z=0, end_z=None, switch_z=None, start_model="TN3", switch_model="TN2", pretrained=None,
+         batch_size=None, review=False, diameter_cache=DIAMETER_CACHE_NAME, workers=1, track=False, save=True):
 
     # user specifies if the GPU or CPU is used to run Cellpose
     if gpu_bool:
@@ -22,24 +51,147 @@ def main(image_list, gpu_bool, start_z=0, end_z=None, switch_z=None, start_model
     else:
         gpu=False
 
-    # initiate Cellpose segmentation models
-    model_cp_0 = models.Cellpose(gpu=gpu, model_type=start_model)      # primary model
-
-    if switch_z:    # model to switch to at specified z, only if switch_z != None
-        model_cp_1 = models.Cellpose(gpu=gpu, model_type=switch_model)
+    if not save and not track:
+        print("Error: the segmentations must be saved or tracked")
+        return -1
 
-    if pretrained:      # if user wants to use pretrained (self-trained model)
-        custom_cp = models.CellposeModel(gpu=True, pretrained_model=PATH)
-
-    size_model = models.SizeModel(model_cp_0)
-    diam, diam_style = size_model.eval(image_list)
+    if isinstance(image_list, (str, os.PathLike)):      # folder of images
+        image_folder = str(image_list)
+        image_list = list_images(image_list, start_z, end_z)
+    else:
+        image_folder = os.path.dirname(str(image_list[0])) if len(image_list) else "."
+    image_list = [str(f) for f in image_list]
+    if len(image_list) == 0:
+        print("Error: no images to segment")
+        return -1
+
+    # the tracker needs every segmentation, so they are not waited on one by one
+    results = None
+    if track:
+        results = {}
+        batch_size = batch_size or SHARD_SIZE
 
     filename_list = []
     for image in image_list:
         name = extract_ztname(image)
         filename_list.append(name)
+    model_types = [start_model, switch_model]
+    model_index = [model_for_z(extract_zt(f)[0], switch_z) for f in image_list]
 
-    segment_image(image_list, filename_list, model_cp_0, diam)
+    diam = estimate_diameter(image_list, start_model, gpu, pretrained, cache_file=diameter_cache)
+
+    if workers > 1:
+        segment_parallel(image_list, filename_list, [model_types[m] for m in model_index], gpu, pretrained, diam,
+                         workers, batch_size=batch_size, save=save, results=results)
+    else:
+        # initiate Cellpose segmentation models, loaded once per process and reused for every folder (see get_model)
+        model_cp_0 = get_model(start_model, gpu, pretrained)      # primary model
+
+        if switch_z:    # model to switch to at specified z, only if switch_z != None
+            model_cp_1 = get_model(switch_model, gpu, pretrained)
+        else:
+            model_cp_1 = None
+
+        # segment each run of consecutive images that use the same model, in order
+        images = [io.imread(f) for f in image_list]
+        start = 0
+        for end in range(1, len(image_list) + 1):
+            if end == len(image_list) or model_index[end] != model_index[start]:
+                segment_image(images[start:end], filename_list[start:end],
+                              model_cp_1 if model_index[start] else model_cp_0, diam, batch_size=batch_size,
+                              save=save, results=results)
+                start = end
+
+    # segmentations were saved without waiting for the user, review them afterwards if selected
+    if (batch_size or workers > 1) and review and save:
+        review_segmentations(filename_list)
+
+    if track:
+        return track_segmentations(image_folder, results)
+
+
+# returns which model segments a z layer, the start model (0) below switch_z and the switch model (1) from switch_z on
+# input: z - the z layer
+#        switch_z - z layer on which to switch segmentation model, or None
+# output: 0 for the start model, 1 for the switch model
+def model_for_z(z, switch_z):
+    if switch_z and z >= switch_z:
+        return 1
+    return 0
+
+
+# returns a Cellpose model, creating it the first time it is asked for, so the models are loaded once and reused across
+# folders and calls of main
+# input: model_type - Cellpose model type, or "pretrained" for the self-trained model at pretrained
+#        gpu - boolean; if True, the model runs on the GPU
+#        pretrained - PATH of the self-trained model, only used if model_type is "pretrained"
+# output: the models.Cellpose (or models.CellposeModel for a pretrained model)
+def get_model(model_type, gpu, pretrained=None):
+    key = (model_type, bool(gpu), str(pretrained) if model_type == "pretrained" else None)
+    if key not in _model_registry:
+        if model_type == "pretrained":      # if user wants to use pretrained (self-trained model)
+            _model_registry[key] = models.CellposeModel(gpu=gpu, pretrained_model=str(pretrained))
+        else:
+            _model_registry[key] = models.Cellpose(gpu=gpu, model_type=model_type)
+
+    return _model_registry[key]
+
+
+# returns the cell diameter of a dataset estimated with the SizeModel of a model, read from the diameter cache if the
+# same images were already estimated with the same model
+# the cache key is the fingerprint of the images (name, size, and modification time, see checkpoint.dataset_fingerprint)
+# and the model, so a changed dataset is estimated again
+# input: image_list - list of the PATHs of the images
+#        model_type, gpu, pretrained - the model to estimate the diameter with (see get_model)
+#        cache_file - PATH of the .json diameter cache, None to not use the cache
+#        images - optional, the loaded images in the same order, read from image_list if the diameter is not cached
+# output: diameter - the estimated diameter
+def estimate_diameter(image_list, model_type, gpu, pretrained=None, cache_file=DIAMETER_CACHE_NAME, images=None):
+    model_name = str(pretrained) if model_type == "pretrained" else model_type
+    key = checkpoint.dataset_fingerprint(image_list) + ":" + model_name
+
+    cache = {}
+    if cache_file and os.path.isfile(cache_file):
+        with open(cache_file) as fp:
+            cache = json.load(fp)
+        if key in cache:
+            print("Using cached diameter " + str(round(cache[key]["diameter"], 2)) + " for " + model_name)
+            return cache[key]["diameter"]
+
+    model_key = (model_type, bool(gpu), model_name)
+    if model_key not in _size_model_registry:
+        _size_model_registry[model_key] = models.SizeModel(get_model(model_type, gpu, pretrained))
+    if images is None:
+        images = [io.imread(f) for f in image_list]
+    diam, diam_style = _size_model_registry[model_key].eval(images)
+    diam = float(np.mean(diam))
+
+    if cache_file:
+        cache[key] = {"diameter": diam, "model": model_name,
+                      "folder": os.path.dirname(os.path.abspath(image_list[0])), "images": len(image_list)}
+        tmp_file = cache_file + ".tmp"
+        with open(tmp_file, "w") as fp:
+            json.dump(cache, fp, indent=1)
+        os.replace(tmp_file, cache_file)
+
+    return diam
+
+
+# returns the images in a folder named with z__t__, in order of t and z
+# input: image_folder - PATH to the folder
+#        start_z, end_z - optional, inclusive range of the z layers to return
+# output: list of the PATHs of the images
+def list_images(image_folder, start_z=None, end_z=None):
+    image_list = []
+    for file in os.scandir(image_folder):
+        if not file.is_file() or not re.match(r'.*\/?[z|Z]\d+[t|T]\d+', file.path, re.I):
+            continue
+        z, t = extract_zt(file.path)
+        if (start_z and z < start_z) or (end_z and z > end_z):
+            continue
+        image_list.append((t, z, file.path))
+
+    return [path for t, z, path in sorted(image_list)]
 
 
 # segments an image or list of images using Cellpose and saves it to a .npy file (and .png if png=True)
@@ -49,9 +201,19 @@ def main(image_list, gpu_bool, start_z=0, end_z=None, switch_z=None, start_model
 #        cp_model - initialized Cellpose model
 #        diameter - average diameter of cells calibrated through the SizeModel
 #        png - boolean; if True, segmentation will be saved as .png and .npy, if false, it is only saved as a .npy
-def segment_image(image_list, filename_list, cp_model, diameter=None, png=False):
+#        batch_size - optional, number of images given to Cellpose at a time, if set the images are segmented in batches
+#                     and each segmentation is saved as soon as its batch is complete, without waiting for the user
+#                     (see review_segmentations for the manual review), if None (default) each image is saved after
+#                     the user presses 'y'
+#        save, results - see segment_batches, only used with batch_size
+def segment_image(image_list, filename_list, cp_model, diameter=None, png=False, batch_size=None, save=True,
+                  results=None):
+    if batch_size:
+        segment_batches(image_list, filename_list, cp_model, diameter, png, batch_size, save=save, results=results)
+        return
+
     for i in range(len(image_list)):
-        masks, flows, styles, diams = cp_model.eval(image_list[i])      # run Cellpose and get masks
+        masks, flows, styles, diams = cp_model.eval(image_list[i], diameter=diameter)      # run Cellpose and get masks
 
         # wait for user key press to continue
         print("Press 'y' after manual correction to continue")
@@ -68,6 +230,176 @@ def segment_image(image_list, filename_list, cp_model, diameter=None, png=False)
                 io.save_masks(image_list[i], masks, flows, png_filename, png=True)     # save as .png
 
 
+# segments a list of images in batches and saves each segmentation without waiting for the user
+# input: image_list, filename_list, cp_model, diameter, png - see segment_image
+#        batch_size - number of images given to cp_model.eval at a time
+#        verbose - boolean; if True (default), the progress is printed after each batch
+#        save - boolean; if True (default), each segmentation is saved as a .npy (and .png if png)
+#        results - optional, dictionary the segmentations are added to, mapping each filename to a dictionary of the
+#                  "img", "masks", "est_diam", and "filename", as in a saved _seg.npy
+# output: None
+def segment_batches(image_list, filename_list, cp_model, diameter, png, batch_size, verbose=True, save=True,
+                    results=None):
+    for start in range(0, len(image_list), batch_size):
+        batch = list(image_list[start:start + batch_size])
+        masks, flows, styles, diams = cp_model.eval(batch, diameter=diameter)     # lists, one entry per image
+
+        for j in range(len(batch)):
+            npy_filename = filename_list[start + j] + ".npy"
+            image_diam = diams[j] if np.ndim(diams) > 0 else diams      # Cellpose returns one diameter per image
+            if save:
+                io.masks_flows_to_seg(batch[j], masks[j], flows[j], image_diam, npy_filename)    # save as .npy
+                if png:
+                    io.save_masks(batch[j], masks[j], flows[j], filename_list[start + j] + ".png", png=True)
+            if results is not None:
+                results[filename_list[start + j]] = {"img": batch[j], "masks": masks[j], "est_diam": image_diam,
+                                                     "filename": filename_list[start + j]}
+
+        if verbose:
+            print("Segmented " + str(min(start + batch_size, len(image_list))) + " of " + str(len(image_list))
+                  + " images")
+
+
+# segments images in parallel processes, each with its own copy of the models loaded once when the process starts
+# the images (in order of t and z) are split into shards of up to batch_size consecutive images using the same model,
+# so each shard is a range of z layers at one t, and each worker reads, segments, and saves the images of a shard
+# the images are segmented with the same models and estimated diameter as in the serial path (interactive or batch),
+# so the results are the same
+# input: image_list - list of the PATHs of the images
+#        filename_list - list of desired filenames of the saved .npy files, in same order as image_list
+#        model_list - the model type to segment each image with (see model_for_z)
+#        gpu, pretrained - see get_model
+#        diameter - the estimated diameter
+#        workers - number of processes
+#        batch_size - number of images in each shard, defaults to SHARD_SIZE
+#        png - boolean; if True, segmentation will be saved as .png and .npy
+#        save, results - see segment_batches, the segmentations are sent back from the workers only with results
+# output: None
+def segment_parallel(image_list, filename_list, model_list, gpu, pretrained, diameter, workers, batch_size=None,
+                     png=False, save=True, results=None):
+    if not batch_size:
+        batch_size = SHARD_SIZE
+
+    shards = []
+    start = 0
+    for end in range(1, len(image_list) + 1):
+        if end == len(image_list) or model_list[end] != model_list[start] or end - start == batch_size:
+            shards.append((image_list[start:end], filename_list[start:end], model_list[start]))
+            start = end
+
+    # torch uses every core in each process by default, split the cores between the workers instead
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    done = 0
+    # spawned processes, so no torch state is copied from this process
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                                initializer=init_worker,
+                                                initargs=(sorted(set(model_list)), gpu, pretrained,
+                                                          threads)) as executor:
+        futures = [executor.submit(segment_shard, files, names, model_type, gpu, pretrained, diameter, png, save,
+                                   results is not None)
+                   for files, names, model_type in shards]
+        for future in concurrent.futures.as_completed(futures):
+            count, shard_results = future.result()
+            done += count
+            if results is not None:
+                results.update(shard_results)
+            print("Segmented " + str(done) + " of " + str(len(image_list)) + " images")
+
+
+# loads the models of a segmentation worker process once, when the process starts
+# input: model_types - the model types the worker uses
+#        gpu, pretrained - see get_model
+#        threads - number of threads torch uses in the process
+# output: None
+def init_worker(model_types, gpu, pretrained, threads):
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+    for model_type in model_types:
+        get_model(model_type, gpu, pretrained)
+
+
+# reads, segments, and saves one shard of images in a worker process
+# input: file_list - list of the PATHs of the images in the shard
+#        filename_list - the filenames to save the segmentations as
+#        model_type, gpu, pretrained - the model of the shard (see get_model)
+#        diameter - the estimated diameter
+#        png, save - see segment_batches
+#        keep - boolean; if True, the segmentations are returned to the main process
+# output: (count, results) - number of images segmented and the dictionary of segmentations (see segment_batches), or
+#         None if not keep
+def segment_shard(file_list, filename_list, model_type, gpu, pretrained, diameter, png, save=True, keep=False):
+    images = [io.imread(f) for f in file_list]
+    results = {} if keep else None
+    segment_batches(images, filename_list, get_model(model_type, gpu, pretrained), diameter, png, len(images),
+                    verbose=False, save=save, results=results)
+    return len(images), results
+
+
+# tracks segmentations kept in memory with the CPTracker (main.py), using the inputs at the top of main.py other than
+# FOLDER_NAME, which is set to the folder of the images so the generated files are written next to them
+# input: image_folder - PATH of the folder of the segmented images
+#        results - dictionary of the segmentations of each z__t__ filename (see segment_batches)
+# output: return value of main.main, 0 if successful, -1 if not
+def track_segmentations(image_folder, results):
+    import main as cptracker        # only needed when tracking, main.py imports the whole tracker
+
+    segmentations = {}
+    for filename, seg in results.items():
+        z, t = extract_zt(filename)
+        segmentations[dataset_manifest.frame_id(t, z)] = seg
+
+    cptracker.FOLDER_NAME = image_folder
+    return cptracker.main(resume=False, workers=cptracker.WORKERS, link_mode=cptracker.LINK_MODE, watch=False,
+                          segmentations=segmentations)
+
+
+# manual review of segmentations saved by the batch mode: shows each image with its mask outlines, the user presses 'y'
+# to accept it or 'n' to flag it for correction in the Cellpose GUI ('ESC' stops the review)
+# input: filename_list - list of the filenames of the saved .npy files, without the .npy
+#        review_file - PATH of the list of flagged files, defaults to review_flagged.txt
+# output: flagged - list of the filenames flagged by the user, also saved to review_file
+def review_segmentations(filename_list, review_file=REVIEW_FILE_NAME):
+    flagged = []
+    print("Review: press 'y' to accept a segmentation, 'n' to flag it for correction, 'ESC' to stop")
+    for filename in filename_list:
+        seg_file = filename + "_seg.npy"        # name io.masks_flows_to_seg saves filename.npy as
+        if not os.path.isfile(seg_file):
+            print("Error: could not find segmentation " + seg_file + ", it is flagged")
+            flagged.append(filename)
+            continue
+        seg = np.load(seg_file, allow_pickle=True).item()
+
+        # draw the outlines of the masks in red over the image
+        img = np.asarray(seg["img"], dtype=np.float32)
+        if img.ndim == 3:
+            img = img.mean(axis=-1) if img.shape[-1] <= 4 else img.mean(axis=0)
+        img = cv2.normalize(img, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+        display = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+        masks = seg["masks"]
+        edge = np.zeros(masks.shape, dtype=bool)
+        edge[1:, :] |= masks[1:, :] != masks[:-1, :]
+        edge[:, 1:] |= masks[:, 1:] != masks[:, :-1]
+        display[edge & (masks > 0)] = (0, 0, 255)
+
+        cv2.imshow("Review", display)
+        k = cv2.waitKey(0) & 0xff
+        if k == 27:     # 'ESC'
+            break
+        if k != ord('y'):
+            flagged.append(filename)
+
+    cv2.destroyAllWindows()
+    with open(review_file, "w") as fp:
+        fp.write("\n".join(flagged) + ("\n" if flagged else ""))
+    print(str(len(flagged)) + " segmentations flagged, saved to " + review_file)
+
+    return flagged
+
+
 # check that command line arguments are valid
 # input: args - ArgumentParser-parsed command line arguments
 # output: boolean - True if all arguments are valid, False if any are not
@@ -79,19 +411,20 @@ def check_args(args):
                   "LC1", "LC2", "LC3", "LC4", "pretrained"]
 
     # check that file name is valid and get z_max and t_max
-    for file in os.scandir(args.image_folder):
-        if not file.is_file():
-            print("Error: file" + file.path + " does not exist.")
-            return False
-        if not re.match(r'.*\/?[z|Z]\d+[t|T]\d+', file.path, re.I):  # check to see if file follows pattern PATH/Z001T001
-            print("Error: File names do not match pattern PATH/Z__T__, where __ can be any number of integers")
-            ret = False
-        else:
-            z, t = extract_zt(file.path)
-
-            # find maximum z and t
-            if z > z_max: z_max = z
-            if t > t_max: t_max = t
+    for image_folder in args.image_folder:
+        for file in os.scandir(image_folder):
+            if not file.is_file():
+                print("Error: file" + file.path + " does not exist.")
+                return False
+            if not re.match(r'.*\/?[z|Z]\d+[t|T]\d+', file.path, re.I):  # check to see if file follows pattern PATH/Z001T001
+                print("Error: File names do not match pattern PATH/Z__T__, where __ can be any number of integers")
+                ret = False
+            else:
+                z, t = extract_zt(file.path)
+
+                # find maximum z and t
+                if z > z_max: z_max = z
+                if t > t_max: t_max = t
 
     # check that layer to start segmentation on (switch_z) is positive and not greater than the number of z layers in the stack
     if args.start_z and (args.start_z < 0 or args.start_z > z_max):
@@ -119,6 +452,10 @@ def check_args(args):
     if args.pretrained and not os.path.isfile(args.pretrained):
         print("Error: pretrained model is not a valid file")
         ret = False
+    # check that the segmentations are kept somewhere
+    if args.no_save and not args.track:
+        print("Error: no_save can only be used with track")
+        ret = False
 
     return ret
 
@@ -149,7 +486,9 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
 
     # define command line arguments
-    parser.add_argument("image_folder", help="PATH to folder containing all images to segment using Cellpose")
+    parser.add_argument("image_folder", nargs="+", help="PATH to folder containing all images to segment using "
+                                                        "Cellpose, several folders are segmented one after another "
+                                                        "with the same models")
     parser.add_argument("-g", "--gpu", help="use GPU to run Cellpose", action="store_true")
     parser.add_argument("-s", "--start_z", help="z stack layer to start segmentation on (inclusive)", type=int)
     parser.add_argument("-e", "--end_z", help="z stack layer to finish segmentation on (inclusive)", type=int)
@@ -159,6 +498,17 @@ if __name__ == "__main__":
     parser.add_argument("-sw", "--switch_model", help="model with which to segment images after switch, "
                                                       "if pretrained use 'pretrained'")
     parser.add_argument("-p", "--pretrained", help="PATH to pretrained model", type=pathlib.Path)
+    parser.add_argument("-b", "--batch_size", help="segment the images in batches of this size and save them without "
+                                                   "waiting for manual correction", type=int)
+    parser.add_argument("-r", "--review", help="review the batch segmentations after they are all saved",
+                        action="store_true")
+    parser.add_argument("-d", "--diameter_cache", help="PATH to the .json cache of estimated diameters",
+                        default=DIAMETER_CACHE_NAME)
+    parser.add_argument("-j", "--workers", help="number of processes to segment the images in", type=int, default=1)
+    parser.add_argument("-t", "--track", help="track the segmentations with the CPTracker (main.py) in memory once "
+                                              "they are all segmented", action="store_true")
+    parser.add_argument("-n", "--no_save", help="do not save the segmentations as .npy files, only with --track",
+                        action="store_true")
 
     # parse command line arguments
     args = parser.parse_args()
@@ -170,6 +520,11 @@ if __name__ == "__main__":
     else:
         gpu = False
 
-    # cpmain.main()  # start Cellpose and GUI
+    # from cellpose import __main__ as cpmain; cpmain.main()  # start Cellpose and GUI
 
-    main(args.image_folder, gpu)
\ No newline at end of file
+    # the models are loaded for the first folder and reused for the rest
+    for image_folder in args.image_folder:
+        main(image_folder, gpu, start_z=args.start_z, end_z=args.end_z, switch_z=args.switch_z,
+             start_model=args.start_model or "TN3", switch_model=args.switch_model or "TN2",
+             pretrained=args.pretrained, batch_size=args.batch_size, review=args.review,
+             diameter_cache=args.diameter_cache, workers=args.workers, track=args.track, save=not args.no_save)
@@ -0,0 +1,99 @@
+# Chloe Fugle (chloe.m.fugle.23@dartmouth.edu)
+# 10/19/2026
+# Bio97 Thesis Project
+# Data structure indexing the frames of a dataset by their (t, z) values, used to plan the t and z videos
+
+import re
+import numpy as np
+
+
+class DatasetGrid:
+
+    # frame_ids - list of the frame_ids (txxx_zxxx) in the dataset
+    # t_values - sorted int array of every t value present in the dataset
+    # z_values - sorted int array of every z value present in the dataset
+    # index - 2D int array with a row for each t value and a column for each z value, giving the index in frame_ids
+    #         of the frame at that (t, z), or -1 if the frame is missing
+    # input: frame_id_list - list of frame_ids (or file names) containing txxx_zxxx, where xxx are three integers,
+    #                        names that do not contain txxx_zxxx are ignored
+    def __init__(self, frame_id_list):
+        self.frame_ids = []
+        t_list = []
+        z_list = []
+
+        # parse each name once
+        pattern = re.compile(r't([0-9]{3})_z([0-9]{3})')
+        for name in frame_id_list:
+            match = pattern.search(name)
+            if match:
+                self.frame_ids.append(name)
+                t_list.append(int(match.group(1)))
+                z_list.append(int(match.group(2)))
+
+        t_arr = np.array(t_list, dtype=np.int64)
+        z_arr = np.array(z_list, dtype=np.int64)
+        self.t_values, t_idx = np.unique(t_arr, return_inverse=True)
+        self.z_values, z_idx = np.unique(z_arr, return_inverse=True)
+
+        self.index = np.full((len(self.t_values), len(self.z_values)), -1, dtype=np.int64)
+        self.index[t_idx[::-1], z_idx[::-1]] = np.arange(len(self.frame_ids))[::-1]    # first name wins duplicates
+
+    # returns the frame_id at a given (t, z)
+    # inputs: t - t value of the frame
+    #         z - z value of the frame
+    # output: the frame_id, or None if the frame is not in the dataset
+    def get_frame(self, t, z):
+        t_i = np.searchsorted(self.t_values, t)
+        z_i = np.searchsorted(self.z_values, z)
+        if t_i == len(self.t_values) or self.t_values[t_i] != t or z_i == len(self.z_values) or self.z_values[z_i] != z:
+            return None
+        elif self.index[t_i, z_i] == -1:
+            return None
+        else:
+            return self.frame_ids[self.index[t_i, z_i]]
+
+    # returns the frame_ids of the t (z-constant) video at a given z, in order of t
+    # input: z - the z value of the video
+    # output: list of frame_ids, frames missing at that z are skipped (see missing_frames)
+    def t_video(self, z):
+        z_i = np.searchsorted(self.z_values, z)
+        if z_i == len(self.z_values) or self.z_values[z_i] != z:
+            return []
+
+        column = self.index[:, z_i]
+        return [self.frame_ids[i] for i in column[column >= 0]]
+
+    # returns the frame_ids of the two z (t-constant) videos at a given t, split at a given z
+    # inputs: t - the t value of the videos
+    #         split - the z value to split the z-stack at, included in both videos
+    # output: (upper, lower) - lists of frame_ids with z <= split and z >= split, both in increasing order of z,
+    #         frames missing at that t are skipped (see missing_frames)
+    def z_video(self, t, split):
+        t_i = np.searchsorted(self.t_values, t)
+        if t_i == len(self.t_values) or self.t_values[t_i] != t:
+            return [], []
+
+        row = self.index[t_i]
+        upper = row[(self.z_values <= split) & (row >= 0)]
+        lower = row[(self.z_values >= split) & (row >= 0)]
+        return [self.frame_ids[i] for i in upper], [self.frame_ids[i] for i in lower]
+
+    # returns the (t, z) of frames missing from the dataset, within the range of t and z values that are present
+    # inputs: t - optional, only return missing frames at this t value
+    #         z - optional, only return missing frames at this z value
+    # output: list of (t, z) tuples of the missing frames, in order of t then z
+    def missing_frames(self, t=None, z=None):
+        t_min, t_max = (self.t_values[0], self.t_values[-1]) if len(self.t_values) else (0, -1)
+        z_min, z_max = (self.z_values[0], self.z_values[-1]) if len(self.z_values) else (0, -1)
+        t_range = np.arange(t_min, t_max + 1) if t is None else np.array([t])
+        z_range = np.arange(z_min, z_max + 1) if z is None else np.array([z])
+
+        present = np.zeros((len(t_range), len(z_range)), dtype=bool)
+        t_in = np.isin(t_range, self.t_values)
+        z_in = np.isin(z_range, self.z_values)
+        sub_index = self.index[np.ix_(np.searchsorted(self.t_values, t_range[t_in]),
+                                      np.searchsorted(self.z_values, z_range[z_in]))]
+        present[np.ix_(t_in, z_in)] = sub_index >= 0
+
+        t_missing, z_missing = np.nonzero(~present)
+        return [(int(t_range[i]), int(z_range[j])) for i, j in zip(t_missing, z_missing)]
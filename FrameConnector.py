@@ -3,7 +3,9 @@
 # Bio97 Thesis Project
 # Wrapper class for CPTracker that connects the CPFrames across all frames and videos
 
-import matplotlib.pyplot as plt
+import json
+import os
+import re
 import numpy as np
 
 class FrameConnector:
@@ -54,7 +56,8 @@ class FrameConnector:
             return -2
 
         # fetch given cell coordinates from dictionary and given frame, if applicable
-        if frame:
+        # (len, since the coordinates of a loaded FrameConnector are arrays, see load)
+        if frame is not None and len(frame) > 0:
             ret = frame
         elif cell:
             ret = cell
@@ -77,6 +80,14 @@ class FrameConnector:
 
         return coords_list
 
+    # creates an empty dictionary for every global cell_id up to num_cells that has not been created yet, so cells can
+    # be added out of order of their cell_ids (used when the cell_ids are known before the cells are matched)
+    # input: num_cells - the number of global cell_ids to reserve
+    # output: None
+    def reserve_cells(self, num_cells):
+        while len(self.cell_dict_list) < num_cells:
+            self.cell_dict_list.append({})
+
     # returns the entire cell dictionary list structure
     # inputs: None
     # output: returns the entire cell dictionary list structure
@@ -104,6 +115,168 @@ class FrameConnector:
     def set_first_vid_list(self, first_vid_list):
         self.first_vid_list = first_vid_list
 
+    # yields the outlines stored in the FrameConnector as flat arrays, one record per (cell, frame) pair, in batches of
+    # whole records so large FrameConnectors can be processed with vectorized operations without one huge copy
+    # inputs: batch_rows - approximate number of coordinates per batch, if None all records are returned in one batch
+    # output: generator of (cell_ids, frame_ids, offsets, coords) tuples, where
+    #         cell_ids - int32 array of the global cell id of each record
+    #         frame_ids - list of the frame_id of each record
+    #         offsets - int64 array of length (records + 1), the coordinates of record i are
+    #                   coords[offsets[i]:offsets[i + 1]]
+    #         coords - int32 array of shape (coordinates, 2) containing the (x, y) coordinates of every record
+    def iter_outline_arrays(self, batch_rows=None):
+        cell_ids = []
+        frame_ids = []
+        coords_list = []
+        row_count = 0
+
+        for cell_id in range(len(self.cell_dict_list)):
+            for frame_id, coords in self.cell_dict_list[cell_id].items():
+                coords_arr = np.asarray(coords, dtype=np.int32).reshape(-1, 2)
+                cell_ids.append(cell_id)
+                frame_ids.append(frame_id)
+                coords_list.append(coords_arr)
+                row_count += len(coords_arr)
+
+                if batch_rows and row_count >= batch_rows:
+                    yield outline_batch(cell_ids, frame_ids, coords_list)
+                    cell_ids = []
+                    frame_ids = []
+                    coords_list = []
+                    row_count = 0
+
+        if cell_ids or not batch_rows:
+            yield outline_batch(cell_ids, frame_ids, coords_list)
+
+    # returns every outline stored in the FrameConnector as a single set of flat arrays
+    # inputs: None
+    # output: (cell_ids, frame_ids, offsets, coords), see iter_outline_arrays
+    def get_outline_arrays(self):
+        return next(self.iter_outline_arrays())
+
+    # saves the FrameConnector to a folder of .npy arrays (no pickling), which can be loaded with load()
+    # files: coords.npy - int32 (x, y) coordinates of every cell in every frame, concatenated
+    #        offsets.npy - int64 start of each (cell, frame) record in coords.npy, plus the total length
+    #        records.npy - int64 (cell_id, frame index) of each record, in the order of the cell dictionaries
+    #        frame_ids.npy - unicode array of the frame_ids, indexed by the frame index of each record
+    #        first_vid_list.npy - float64 first video cell centers, NaN where the center is None
+    #        frame_connector.json - number of cells and file format version
+    # input: dir_path - path to the folder to save in, created if it does not exist
+    # output: None
+    def save(self, dir_path):
+        if not os.path.isdir(dir_path):
+            os.makedirs(dir_path)
+        elif os.path.isfile(dir_path + "/frame_connector.json"):     # overwriting a previous save
+            os.remove(dir_path + "/frame_connector.json")
+
+        cell_ids, frame_ids, offsets, coords = self.get_outline_arrays()
+        frame_index = {}
+        for frame_id in frame_ids:
+            if frame_id not in frame_index:
+                frame_index[frame_id] = len(frame_index)
+
+        records = np.zeros((len(frame_ids), 2), dtype=np.int64)
+        records[:, 0] = cell_ids
+        records[:, 1] = [frame_index[frame_id] for frame_id in frame_ids]
+
+        first_vid = np.full((len(self.first_vid_list), 2), np.nan)
+        for i in range(len(self.first_vid_list)):
+            if self.first_vid_list[i] is not None:
+                first_vid[i] = self.first_vid_list[i]
+
+        np.save(dir_path + "/coords.npy", coords)
+        np.save(dir_path + "/offsets.npy", offsets)
+        np.save(dir_path + "/records.npy", records)
+        np.save(dir_path + "/frame_ids.npy", np.array(list(frame_index), dtype=str).reshape(-1))
+        np.save(dir_path + "/first_vid_list.npy", first_vid)
+
+        # written last, so a folder without it is never mistaken for a complete save
+        with open(dir_path + "/frame_connector.json", "w") as fp:
+            json.dump({"version": 1, "num_cells": len(self.cell_dict_list)}, fp)
+
+    # matches the global cell IDs of another FrameConnector to the cell IDs of this one
+    # cells are the same if they have an identical outline in a frame both FrameConnectors contain (ex. the frame at
+    # ZVALUE and TVALUE shared by the time video and a z video), otherwise if their first video cell centers are
+    # within near_cutoff of each other
+    # inputs: other - another FrameConnector
+    #         near_cutoff - inclusive Euclidean distance cutoff for matching first video cell centers
+    # output: id_map - list with the cell_id in this FrameConnector of each cell_id in other, or None if the cell is
+    #                  not present in this FrameConnector
+    def match_cell_ids(self, other, near_cutoff=10):
+        id_map = [None] * len(other.cell_dict_list)
+        used = set()
+
+        # match cells by their outlines in shared frames
+        shared_frames = set()
+        for cell in other.cell_dict_list:
+            shared_frames.update(cell.keys())
+        outline_index = {}      # (frame_id, outline bytes) -> cell_id in this FrameConnector
+        for cell_id in range(len(self.cell_dict_list)):
+            for frame_id, coords in self.cell_dict_list[cell_id].items():
+                if frame_id in shared_frames:
+                    outline_index.setdefault((frame_id, outline_key(coords)), cell_id)
+
+        for other_id in range(len(other.cell_dict_list)):
+            for frame_id, coords in other.cell_dict_list[other_id].items():
+                cell_id = outline_index.get((frame_id, outline_key(coords)))
+                if cell_id is not None and cell_id not in used:
+                    id_map[other_id] = cell_id
+                    used.add(cell_id)
+                    break
+
+        # match the remaining cells by their first video cell centers
+        if self.first_vid_list and other.first_vid_list:
+            self_centers = np.full((len(self.first_vid_list), 2), np.nan)
+            for i in range(len(self.first_vid_list)):
+                if self.first_vid_list[i] is not None:
+                    self_centers[i] = self.first_vid_list[i]
+
+            for other_id in range(min(len(other.cell_dict_list), len(other.first_vid_list))):
+                center = other.first_vid_list[other_id]
+                if id_map[other_id] is not None or center is None:
+                    continue
+                distance = np.hypot(self_centers[:, 0] - center[0], self_centers[:, 1] - center[1])
+                distance[[c for c in used if c < len(distance)]] = np.nan     # cells past the first video list
+                if np.isnan(distance).all():
+                    continue
+                cell_id = int(np.nanargmin(distance))
+                if distance[cell_id] <= near_cutoff:
+                    id_map[other_id] = cell_id
+                    used.add(cell_id)
+
+        return id_map
+
+    # merges another FrameConnector (ex. one built by a separate process from a different video) into this one
+    # global cell IDs are reconciled with match_cell_ids, cells not present in this FrameConnector are added as new
+    # cells, and frames that both FrameConnectors contain for the same cell are kept from this FrameConnector unless
+    # overwrite is True
+    # inputs: other - another FrameConnector
+    #         near_cutoff - inclusive Euclidean distance cutoff for matching first video cell centers
+    #         overwrite - boolean; if True, coordinates from other replace coordinates already in this FrameConnector
+    # output: this FrameConnector, with other merged into it
+    def merge(self, other, near_cutoff=10, overwrite=False):
+        id_map = self.match_cell_ids(other, near_cutoff)
+
+        if not self.first_vid_list:
+            self.first_vid_list = list(other.first_vid_list)
+
+        for other_id in range(len(other.cell_dict_list)):
+            cell_id = id_map[other_id]
+            if cell_id is None:     # cell not in this FrameConnector, add as a new cell
+                cell_id = len(self.cell_dict_list)
+                self.cell_dict_list.append({})
+                if len(self.first_vid_list) == cell_id and other_id < len(other.first_vid_list):
+                    self.first_vid_list.append(other.first_vid_list[other_id])
+            elif cell_id >= len(self.cell_dict_list):     # matched by a first video center with no frames yet
+                self.cell_dict_list.extend({} for _ in range(cell_id + 1 - len(self.cell_dict_list)))
+
+            cell = self.cell_dict_list[cell_id]
+            for frame_id, coords in other.cell_dict_list[other_id].items():
+                if overwrite or frame_id not in cell:
+                    cell[frame_id] = coords
+
+        return self
+
     # prints the FrameConnector dictionaries in a pretty way
     def print_FC(self):
         cell_id = 0
@@ -123,6 +296,7 @@ class FrameConnector:
     # input - array_num - if the cell dictionaries contain multiple values, user can input the desired one
     # output - plot of the cells in the FrameConnector dictionaries
     def plot_cells(self, array_num=None):
+        import matplotlib.pyplot as plt     # only needed to plot, FrameConnector is used without matplotlib
 
         # for each cell in the cell dictionary list
         for i in range(len(self.cell_dict_list)):
@@ -141,6 +315,183 @@ class FrameConnector:
         plt.show()
         plt.cla()
 
+    # returns the coordinates of every cell in the FrameConnector concatenated into single arrays for plotting
+    # input: array_num - if the cell dictionaries contain multiple values, user can input the desired one
+    #        seed - seed for the random color of each cell, defaults to None (different colors every call)
+    # output: points - int array of shape (points, 2) of the (x, y) coordinates of every cell in every frame
+    #         colors - float array of shape (points, 3) of the RGB color (0 to 1) of each point, one color per cell
+    def get_plot_arrays(self, array_num=None, seed=None):
+        if array_num:
+            coords_list = []
+            cell_list = []
+            for i in range(len(self.cell_dict_list)):
+                for frame, coords in self.cell_dict_list[i].items():
+                    coords_arr = np.asarray(coords[array_num], dtype=np.int32).reshape(-1, 2)
+                    coords_list.append(coords_arr)
+                    cell_list.append(np.full(len(coords_arr), i, dtype=np.int32))
+            if coords_list:
+                points = np.concatenate(coords_list)
+                point_cells = np.concatenate(cell_list)
+            else:
+                points = np.zeros((0, 2), dtype=np.int32)
+                point_cells = np.zeros(0, dtype=np.int32)
+        else:
+            cell_ids, frame_ids, offsets, points = self.get_outline_arrays()
+            point_cells = np.repeat(cell_ids, np.diff(offsets))
+
+        cell_colors = np.random.default_rng(seed).random((len(self.cell_dict_list), 3))
+
+        return points, cell_colors[point_cells]
+
+    # plots the cells in the FrameConnector dictionaries offscreen and saves the plot to a file without blocking
+    # all points are drawn at once (one collection per figure) rather than one scatter per cell and frame
+    # each cell is one color
+    # input: file_path - path of the image file to save, the type is given by the extension (ex. .png)
+    #        array_num - if the cell dictionaries contain multiple values, user can input the desired one
+    #        backend - "matplotlib" (default) to save a scatter plot, or "opencv" to rasterize the points directly
+    #                  into an image with one pixel per coordinate, which is much faster for very large point counts
+    #                  note: the opencv image has (0, 0) at the top left, as in the original images
+    #        point_size - marker size of the matplotlib scatter plot
+    #        seed - seed for the random cell colors
+    # output: 0 if the plot was saved, -1 if not
+    def save_plot(self, file_path, array_num=None, backend="matplotlib", point_size=1, seed=None):
+        points, colors = self.get_plot_arrays(array_num, seed=seed)
+
+        if backend == "opencv":
+            import cv2
+
+            in_image = (points[:, 0] >= 0) & (points[:, 1] >= 0)
+            points = points[in_image]
+            colors = colors[in_image]
+            width = int(points[:, 0].max()) + 1 if len(points) > 0 else 1
+            height = int(points[:, 1].max()) + 1 if len(points) > 0 else 1
+
+            image = np.full((height, width, 3), 255, dtype=np.uint8)
+            image[points[:, 1], points[:, 0]] = (colors[:, ::-1] * 255).astype(np.uint8)    # RGB to BGR
+
+            if not cv2.imwrite(file_path, image):
+                print("Error: could not save plot to " + str(file_path))
+                return -1
+
+        elif backend == "matplotlib":
+            from matplotlib.figure import Figure
+
+            fig = Figure()
+            ax = fig.add_subplot()
+            ax.scatter(points[:, 0], points[:, 1], c=colors, s=point_size, linewidths=0)
+            fig.savefig(file_path)
+
+        else:
+            print("Error: plot backend " + str(backend) + " not recognized, must be one of: [matplotlib, opencv]")
+            return -1
+
+        return 0
+
+
+# combines lists of per-record outline information into the flat arrays returned by iter_outline_arrays
+# inputs: cell_ids - list of the global cell id of each record
+#         frame_ids - list of the frame_id of each record
+#         coords_list - list of (n, 2) int32 coordinate arrays, one per record
+# output: (cell_ids, frame_ids, offsets, coords), see FrameConnector.iter_outline_arrays
+def outline_batch(cell_ids, frame_ids, coords_list):
+    offsets = np.zeros(len(coords_list) + 1, dtype=np.int64)
+    if coords_list:
+        offsets[1:] = np.cumsum([len(c) for c in coords_list])
+        coords = np.concatenate(coords_list)
+    else:
+        coords = np.zeros((0, 2), dtype=np.int32)
+
+    return np.asarray(cell_ids, dtype=np.int32), list(frame_ids), offsets, coords
+
+
+# loads a FrameConnector saved with FrameConnector.save()
+# inputs: dir_path - path to the folder the FrameConnector was saved in
+#         mmap - boolean; if True (default), the coordinates are memory-mapped from coords.npy instead of read into
+#                memory, each cell's coordinates are a read-only view into the file
+# output: the loaded FrameConnector, or -1 if the folder does not contain a saved FrameConnector
+def load(dir_path, mmap=True):
+    if not os.path.isfile(dir_path + "/frame_connector.json"):
+        print("Error: could not find a saved FrameConnector in " + str(dir_path))
+        return -1
+
+    with open(dir_path + "/frame_connector.json") as fp:
+        info = json.load(fp)
+
+    coords = np.load(dir_path + "/coords.npy", mmap_mode="r" if mmap else None)
+    offsets = np.load(dir_path + "/offsets.npy")
+    records = np.load(dir_path + "/records.npy")
+    frame_ids = np.load(dir_path + "/frame_ids.npy").tolist()
+    first_vid = np.load(dir_path + "/first_vid_list.npy")
+
+    frame_connector = FrameConnector()
+    frame_connector.cell_dict_list = [{} for _ in range(info["num_cells"])]
+    for i in range(len(records)):
+        frame_connector.cell_dict_list[records[i, 0]][frame_ids[records[i, 1]]] = coords[offsets[i]:offsets[i + 1]]
+
+    first_vid_list = []
+    for center in first_vid:
+        if np.isnan(center).any():
+            first_vid_list.append(None)
+        else:
+            first_vid_list.append((int(center[0]), int(center[1])))
+    frame_connector.set_first_vid_list(first_vid_list)
+
+    return frame_connector
+
+
+# loads and merges FrameConnectors saved by separate processes (ex. one per video) into one FrameConnector
+# inputs: dir_path_list - list of folders containing saved FrameConnectors, merged in the order given
+#         mmap - boolean; if True (default), coordinates are memory-mapped, see load()
+#         near_cutoff - inclusive Euclidean distance cutoff for matching first video cell centers, see merge()
+# output: the merged FrameConnector, or -1 if any folder could not be loaded
+def merge_saved(dir_path_list, mmap=True, near_cutoff=10):
+    frame_connector = FrameConnector()
+    for dir_path in dir_path_list:
+        shard = load(dir_path, mmap=mmap)
+        if shard == -1:
+            return -1
+        frame_connector.merge(shard, near_cutoff=near_cutoff)
+
+    return frame_connector
+
+
+# returns a hashable key of a cell outline, used to find identical outlines in different FrameConnectors
+# input: coords - list or array of the (x, y) coordinates of the cell outline
+# output: bytes of the outline coordinates as int32
+def outline_key(coords):
+    return np.ascontiguousarray(np.asarray(coords, dtype=np.int32).reshape(-1, 2)).tobytes()
+
+
+# extracts the t and z values from a frame_id containing txxx_zxxx, where xxx are three integers
+# input: frame_id - the ID of the video frame (the .npy filename without the file type)
+# output: (t, z) - integers giving the timepoint and z layer of the frame, or (-1, -1) if they could not be extracted
+def parse_frame_id(frame_id):
+    zt = re.search(r't([0-9]{3})_z([0-9]{3})', str(frame_id))
+    if zt:
+        return int(zt.group(1)), int(zt.group(2))
+    else:
+        return -1, -1
+
+
+# extracts the t and z values of a list of frame_ids, parsing each distinct frame_id once
+# inputs: frame_ids - list of frame_ids (e.g. from FrameConnector.iter_outline_arrays)
+#         cache - optional, dictionary of frame_id -> (t, z) shared between calls, so frame_ids repeated across
+#                 batches are not parsed again
+# output: (t_arr, z_arr) - int32 arrays of the t and z value of each frame_id, -1 if they could not be extracted
+#         (see parse_frame_id)
+def frame_tz_arrays(frame_ids, cache=None):
+    if cache is None:
+        cache = {}
+
+    t_arr = np.empty(len(frame_ids), dtype=np.int32)
+    z_arr = np.empty(len(frame_ids), dtype=np.int32)
+    for i in range(len(frame_ids)):
+        if frame_ids[i] not in cache:
+            cache[frame_ids[i]] = parse_frame_id(frame_ids[i])
+        t_arr[i], z_arr[i] = cache[frame_ids[i]]
+
+    return t_arr, z_arr
+
 
 # unit testing
 if __name__ == "__main__":
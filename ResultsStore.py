@@ -0,0 +1,200 @@
+# Chloe Fugle (chloe.m.fugle.23@dartmouth.edu)
+# 10/19/2026
+# Bio97 Thesis Project
+# Indexed binary store of the tracking output (OUTPUT_FORMAT = "store" in main.py), so the outline of a cell at a
+# (t, z) or every cell in a frame can be looked up without reading the whole output
+# The outlines are sorted by (cell, t, z) and concatenated into one int32 coordinate file, with a sorted key and offset
+# index of every (cell, t, z) and a second index of the same records in (t, z, cell) order. Lookups are binary searches
+# (np.searchsorted) of the indexes and reads of the memory-mapped coordinates, so they only touch the records returned
+# files: coords.npy - int32 (x, y) coordinates of every outline, in (cell, t, z) order
+#        keys.npy - int64 (cell, t, z) key of each record (see pack_key), sorted
+#        offsets.npy - int64 start of each record in coords.npy, plus the total length
+#        tz_keys.npy - int64 (t, z) key of each record in (t, z, cell) order, sorted
+#        tz_order.npy - int64 index in keys.npy of each record in (t, z, cell) order
+#        store.json - number of records and coordinates and file format version
+
+import json
+import os
+import numpy as np
+
+from FrameConnector import frame_tz_arrays
+
+STORE_DIR_NAME = "cptracker_store"      # name of the store folder written in the generated folder
+COPY_ROWS = 4000000         # number of coordinates copied into the store at a time
+MAX_TZ = 0xFFFF             # largest t and z value that can be stored
+MAX_CELL = 0x7FFFFFFF       # largest cell that can be stored
+
+
+# packs (cell, t, z) into one sortable integer key, the cell in the upper 32 bits and t and z in 16 bits each
+# inputs: cell, t, z - integers or int arrays
+# output: int64 key, or array of keys
+def pack_key(cell, t, z):
+    return ((np.asarray(cell, dtype=np.int64) << 32) | (np.asarray(t, dtype=np.int64) << 16)
+            | np.asarray(z, dtype=np.int64))
+
+
+# unpacks keys made with pack_key
+# input: keys - int64 array of keys
+# output: (cell, t, z) int32 arrays
+def unpack_key(keys):
+    keys = np.asarray(keys, dtype=np.int64)
+    return (keys >> 32).astype(np.int32), ((keys >> 16) & MAX_TZ).astype(np.int32), (keys & MAX_TZ).astype(np.int32)
+
+
+# writes the outlines of the FrameConnector to an indexed store
+# inputs: frame_connector - filled FrameConnector
+#         dir_path - path to the store folder, created if it does not exist
+# output: 0 if the store was written, -1 if not
+#         note: cells start from 1 (as in the .csv output), outlines that are empty or whose frame_id has no t and z are
+#               not stored
+def write_store(frame_connector, dir_path):
+    cell_ids, frame_ids, offsets, coords = frame_connector.get_outline_arrays()
+
+    t_arr, z_arr = frame_tz_arrays(frame_ids)
+
+    lengths = np.diff(offsets)
+    keep = (lengths > 0) & (t_arr >= 0) & (z_arr >= 0)
+    if ((t_arr > MAX_TZ) | (z_arr > MAX_TZ)).any():
+        print("Error: t and z values must be at most " + str(MAX_TZ) + " to be stored")
+        return -1
+    if not keep.any():
+        print("Error: no outlines to store")
+        return -1
+
+    keys = pack_key(cell_ids.astype(np.int64) + 1, t_arr, z_arr)[keep]
+    starts = offsets[:-1][keep]
+    lengths = lengths[keep]
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    starts = starts[order]
+    lengths = lengths[order]
+
+    store_offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+    store_offsets[1:] = np.cumsum(lengths)
+
+    if not os.path.isdir(dir_path):
+        os.makedirs(dir_path)
+    elif os.path.isfile(dir_path + "/store.json"):     # overwriting a previous store
+        os.remove(dir_path + "/store.json")
+
+    # copy the outlines into the store in sorted order, a block of coordinates at a time
+    store_coords = np.lib.format.open_memmap(dir_path + "/coords.npy", mode="w+", dtype=np.int32,
+                                             shape=(int(store_offsets[-1]), 2))
+    source = np.repeat(starts - store_offsets[:-1], lengths)     # coordinate i of the store is coords[i + source[i]]
+    for a in range(0, len(source), COPY_ROWS):
+        b = min(a + COPY_ROWS, len(source))
+        store_coords[a:b] = coords[np.arange(a, b) + source[a:b]]
+    store_coords.flush()
+    del store_coords
+
+    cell, t, z = unpack_key(keys)
+    tz_keys = (t.astype(np.int64) << 16) | z
+    tz_order = np.argsort(tz_keys, kind="stable")       # records of each (t, z) stay in order of cell
+
+    np.save(dir_path + "/keys.npy", keys)
+    np.save(dir_path + "/offsets.npy", store_offsets)
+    np.save(dir_path + "/tz_keys.npy", tz_keys[tz_order])
+    np.save(dir_path + "/tz_order.npy", tz_order.astype(np.int64))
+
+    # written last, so a folder without it is never mistaken for a complete store
+    with open(dir_path + "/store.json", "w") as fp:
+        json.dump({"version": 1, "records": len(keys), "coordinates": int(store_offsets[-1])}, fp)
+
+    return 0
+
+
+class ResultsStore:
+
+    # dir_path - path to the store folder written by write_store (see load)
+    # keys, offsets, tz_keys, tz_order - the indexes, read into memory
+    # coords - the memory-mapped coordinates
+    def __init__(self, dir_path):
+        self.dir_path = dir_path
+        self.keys = np.load(dir_path + "/keys.npy")
+        self.offsets = np.load(dir_path + "/offsets.npy")
+        self.tz_keys = np.load(dir_path + "/tz_keys.npy")
+        self.tz_order = np.load(dir_path + "/tz_order.npy")
+        self.coords = np.load(dir_path + "/coords.npy", mmap_mode="r")
+
+    # returns the number of (cell, t, z) records in the store
+    def __len__(self):
+        return len(self.keys)
+
+    # returns the outline of a cell at a (t, z)
+    # inputs: cell - the cell (starting from 1, as in the .csv output)
+    #         t, z - the t and z value
+    # output: int32 array of shape (pixels, 2) of the (x, y) outline coordinates, a read-only view into the store, or
+    #         None if the cell is not in the store at that (t, z)
+    def get(self, cell, t, z):
+        # values outside their bit field would be packed into the key of another record
+        if not (0 <= cell <= MAX_CELL and 0 <= t <= MAX_TZ and 0 <= z <= MAX_TZ):
+            return None
+        key = pack_key(cell, t, z)
+        i = np.searchsorted(self.keys, key)
+        if i == len(self.keys) or self.keys[i] != key:
+            return None
+        return self.coords[self.offsets[i]:self.offsets[i + 1]]
+
+    # returns every record of a cell, optionally limited to a range of t values
+    # inputs: cell - the cell (starting from 1)
+    #         t_min, t_max - optional, inclusive range of t values
+    # output: list of (cell, t, z, coords) in order of t and z, see get
+    def get_cell(self, cell, t_min=None, t_max=None):
+        return self.records(np.arange(*self.cell_bounds(cell, t_min, t_max)))
+
+    # returns every cell in a frame, or at every z of a t
+    # inputs: t - the t value
+    #         z - optional, the z value, if None every z at t is returned
+    # output: list of (cell, t, z, coords) in order of z and cell, see get
+    def get_frame(self, t, z=None):
+        if not (0 <= t <= MAX_TZ and (z is None or 0 <= z <= MAX_TZ)):
+            return []
+        lo = np.searchsorted(self.tz_keys, (int(t) << 16) | (0 if z is None else int(z)), side="left")
+        hi = np.searchsorted(self.tz_keys, (int(t) << 16) | (MAX_TZ if z is None else int(z)), side="right")
+        return self.records(self.tz_order[lo:hi])
+
+    # returns the records matching any combination of cell, t, and z, using the index that fits the query
+    # inputs: cell, t, z - optional, the values to match, None matches every value
+    # output: list of (cell, t, z, coords), see get
+    def query(self, cell=None, t=None, z=None):
+        if cell is not None:
+            rows = np.arange(*self.cell_bounds(cell, t, t))
+        elif t is not None:
+            return self.get_frame(t, z)
+        else:
+            rows = self.tz_order
+
+        if z is not None:
+            rows = rows[(self.keys[rows] & MAX_TZ) == z]
+        return self.records(rows)
+
+    # returns the (first, last + 1) rows of the index of a cell, optionally limited to an inclusive range of t values
+    # the range is limited to the t values that can be stored, and is empty for a cell that cannot be stored
+    def cell_bounds(self, cell, t_min=None, t_max=None):
+        t_min = 0 if t_min is None else max(int(t_min), 0)
+        t_max = MAX_TZ if t_max is None else min(int(t_max), MAX_TZ)
+        if not 0 <= cell <= MAX_CELL or t_min > t_max:
+            return 0, 0
+        lo = np.searchsorted(self.keys, pack_key(cell, t_min, 0), side="left")
+        hi = np.searchsorted(self.keys, pack_key(cell, t_max, MAX_TZ), side="right")
+        return lo, hi
+
+    # returns the (cell, t, z, coords) of rows of the index
+    # input: rows - int array of the rows in keys
+    # output: list of (cell, t, z, coords), see get
+    def records(self, rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        cell, t, z = unpack_key(self.keys[rows])
+        return [(int(cell[i]), int(t[i]), int(z[i]), self.coords[self.offsets[rows[i]]:self.offsets[rows[i] + 1]])
+                for i in range(len(rows))]
+
+
+# opens a store written with write_store
+# input: dir_path - path to the store folder
+# output: the ResultsStore, or -1 if the folder does not contain a complete store
+def load(dir_path):
+    if not os.path.isfile(dir_path + "/store.json"):
+        print("Error: could not find a tracking results store in " + str(dir_path))
+        return -1
+
+    return ResultsStore(dir_path)
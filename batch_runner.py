@@ -0,0 +1,211 @@
+# Chloe Fugle (chloe.m.fugle.23@dartmouth.edu)
+# 10/19/2026
+# Bio97 Thesis Project
+# Runs the CPTracker on many datasets from a job file, scheduling the jobs across the local cores
+# Each job runs main.main in its own process with the inputs at the top of main.py set from the job file, in its own
+# workspace folder (generated files, tracking videos, and log), and a status and timing report of every job is written
+# to batch_report.json when the batch is complete
+#
+# example job file (.json):
+# {"max_jobs": 2, "max_cores": 8,
+#  "defaults": {"zvalue": 16, "tvalue": [1, 5, 10], "jump_limit": 20},
+#  "jobs": [{"name": "embryo_01", "folder": "20230324_0010_npys"},
+#           {"name": "embryo_02", "folder": "20230331_0002_npys", "workers": 4}]}
+# run with: python batch_runner.py jobs.json batch_output_folder
+
+import argparse
+import concurrent.futures
+import json
+import os
+import subprocess
+import sys
+import time
+
+REPORT_NAME = "batch_report.json"       # name of the report written to the batch folder
+LOG_NAME = "cptracker.log"              # name of the log of each job, in the job's workspace
+JOB_FILE_NAME = "job.json"              # name of the inputs of each job, in the job's workspace
+
+# job file keys and the main.py inputs they set
+JOB_PARAMS = {"folder": "FOLDER_NAME", "zvalue": "ZVALUE", "tvalue": "TVALUE", "jump_limit": "JUMP_LIMIT",
+              "rand_num": "RANDNUM", "video_fps": "VIDEO_FPS", "tracker_type": "TRACKER_TYPE",
+              "output_format": "OUTPUT_FORMAT", "output_mode": "OUTPUT_MODE", "link_mode": "LINK_MODE",
+              "workers": "WORKERS", "checkpoint": "CHECKPOINT", "resume": "RESUME", "analyze": "ANALYZE",
+              "write_output": "WRITE_OUTPUT", "kinematics": "KINEMATICS",
+              "morphology": "MORPHOLOGY", "voxel_size": "VOXEL_SIZE"}
+
+
+# reads a job file and fills in each job with the default inputs
+# input: job_file - PATH of the .json job file (see the example above)
+# output: (jobs, max_jobs, max_cores) - list of job dictionaries with a unique "name", the maximum number of jobs run
+#         at once, and the maximum number of cores used at once, or -1 if the job file is not valid
+def load_jobs(job_file):
+    if not os.path.isfile(job_file):
+        print("Error: could not find job file " + str(job_file))
+        return -1
+
+    with open(job_file) as fp:
+        batch = json.load(fp)
+
+    defaults = batch.get("defaults", {})
+    jobs = []
+    names = set()
+    for i in range(len(batch.get("jobs", []))):
+        job = dict(defaults)
+        job.update(batch["jobs"][i])
+
+        if "folder" not in job:
+            print("Error: job " + str(i) + " does not have a folder")
+            return -1
+        unknown = [key for key in job if key not in JOB_PARAMS and key != "name"]
+        if unknown:
+            print("Error: job " + str(i) + " has unknown inputs " + str(unknown) + ", must be in "
+                  + str(["name"] + list(JOB_PARAMS)))
+            return -1
+
+        # jobs are named after their folder by default, names must be unique since they name the workspaces
+        if "name" not in job:
+            job["name"] = os.path.basename(os.path.normpath(job["folder"]))
+        if job["name"] in names:
+            job["name"] = job["name"] + "_" + str(i).zfill(3)
+        names.add(job["name"])
+        job["folder"] = os.path.abspath(job["folder"])
+        jobs.append(job)
+
+    max_cores = batch.get("max_cores") or os.cpu_count() or 1
+    max_jobs = batch.get("max_jobs") or max_cores
+
+    return jobs, max_jobs, max_cores
+
+
+# runs the jobs in separate processes, starting the next job (in the order of the job file) whenever fewer than
+# max_jobs jobs are running and its cores fit within max_cores, a job that needs more than max_cores cores is run
+# on its own
+# inputs: jobs - list of job dictionaries (see load_jobs)
+#         batch_dir - PATH of the folder the job workspaces and the report are created in
+#         max_jobs - maximum number of jobs run at once
+#         max_cores - maximum number of cores used at once, each job uses as many cores as its "workers"
+# output: report - dictionary of the status and timing of each job, also saved to batch_report.json in batch_dir
+def run_batch(jobs, batch_dir, max_jobs, max_cores):
+    if not os.path.isdir(batch_dir):
+        os.makedirs(batch_dir)
+
+    batch_start = time.time()
+    results = {}
+    pending = list(jobs)
+    running = {}        # future -> job
+    used_cores = 0
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, max_jobs)) as executor:
+        while pending or running:
+            # start as many of the next jobs as fit
+            while pending and len(running) < max_jobs:
+                cores = job_cores(pending[0])
+                if running and used_cores + cores > max_cores:
+                    break
+                job = pending.pop(0)
+                used_cores += cores
+                print("Starting job " + job["name"] + " (" + str(cores) + " cores)")
+                running[executor.submit(run_job, job, batch_dir + "/" + job["name"])] = job
+
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                job = running.pop(future)
+                used_cores -= job_cores(job)
+                results[job["name"]] = future.result()
+                print("Job " + job["name"] + " " + results[job["name"]]["status"] + " in "
+                      + str(round(results[job["name"]]["seconds"], 1)) + " s")
+
+    report = {"jobs": [results[job["name"]] for job in jobs],
+              "completed": sum(1 for r in results.values() if r["status"] == "completed"),
+              "failed": sum(1 for r in results.values() if r["status"] != "completed"),
+              "seconds": time.time() - batch_start,
+              "max_jobs": max_jobs,
+              "max_cores": max_cores}
+
+    tmp_file = batch_dir + "/" + REPORT_NAME + ".tmp"
+    with open(tmp_file, "w") as fp:
+        json.dump(report, fp, indent=1)
+    os.replace(tmp_file, batch_dir + "/" + REPORT_NAME)
+
+    print_report(report)
+    return report
+
+
+# returns the number of cores a job uses
+def job_cores(job):
+    return max(1, int(job.get("workers", 1)))
+
+
+# runs one job in a separate process, in its workspace, and waits for it to finish
+# inputs: job - job dictionary (see load_jobs)
+#         workspace - PATH of the folder the job's files are generated in
+# output: dictionary of the status ("completed" or "failed"), return code, start and end times, and seconds of the job
+def run_job(job, workspace):
+    if not os.path.isdir(workspace):
+        os.makedirs(workspace)
+    with open(workspace + "/" + JOB_FILE_NAME, "w") as fp:
+        json.dump(job, fp, indent=1)
+
+    start = time.time()
+    with open(workspace + "/" + LOG_NAME, "w") as log:
+        # the job runs with its workspace as the current folder so files written there (e.g. [tracker_type].avi)
+        # are kept separate from the other jobs
+        returncode = subprocess.call([sys.executable, os.path.abspath(__file__), "--run-job", JOB_FILE_NAME],
+                                     cwd=workspace, stdout=log, stderr=subprocess.STDOUT)
+    end = time.time()
+
+    return {"name": job["name"], "folder": job["folder"], "workspace": os.path.abspath(workspace),
+            "status": "completed" if returncode == 0 else "failed", "returncode": returncode,
+            "cores": job_cores(job), "start": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(start)),
+            "end": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(end)), "seconds": end - start,
+            "log": os.path.abspath(workspace + "/" + LOG_NAME)}
+
+
+# sets the inputs at the top of main.py from a job and runs main.main in this process, generating the files in the
+# current folder
+# input: job_file - PATH of the job's .json inputs
+# output: 0 if the job completed, 1 if not
+def run_job_inputs(job_file):
+    import main
+
+    with open(job_file) as fp:
+        job = json.load(fp)
+
+    for key, name in JOB_PARAMS.items():
+        if key in job:
+            setattr(main, name, job[key])
+    main.WORK_DIR = os.path.abspath("output")
+    main.SAVE_PLOTS = True      # no one is there to close the plot windows
+    main.DISPLAY = False
+
+    ret = main.main(resume=main.RESUME, workers=main.WORKERS, link_mode=main.LINK_MODE)
+    return 1 if ret == -1 else 0
+
+
+# prints the status and timing of each job
+def print_report(report):
+    print("\n" + str(report["completed"]) + " jobs completed, " + str(report["failed"]) + " failed in "
+          + str(round(report["seconds"], 1)) + " s")
+    for result in report["jobs"]:
+        print("  " + result["name"].ljust(30) + result["status"].ljust(12) + str(round(result["seconds"], 1)).rjust(10)
+              + " s   " + result["workspace"])
+
+
+# run the batch
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs the CPTracker on every dataset in a job file.")
+    parser.add_argument("job_file", help="PATH of the .json job file")
+    parser.add_argument("batch_dir", nargs="?", default="cptracker_batch",
+                        help="folder the job workspaces and report are created in, defaults to cptracker_batch")
+    parser.add_argument("--run-job", action="store_true", help=argparse.SUPPRESS)     # used for each job's process
+    args = parser.parse_args()
+
+    if args.run_job:
+        sys.exit(run_job_inputs(args.job_file))
+
+    loaded = load_jobs(args.job_file)
+    if loaded == -1:
+        sys.exit(1)
+    jobs, max_jobs, max_cores = loaded
+    report = run_batch(jobs, args.batch_dir, max_jobs, max_cores)
+    sys.exit(1 if report["failed"] else 0)
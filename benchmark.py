@@ -0,0 +1,228 @@
+# Chloe Fugle (chloe.m.fugle.23@dartmouth.edu)
+# 10/19/2026
+# Bio97 Thesis Project
+# Benchmarks each stage of the CPTracker on synthetic datasets (see synthetic_data.py) at several scales, and saves the
+# timings as .json so runs before and after a change can be compared
+# run with: python benchmark.py --scales small medium --output benchmark_new.json --baseline benchmark_old.json
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import synthetic_data
+import dataset_manifest
+import DatasetGrid
+import load_npy
+import frames_to_video
+import tracker
+import match_coords
+import data_analysis
+import main
+from CPFrame import CPFrame
+from FrameConnector import FrameConnector
+
+# synthetic datasets benchmarked, by name (see synthetic_data.generate for the parameters)
+SCALES = {"small": {"t_count": 5, "z_count": 5, "cell_count": 20, "size": (128, 128)},
+          "medium": {"t_count": 10, "z_count": 8, "cell_count": 100, "size": (256, 256)},
+          "large": {"t_count": 20, "z_count": 12, "cell_count": 400, "size": (512, 512)}}
+
+# stages timed, in the order they are run
+STAGES = ["load_npy.load", "CPFrame", "frames_to_video.write_video", "tracker.track", "match_coords.match",
+          "format_output", "analyze_data"]
+
+TRACKER_TYPE = "TrackerCSRT"
+JUMP_LIMIT = 20
+
+
+# runs a function and adds its wall time to the total of a stage
+# inputs: timings - dictionary of stage name -> {"seconds": total seconds, "calls": number of calls}
+#         stage - name of the stage
+#         func - the function to run, followed by its arguments
+#         quiet - boolean; if True (default), the output printed by the function is hidden
+# output: the return value of func
+def timed(timings, stage, func, *args, quiet=True, **kwargs):
+    with open(os.devnull, "w") as devnull, (contextlib.redirect_stdout(devnull) if quiet else contextlib.nullcontext()):
+        start = time.perf_counter()
+        ret = func(*args, **kwargs)
+        seconds = time.perf_counter() - start
+
+    timing = timings.setdefault(stage, {"seconds": 0.0, "calls": 0})
+    timing["seconds"] += seconds
+    timing["calls"] += 1
+    return ret
+
+
+# runs every stage of the CPTracker once on a dataset: the t video at the middle z value and the two z videos at the
+# first t value are loaded, tracked, and matched, then the output is written and analyzed
+# inputs: folder_name - PATH of the folder containing the .npys
+#         work_dir - PATH of the folder to write the .pngs, videos, and output to
+# output: timings - dictionary of stage name -> {"seconds": total seconds, "calls": number of calls}
+def run_pipeline(folder_name, work_dir):
+    timings = {}
+    if not os.path.isdir(work_dir):
+        os.makedirs(work_dir)
+
+    manifest = dataset_manifest.build_manifest(folder_name)
+    grid = DatasetGrid.DatasetGrid(list(manifest))
+    z_value = int(grid.z_values[len(grid.z_values) // 2])
+    t_value = int(grid.t_values[0])
+    upper, lower = grid.z_video(t_value, z_value)
+
+    frame_connector = FrameConnector()
+    for v, video in enumerate([grid.t_video(z_value), upper[::-1], lower]):
+        png_list = []
+        cpframe_list = []
+        for frame_id in video:
+            png, cpframe = timed(timings, "load_npy.load", load_npy.load, manifest[frame_id],
+                                 png_name=work_dir + "/" + frame_id + ".npy.png", frame_id=frame_id)
+            png_list.append(png)
+            cpframe_list.append(cpframe)
+
+            # construction of the CPFrame alone, from the outlines already extracted from the masks
+            timed(timings, "CPFrame", CPFrame, cpframe.get_outlines_list(), cpframe.size, frame_id)
+
+        video_file_path = work_dir + "/benchmark_video_" + str(v) + ".mp4"
+        timed(timings, "frames_to_video.write_video", frames_to_video.write_video, video_file_path, png_list, 4)
+        coords_list = timed(timings, "tracker.track", tracker.track, video_file_path, len(cpframe_list), TRACKER_TYPE,
+                            cpframe_list[0], JUMP_LIMIT, display=False,
+                            output_path=work_dir + "/benchmark_video_" + str(v) + ".avi")
+
+        if v == 0:
+            frame_connector.set_first_vid_list([x[0] for x in coords_list if x])
+        timed(timings, "match_coords.match", match_coords.match, cpframe_list, frame_connector, coords_list)
+
+    timed(timings, "format_output", main.format_output, frame_connector, work_dir)
+
+    data_analysis.TVALUE = [t_value]
+    timed(timings, "analyze_data", data_analysis.analyze_data, work_dir + "/cptracker_output.csv",
+          work_dir + "/cptracker_summary.csv")
+
+    return timings
+
+
+# generates the dataset of each scale and runs the pipeline on it, keeping the fastest of the repeats of each stage
+# inputs: scales - list of the names of the scales to run (see SCALES)
+#         repeat - number of times the pipeline is run on each dataset, defaults to 3
+#         work_dir - optional, PATH of the folder the datasets are generated in, defaults to a temporary folder that
+#                    is removed when the benchmark is complete
+# output: results - dictionary of the parameters and stage timings of each scale (see save_results)
+def run_benchmark(scales, repeat=3, work_dir=None):
+    remove = work_dir is None
+    if work_dir is None:
+        work_dir = tempfile.mkdtemp(prefix="cptracker_benchmark_")
+
+    results = {"version": 1, "date": time.strftime("%Y-%m-%d %H:%M:%S"), "python": platform.python_version(),
+               "platform": platform.platform(), "cpu_count": os.cpu_count(), "repeat": repeat, "scales": {}}
+    try:
+        for scale in scales:
+            params = SCALES[scale]
+            folder_name = work_dir + "/" + scale
+            print("Generating " + scale + " dataset " + str(params) + "...")
+            start = time.perf_counter()
+            synthetic_data.generate(folder_name, params["t_count"], params["z_count"], params["cell_count"],
+                                    size=params["size"], seed=0, prefix=scale)
+            generate_seconds = time.perf_counter() - start
+
+            stages = {}
+            for r in range(repeat):
+                timings = run_pipeline(folder_name, folder_name + "/__benchmark_" + str(r) + "__")
+                for stage, timing in timings.items():
+                    if stage not in stages or timing["seconds"] < stages[stage]["seconds"]:
+                        stages[stage] = timing
+            for timing in stages.values():
+                timing["per_call"] = timing["seconds"] / timing["calls"]
+
+            results["scales"][scale] = {"params": {k: list(v) if isinstance(v, tuple) else v for k, v in params.items()},
+                                        "generate_seconds": generate_seconds, "stages": stages,
+                                        "total_seconds": sum(t["seconds"] for t in stages.values())}
+            print_scale(scale, results["scales"][scale])
+    finally:
+        if remove:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    return results
+
+
+# saves benchmark results as .json
+# inputs: results - dictionary from run_benchmark, with the stage timings of each scale in
+#                   results["scales"][scale]["stages"][stage] = {"seconds", "calls", "per_call"}
+#         file_path - PATH of the .json file
+# output: None
+def save_results(results, file_path):
+    with open(file_path, "w") as fp:
+        json.dump(results, fp, indent=1)
+
+
+# compares benchmark results to the results of a previous run, printing the ratio of the time of each stage
+# inputs: results - dictionary from run_benchmark
+#         baseline - dictionary from a previous run_benchmark (see save_results)
+#         threshold - fraction a stage can be slower than the baseline before it is reported as a regression,
+#                     defaults to 0.2 (20% slower)
+# output: regressions - list of (scale, stage, ratio) of the stages slower than the baseline by more than threshold
+def compare_results(results, baseline, threshold=0.2):
+    regressions = []
+    for scale, result in results["scales"].items():
+        if scale not in baseline.get("scales", {}):
+            continue
+        if baseline["scales"][scale]["params"] != result["params"]:
+            print("Warning: the " + scale + " dataset has different parameters in the baseline, not compared")
+            continue
+
+        print("\n" + scale + " (new / baseline)")
+        for stage in STAGES:
+            old = baseline["scales"][scale]["stages"].get(stage)
+            new = result["stages"].get(stage)
+            if not old or not new or old["seconds"] <= 0:
+                continue
+            ratio = new["seconds"] / old["seconds"]
+            flag = ""
+            if ratio > 1 + threshold:
+                flag = "  REGRESSION"
+                regressions.append((scale, stage, ratio))
+            print("  " + stage.ljust(30) + str(round(new["seconds"], 3)).rjust(10) + " s"
+                  + str(round(old["seconds"], 3)).rjust(10) + " s" + ("x" + str(round(ratio, 2))).rjust(8) + flag)
+
+    return regressions
+
+
+# prints the stage timings of one scale
+def print_scale(scale, result):
+    print("\n" + scale + ": " + str(round(result["total_seconds"], 3)) + " s")
+    for stage in STAGES:
+        if stage in result["stages"]:
+            timing = result["stages"][stage]
+            print("  " + stage.ljust(30) + str(round(timing["seconds"], 3)).rjust(10) + " s"
+                  + str(timing["calls"]).rjust(6) + " calls" + str(round(1000 * timing["per_call"], 2)).rjust(10)
+                  + " ms/call")
+
+
+# run the benchmark
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the CPTracker stages on synthetic datasets.")
+    parser.add_argument("--scales", nargs="+", default=["small", "medium"], choices=list(SCALES),
+                        help="datasets to benchmark, defaults to small and medium")
+    parser.add_argument("--repeat", type=int, default=3, help="number of runs of each dataset, the fastest is kept")
+    parser.add_argument("--output", default="benchmark_results.json", help=".json file to save the results to")
+    parser.add_argument("--baseline", help="optional, .json results of a previous run to compare to")
+    parser.add_argument("--threshold", type=float, default=0.2, help="slowdown reported as a regression")
+    parser.add_argument("--work-dir", help="optional, folder to generate the datasets in (kept after the run)")
+    args = parser.parse_args()
+
+    np.random.seed(0)       # trackers are colored randomly
+    bench_results = run_benchmark(args.scales, repeat=args.repeat, work_dir=args.work_dir)
+    save_results(bench_results, args.output)
+    print("\nResults saved to " + args.output)
+
+    if args.baseline:
+        with open(args.baseline) as fp:
+            found = compare_results(bench_results, json.load(fp), threshold=args.threshold)
+        if found:
+            print("\n" + str(len(found)) + " stages slower than the baseline")
+            raise SystemExit(1)
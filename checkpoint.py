@@ -0,0 +1,106 @@
+# Chloe Fugle (chloe.m.fugle.23@dartmouth.edu)
+# 10/19/2026
+# Bio97 Thesis Project
+# Per-video checkpoints of the FrameConnector state, so that an interrupted CPTracker run can be
+# resumed from the first incomplete video
+
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+
+import FrameConnector
+
+CHECKPOINT_DIR_NAME = "__checkpoints__"     # name of the checkpoint folder in the generated CPTracker folder
+STATE_FILE = "checkpoint.json"      # name of the file recording the completed videos in the checkpoint folder
+
+
+# creates a fingerprint of the dataset from the name, size, and modification time of each file, so that a checkpoint
+# is not resumed on a dataset that has changed
+# input: file_list - list of PATHs to the .npy files in the dataset
+# output: hexadecimal string fingerprint of the dataset
+def dataset_fingerprint(file_list):
+    sha = hashlib.sha1()
+    for file_path in sorted(file_list):
+        stat = os.stat(file_path)
+        sha.update((os.path.basename(file_path) + "," + str(stat.st_size) + "," + str(stat.st_mtime_ns) + "\n").encode())
+
+    return sha.hexdigest()
+
+
+# creates a fingerprint of a dataset of segmentations held in memory (see main.main), from the frame_id and masks of each
+# frame, so that a checkpoint is not resumed on different segmentations
+# input: manifest - dictionary mapping each frame_id to its segmentation dictionary (see load_npy.read_seg)
+# output: hexadecimal string fingerprint of the dataset
+def segmentation_fingerprint(manifest):
+    sha = hashlib.sha1()
+    for frame_id in sorted(manifest):
+        masks = np.ascontiguousarray(manifest[frame_id]["masks"])
+        sha.update((frame_id + "," + str(masks.shape) + "," + str(masks.dtype) + "\n").encode())
+        sha.update(masks.tobytes())
+
+    return sha.hexdigest()
+
+
+# records that a video has been completed, saving the FrameConnector state after that video
+# the FrameConnector is saved to a new folder before the state file is (atomically) replaced, so an interruption at
+# any point leaves the previous checkpoint intact
+# inputs: checkpoint_dir - folder to save checkpoints in, created if it does not exist
+#         video_index - index of the completed video in the list of videos
+#         frame_connector - FrameConnector after the completed video
+#         fingerprint - dataset fingerprint from dataset_fingerprint
+#         params - dictionary of the parameters of the run (must be .json serializable)
+#         completed - list of the indexes of all videos completed before this one
+# output: updated list of completed video indexes
+def write_checkpoint(checkpoint_dir, video_index, frame_connector, fingerprint, params, completed):
+    if not os.path.isdir(checkpoint_dir):
+        os.makedirs(checkpoint_dir)
+
+    fc_name = "frame_connector_" + str(video_index).zfill(3)
+    frame_connector.save(checkpoint_dir + "/" + fc_name)
+
+    completed = sorted(set(completed) | {video_index})
+    state = {"fingerprint": fingerprint, "params": params, "completed": completed, "frame_connector": fc_name}
+    tmp_path = checkpoint_dir + "/" + STATE_FILE + ".tmp"
+    with open(tmp_path, "w") as fp:
+        json.dump(state, fp)
+    os.replace(tmp_path, checkpoint_dir + "/" + STATE_FILE)
+
+    # remove FrameConnector states from earlier videos
+    for filename in os.scandir(checkpoint_dir):
+        if filename.is_dir() and filename.name.startswith("frame_connector_") and filename.name != fc_name:
+            shutil.rmtree(filename.path)
+
+    return completed
+
+
+# loads the latest checkpoint, checking that it was made from the same dataset with the same parameters
+# inputs: checkpoint_dir - folder the checkpoints were saved in
+#         fingerprint - dataset fingerprint of the current dataset
+#         params - dictionary of the parameters of the current run
+# output: (frame_connector, completed) - the FrameConnector after the last completed video and the list of completed
+#         video indexes, (None, []) if there is no checkpoint, or -1 if the checkpoint does not match the dataset or
+#         parameters
+def load_checkpoint(checkpoint_dir, fingerprint, params):
+    state_path = checkpoint_dir + "/" + STATE_FILE
+    if not os.path.isfile(state_path):
+        return None, []
+
+    with open(state_path) as fp:
+        state = json.load(fp)
+
+    if state["fingerprint"] != fingerprint:
+        print("Error: the dataset has changed since the checkpoint was made, cannot resume")
+        return -1
+    # compare through .json so tuples and lists are treated the same
+    if state["params"] != json.loads(json.dumps(params)):
+        print("Error: the parameters have changed since the checkpoint was made, cannot resume")
+        return -1
+
+    # read into memory rather than memory-mapped, as older checkpoint folders are removed as the run continues
+    frame_connector = FrameConnector.load(checkpoint_dir + "/" + state["frame_connector"], mmap=False)
+    if frame_connector == -1:
+        return -1
+
+    return frame_connector, state["completed"]
@@ -2,22 +2,35 @@
 # 4/15/2023
 # Bio97 Thesis Project
 # Analyzes .csv output from CPTracker
+# pandas is imported in the functions that use it, so main.py and the worker processes only load it when analyzing
 
-import pandas as pd
 import numpy as np
+import concurrent.futures
+import io
 import os
 
+import FrameConnector
+
 ########################################################################################################################
 FILE_PATH = "20230324_0010_npys/__CPTracker_folder__/cptracker_output_run1.csv"      # PATH to .csv outputted from CPTracker
 OUTPUT_PATH = "20230324_0010_npys/__CPTracker_folder__/cptracker_summary.csv"   # PATH to desired output file
 TVALUE = [1, 5, 10, 15, 20, 25, 27]         # list of t-values of interest for z-tracking (likely same as from CPTracker)
+CHUNKED = False         # if True, the .csv is read in chunks so files larger than memory can be analyzed
+WORKERS = 1             # number of processes to read the chunks in when CHUNKED is True
 
 ########################################################################################################################
 
 # get the minimum and maximum t that was tracked as well as the range of z values tracked for each t
-# input:
-# output:
-def analyze_data(file_path, output_path):
+# inputs: file_path - PATH to the .csv outputted from CPTracker (columns cell, x, y, z, t without a header)
+#         output_path - PATH to the summary file, each line is "cell, t_min, t_max, t:z range, t:z range, ..." with the
+#                       z range (z max - z min) of the cell at each of the t values of interest it was tracked at
+#         tvalues - optional, list of the t values of interest, defaults to TVALUE
+# output: 0 if the summary was written, -1 if not
+def analyze_data(file_path, output_path, tvalues=None):
+    import pandas as pd
+
+    if tvalues is None:
+        tvalues = TVALUE
 
     # check that provided path exists and is a .csv file
     if not os.path.isfile(file_path):
@@ -27,78 +40,224 @@ def analyze_data(file_path, output_path):
         print("Error: file" + str(file_path) + "is not of form .csv")
         return -1
 
-    # open file for writing
-    # if os.path.exists(output_path) or os.path.isfile(output_path):
-    #     print("Error: ouput file already exists! Please rename the file or change the desired path to "
-    #           "avoid rewriting the file")
-    #     return -1
-    fp = open(output_path, "w")
+    # process the data
+    try:
+        data_df = pd.read_csv(file_path, names=["cell", "x", "y", "z", "t"], usecols=["cell", "z", "t"])
+        t_range, z_range = summarize(aggregate(data_df), tvalues)
+    except (ValueError, KeyError, TypeError):
+        print("Error: unable to read file. Please check that it is the output from CPTracker")
+        return -1
+
+    # output summary data as file
+    return write_summary(t_range, z_range, output_path)
 
-    data_df = pd.read_csv(file_path, names=["cell", "x", "y", "z", "t"])
 
-    # process the data
+# computes the same summary as analyze_data directly from a FrameConnector, without writing and reading the .csv
+# inputs: frame_connector - filled FrameConnector
+#         tvalues - optional, list of the t values of interest, defaults to TVALUE
+#         output_path - optional, PATH to write the summary file to (see analyze_data)
+# output: t_range - DataFrame indexed by cell (starting from 1, as in the .csv), with columns t_min and t_max
+#         z_range - Series indexed by (cell, t) of the z range (z max - z min) at the t values of interest
+#         or -1 if the summary could not be written
+def analyze_frame_connector(frame_connector, tvalues=None, output_path=None):
+    import pandas as pd
+
+    if tvalues is None:
+        tvalues = TVALUE
+
+    # parse the (t, z) of each frame_id once
+    frame_pos = {}      # frame_id -> index in frame_t and frame_z
+    frame_t = []
+    frame_z = []
+    cell_list = []
+    frame_list = []
+    cell_dict_list = frame_connector.get_dict_list()
+    for i in range(len(cell_dict_list)):
+        for frame_id, coords in cell_dict_list[i].items():
+            if len(coords) == 0:        # empty outlines have no rows in the .csv
+                continue
+            if frame_id not in frame_pos:
+                t, z = FrameConnector.parse_frame_id(frame_id)
+                frame_pos[frame_id] = len(frame_t)
+                frame_t.append(t)
+                frame_z.append(z)
+            cell_list.append(i + 1)
+            frame_list.append(frame_pos[frame_id])
+
+    frame_list = np.asarray(frame_list, dtype=np.int64)
+    data_df = pd.DataFrame({"cell": np.asarray(cell_list, dtype=np.int32),
+                            "z": np.asarray(frame_z, dtype=np.int32)[frame_list] if len(frame_list) else
+                            np.zeros(0, dtype=np.int32),
+                            "t": np.asarray(frame_t, dtype=np.int32)[frame_list] if len(frame_list) else
+                            np.zeros(0, dtype=np.int32)})
+    t_range, z_range = summarize(aggregate(data_df), tvalues)
+
+    if output_path is not None and write_summary(t_range, z_range, output_path) == -1:
+        return -1
+
+    return t_range, z_range
+
+
+# same summary as analyze_data, but reads the .csv in chunks of compact (int32) columns and keeps only the running
+# (cell, t) aggregates, so the memory used depends on the number of (cell, t) pairs rather than the size of the file
+# inputs: file_path, output_path, tvalues - see analyze_data
+#         chunk_bytes - approximate size of each chunk read, defaults to 256 MB
+#         workers - number of processes to read the chunks in, defaults to 1 (the file is split into one byte range per
+#                   worker, each read in chunks)
+# output: 0 if the summary was written, -1 if not
+def analyze_data_chunked(file_path, output_path, tvalues=None, chunk_bytes=2**28, workers=1):
+    if tvalues is None:
+        tvalues = TVALUE
+
+    # check that provided path exists and is a .csv file
+    if not os.path.isfile(file_path):
+        print("Error: file" + str(file_path) + "could not be found")
+        return -1
+    elif os.path.splitext(file_path)[1] != ".csv":
+        print("Error: file" + str(file_path) + "is not of form .csv")
+        return -1
+
+    ranges = split_lines(file_path, max(workers, 1))
     try:
-        # get the minimum and maximum t for each cell
-        t_max = data_df.loc[data_df.groupby('cell')['t'].idxmax()]
-        t_max_name = t_max[["cell", "t"]]
-        t_max_name.columns = ["cell", "t_max"]
-
-        t_min = data_df.loc[data_df.groupby('cell')['t'].idxmin()]
-        t_min_name = t_min[["cell", "t"]]
-        t_min_name.columns = ["cell", "t_min"]
-
-        t_merge = pd.merge(t_min_name, t_max_name, on='cell')
-
-        # get z range (z max - z min) for each timepoint
-        z_t_group = data_df[data_df['t'].isin(TVALUE)]
-        min_z = z_t_group.loc[z_t_group.groupby(['cell', 't'])['z'].idxmin()]
-        z_min_name = min_z[["cell", "z", "t"]]
-        z_min_name.columns = ["cell", "z_min", "t"]
-
-        z_t_group = data_df[data_df['t'].isin(TVALUE)]
-        max_z = z_t_group.loc[z_t_group.groupby(['cell', 't'])['z'].idxmax()]
-        z_max_name = max_z[["cell", "z", "t"]]
-        z_max_name.columns = ["cell", "z_max", "t"]
-
-        min_max_merge = pd.merge(z_min_name, z_max_name, on=['t', 'cell'])
-        min_max_merge['diff'] = min_max_merge['z_max'] - min_max_merge['z_min']
-        print(min_max_merge)
-        z_min_max = min_max_merge[['cell', 't', 'diff']]
-
-    except:
+        if workers > 1 and len(ranges) > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+                partials = list(executor.map(aggregate_byte_range, [file_path] * len(ranges),
+                                             [start for start, end in ranges], [end for start, end in ranges],
+                                             [chunk_bytes] * len(ranges)))
+        else:
+            partials = [aggregate_byte_range(file_path, start, end, chunk_bytes) for start, end in ranges]
+        t_range, z_range = summarize(merge_aggregates(partials), tvalues)
+    except (ValueError, KeyError, TypeError):
         print("Error: unable to read file. Please check that it is the output from CPTracker")
+        return -1
+
+    return write_summary(t_range, z_range, output_path)
+
+
+# splits a file into byte ranges that start and end at the start of a line
+# inputs: file_path - PATH to the file
+#         parts - number of ranges
+# output: list of (start, end) byte offsets, without empty ranges
+def split_lines(file_path, parts):
+    size = os.path.getsize(file_path)
+    offsets = [0]
+    with open(file_path, "rb") as fp:
+        for i in range(1, parts):
+            fp.seek(max(size * i // parts, offsets[-1]))
+            if fp.tell() > 0:
+                fp.seek(fp.tell() - 1)
+                fp.readline()       # move to the start of the next line
+            offsets.append(min(fp.tell(), size))
+    offsets.append(size)
+
+    return [(offsets[i], offsets[i + 1]) for i in range(parts) if offsets[i + 1] > offsets[i]]
+
+
+# aggregates the rows of a byte range of the CPTracker output by cell and t, reading chunks of about chunk_bytes
+# inputs: file_path - PATH to the .csv
+#         start, end - byte offsets of the range, at the start of a line (see split_lines)
+#         chunk_bytes - approximate size of each chunk read
+# output: DataFrame indexed by (cell, t) with columns z_min and z_max (see aggregate)
+def aggregate_byte_range(file_path, start, end, chunk_bytes):
+    import pandas as pd
+
+    partials = []       # aggregates of the chunks, merged every 16 chunks to keep the memory bounded
+    with open(file_path, "rb") as fp:
+        fp.seek(start)
+        position = start
+        rest = b""
+        while position < end:
+            block = fp.read(min(chunk_bytes, end - position))
+            if not block:
+                break
+            position += len(block)
+
+            # only parse whole lines, the rest is parsed with the next chunk
+            block = rest + block
+            cut = block.rfind(b"\n") + 1 if position < end else len(block)
+            block, rest = block[:cut], block[cut:]
+            if not block.strip():
+                continue
+
+            chunk_df = pd.read_csv(io.BytesIO(block), names=["cell", "x", "y", "z", "t"], usecols=["cell", "z", "t"],
+                                   dtype=np.int32)
+            partials.append(aggregate(chunk_df))
+            if len(partials) >= 16:
+                partials = [merge_aggregates(partials)]
 
-    else:       # output summary data as file
+    if not partials:        # empty range
+        return aggregate(pd.DataFrame({"cell": [], "z": [], "t": []}, dtype=np.int32))
+    return merge_aggregates(partials)
 
-        print(z_min_max)
-        print(t_merge)
-        # get list of all cell ids
-        d_cell_list = np.concatenate((pd.Series.unique(t_merge['cell']), pd.Series.unique(z_min_max['cell'])))
-        cell_list = np.unique(d_cell_list)
 
-        for cell in cell_list:
-            cell_z = z_min_max[z_min_max['cell'] == cell]
-            cell_t = t_merge[t_merge['cell'] == cell]
+# merges (cell, t) aggregates of different parts of the CPTracker output
+# input: partials - list of DataFrames indexed by (cell, t) with columns z_min and z_max (see aggregate)
+# output: DataFrame indexed by (cell, t), sorted, with the z_min and z_max over every part
+def merge_aggregates(partials):
+    import pandas as pd
 
-            # get the range of the cell over z for each t
-            t_string = ""
-            for t in np.unique(cell_z['t']):
-                diff = cell_z[cell_z['t'] == t]['diff'].to_string().split()[1]
-                t_string += (str(t) + ":" + str(diff) + ", ")
-            t_string = t_string[:-2]
+    if len(partials) == 1:
+        return partials[0]
+    return pd.concat(partials).groupby(level=["cell", "t"], sort=True).agg({"z_min": "min", "z_max": "max"})
 
-            # get the range over t
-            t_min = cell_t['t_min'].to_string().split()[1]
-            t_max = cell_t['t_max'].to_string().split()[1]
 
-            fp.write(str(cell) + ", " + str(t_min) + ", " + str(t_max) + ", " + t_string + "\n")
+# aggregates the rows of the CPTracker output by cell and t
+# input: data_df - DataFrame with integer columns cell, z, and t (one row per outline pixel)
+# output: DataFrame indexed by (cell, t), sorted, with columns z_min and z_max
+def aggregate(data_df):
+    return data_df.groupby(["cell", "t"], sort=True)["z"].agg(z_min="min", z_max="max")
+
+
+# computes the summary of each cell from the (cell, t) aggregates
+# inputs: cell_t_df - DataFrame indexed by (cell, t) with columns z_min and z_max (see aggregate)
+#         tvalues - list of the t values of interest
+# output: t_range - DataFrame indexed by cell, sorted, with columns t_min and t_max
+#         z_range - Series indexed by (cell, t), sorted, of the z range (z max - z min) at the t values of interest
+def summarize(cell_t_df, tvalues):
+    import pandas as pd
+
+    t_index = cell_t_df.index.get_level_values("t")
+    t_range = pd.Series(t_index, index=cell_t_df.index.get_level_values("cell")).groupby(level=0, sort=True)
+    t_range = t_range.agg(t_min="min", t_max="max")
+
+    z_df = cell_t_df[t_index.isin(tvalues)]
+    z_range = z_df["z_max"] - z_df["z_min"]
+
+    return t_range, z_range
+
+
+# writes the summary of each cell to a file in one write
+# inputs: t_range - DataFrame indexed by cell with columns t_min and t_max (see summarize)
+#         z_range - Series indexed by (cell, t) of the z range at the t values of interest (see summarize)
+#         output_path - PATH to the summary file (see analyze_data)
+# output: 0 if the summary was written, -1 if not
+def write_summary(t_range, z_range, output_path):
+    # "t:z range, t:z range, ..." for each cell with z ranges, the rows of each cell are consecutive (sorted by cell)
+    z_cells = z_range.index.get_level_values("cell").to_numpy()
+    entries = np.char.add(np.char.add(z_range.index.get_level_values("t").to_numpy().astype(str), ":"),
+                          z_range.to_numpy().astype(str))
+    z_cell_ids, z_starts = np.unique(z_cells, return_index=True)
+    t_strings = dict(zip(z_cell_ids.tolist(), [", ".join(group) for group in np.split(entries, z_starts[1:])]))
+
+    lines = [str(cell) + ", " + str(t_min) + ", " + str(t_max) + ", " + t_strings.get(cell, "") + "\n"
+             for cell, t_min, t_max in zip(t_range.index.tolist(), t_range["t_min"].tolist(),
+                                           t_range["t_max"].tolist())]
+
+    try:
+        with open(output_path, "w") as fp:
+            fp.write("".join(lines))
+    except OSError:
+        print("Error: could not write to file " + str(output_path))
+        return -1
 
-    finally:
-        fp.close()
+    return 0
 
 
 # run the analysis
 if __name__ == "__main__":
-    analyze_data(FILE_PATH, OUTPUT_PATH)
+    if CHUNKED:
+        analyze_data_chunked(FILE_PATH, OUTPUT_PATH, workers=WORKERS)
+    else:
+        analyze_data(FILE_PATH, OUTPUT_PATH)
 
 
@@ -0,0 +1,72 @@
+# Chloe Fugle (chloe.m.fugle.23@dartmouth.edu)
+# 10/19/2026
+# Bio97 Thesis Project
+# Dataset manifest mapping the (t, z) frame_id of every .npy file in a folder to its PATH, so the .npy files can be
+# used in place without copying them to correctly-named files
+
+import json
+import os
+import re
+
+MANIFEST_NAME = "cptracker_manifest.json"       # name of the manifest file saved in the dataset folder
+
+
+# creates the frame_id of a frame from its t and z values
+# inputs: t - t value (timepoint) of the frame
+#         z - z value (layer) of the frame
+# output: frame_id in form txxx_zxxx, where xxx are three integers
+def frame_id(t, z):
+    return "t" + str(t).zfill(3) + "_z" + str(z).zfill(3)
+
+
+# scans a folder once and maps the txxx_zxxx name of each .npy file to its PATH
+# note: if more than one file has the same txxx_zxxx name, the first file (in alphabetical order) is used
+# inputs: folder_name - PATH to the folder containing the .npy files
+#         verbose - boolean; if True (default), prints an error for each .npy file that is not named correctly
+# output: manifest - dictionary mapping each frame_id (txxx_zxxx) to the PATH of its .npy file, sorted by frame_id
+def build_manifest(folder_name, verbose=True):
+    manifest = {}
+
+    for filename in sorted(os.scandir(folder_name), key=lambda f: f.name):
+        if filename.is_file() and os.path.splitext(filename)[1] == ".npy":      # if the file is a .npy
+            match = re.search(r't[0-9]{3}_z[0-9]{3}', filename.name)
+            if match and match.group(0) not in manifest:
+                manifest[match.group(0)] = filename.path
+            elif not verbose:
+                continue
+            elif match:
+                print("Error: file name " + filename.path + " has the same txxx_zxxx as "
+                      + manifest[match.group(0)] + ", it will not be used")
+            else:
+                print("Error: file name " + filename.path + " not formatted correctly")
+                print("Please include txxx_zxxx in the filename, where xxx are three integers,\n"
+                      "with txxx representing the t_value of the frame and zxxx representing the z-value of the frame")
+
+    return dict(sorted(manifest.items()))
+
+
+# saves a manifest as a .json file, with the PATHs stored relative to the folder the manifest is saved in
+# inputs: manifest - dictionary mapping each frame_id to the PATH of its .npy file
+#         file_path - PATH of the .json file to save
+# output: None
+def save_manifest(manifest, file_path):
+    folder = os.path.dirname(os.path.abspath(file_path))
+    frames = {f: os.path.relpath(os.path.abspath(path), folder) for f, path in manifest.items()}
+
+    with open(file_path, "w") as fp:
+        json.dump({"version": 1, "frames": frames}, fp, indent=1)
+
+
+# loads a manifest saved with save_manifest
+# input: file_path - PATH of the .json file
+# output: manifest - dictionary mapping each frame_id to the PATH of its .npy file, or -1 if the file does not exist
+def load_manifest(file_path):
+    if not os.path.isfile(file_path):
+        print("Error: could not find manifest " + str(file_path))
+        return -1
+
+    folder = os.path.dirname(file_path)
+    with open(file_path) as fp:
+        frames = json.load(fp)["frames"]
+
+    return {f: os.path.join(folder, path) for f, path in frames.items()}
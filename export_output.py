@@ -0,0 +1,198 @@
+# Chloe Fugle (chloe.m.fugle.23@dartmouth.edu)
+# 10/19/2026
+# Bio97 Thesis Project
+# Exports the FrameConnector in vectorized batches as an alternative to the per-pixel .csv written by
+# main.format_output: columnar binary files (Parquet or chunked .npz) and per-cell summaries
+
+import os
+import numpy as np
+
+from FrameConnector import frame_tz_arrays
+
+OUTLINE_COLUMNS = ["cell", "x", "y", "z", "t"]     # columns of the outline export, same order as the .csv
+SUMMARY_COLUMNS = ["cell", "t", "z", "centroid_x", "centroid_y", "area",        # columns of the per-cell summary export
+                   "min_x", "min_y", "max_x", "max_y"]
+SUMMARY_FMT = ["%d", "%d", "%d", "%.2f", "%.2f", "%.1f", "%d", "%d", "%d", "%d"]     # .csv format of each summary column
+BATCH_ROWS = 1000000        # default number of rows converted and written at a time
+
+
+# converts the FrameConnector into batches of int32 columns with one row per outline pixel
+# each frame_id is parsed once, no matter how many cells and pixels it contains
+# inputs: frame_connector - filled FrameConnector
+#         batch_rows - approximate number of rows in each batch
+# output: generator of dictionaries mapping each column in OUTLINE_COLUMNS to an int32 array
+#         note: cells start from 1, z and t are -1 if they could not be extracted from the frame_id
+def iter_outline_batches(frame_connector, batch_rows=BATCH_ROWS):
+    frame_tz = {}       # frame_id -> (t, z)
+
+    for cell_ids, frame_ids, offsets, coords in frame_connector.iter_outline_arrays(batch_rows):
+        lengths = np.diff(offsets)
+        t_arr, z_arr = frame_tz_arrays(frame_ids, cache=frame_tz)
+
+        yield {"cell": np.repeat(cell_ids + 1, lengths).astype(np.int32),
+               "x": coords[:, 0],
+               "y": coords[:, 1],
+               "z": np.repeat(z_arr, lengths),
+               "t": np.repeat(t_arr, lengths)}
+
+
+# converts the FrameConnector into batches of per-cell summaries with one row per (cell, t, z), computed with
+# vectorized segment reductions over the concatenated outlines rather than cell by cell
+# centroid - mean of the outline pixel coordinates
+# area - area enclosed by the outline, using the shoelace formula over the ordered outline pixels
+# min/max x and y - bounding box of the outline
+# inputs: frame_connector - filled FrameConnector
+#         batch_rows - approximate number of outline pixels summarized in each batch
+# output: generator of dictionaries mapping each column in SUMMARY_COLUMNS to an array
+#         note: cells start from 1, z and t are -1 if they could not be extracted from the frame_id, and cells whose
+#               outline is empty in a frame are skipped (as they have no rows in the outline export)
+def iter_summary_batches(frame_connector, batch_rows=BATCH_ROWS):
+    frame_tz = {}       # frame_id -> (t, z)
+
+    for cell_ids, frame_ids, offsets, coords in frame_connector.iter_outline_arrays(batch_rows):
+        lengths = np.diff(offsets)
+        keep = lengths > 0
+        if not keep.any():
+            continue
+
+        t_arr, z_arr = frame_tz_arrays(frame_ids, cache=frame_tz)
+
+        starts = offsets[:-1][keep]
+        counts = lengths[keep]
+        x = coords[:, 0].astype(np.int64)
+        y = coords[:, 1].astype(np.int64)
+
+        # index of the next pixel around each outline, wrapping the last pixel back to the first
+        next_idx = np.arange(1, len(coords) + 1)
+        next_idx[offsets[1:][keep] - 1] = starts
+        cross = x * y[next_idx] - x[next_idx] * y
+
+        yield {"cell": cell_ids[keep] + 1,
+               "t": t_arr[keep],
+               "z": z_arr[keep],
+               "centroid_x": np.add.reduceat(x, starts) / counts,
+               "centroid_y": np.add.reduceat(y, starts) / counts,
+               "area": np.abs(np.add.reduceat(cross, starts)) / 2.0,
+               "min_x": np.minimum.reduceat(coords[:, 0], starts),
+               "min_y": np.minimum.reduceat(coords[:, 1], starts),
+               "max_x": np.maximum.reduceat(coords[:, 0], starts),
+               "max_y": np.maximum.reduceat(coords[:, 1], starts)}
+
+
+# writes batches of columns to a .csv file, converting each batch in bulk
+# inputs: batches - iterable of dictionaries mapping column names to equal-length arrays
+#         file_path - path to the .csv file to create
+#         columns - the order of the columns in the file
+#         fmt - list of the printf-style format of each column
+#         header - boolean; if True, the column names are written as the first line
+# output: 0 if the file was written, -1 if not
+def write_csv(batches, file_path, columns, fmt, header=True):
+    try:
+        fp = open(file_path, "w")
+    except OSError:
+        print("Error: could not create file " + str(file_path))
+        return -1
+
+    with fp:
+        if header:
+            fp.write(",".join(columns) + "\n")
+        for batch in batches:
+            np.savetxt(fp, np.column_stack([batch[c] for c in columns]), fmt=fmt, delimiter=",")
+
+    return 0
+
+
+# writes batches of columns to a single Parquet file, one row group per batch, using pyarrow's streaming writer
+# inputs: batches - iterable of dictionaries mapping column names to equal-length arrays
+#         file_path - path to the .parquet file to create
+#         columns - the order of the columns in the file
+# output: 0 if the file was written, -1 if not
+def write_parquet(batches, file_path, columns=OUTLINE_COLUMNS):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        print("Error: pyarrow is required to write .parquet files. Please install it or use the .npz output")
+        return -1
+
+    writer = None
+    try:
+        for batch in batches:
+            table = pa.table([pa.array(batch[c]) for c in columns], names=columns)
+            if writer is None:      # schema is taken from the first batch
+                writer = pq.ParquetWriter(file_path, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    if writer is None:
+        print("Error: no rows to write to " + str(file_path))
+        return -1
+
+    return 0
+
+
+# writes batches of columns to a folder of numbered .npz files, one file per batch
+# inputs: batches - iterable of dictionaries mapping column names to equal-length arrays
+#         dir_path - path to the folder to create the .npz files in, created if it does not exist
+#         columns - the columns to save in each file
+# output: 0 if the files were written, -1 if not
+def write_npz(batches, dir_path, columns=OUTLINE_COLUMNS):
+    if not os.path.isdir(dir_path):
+        os.makedirs(dir_path)
+
+    # remove chunks from a previous export so they are not mixed with this one
+    for filename in os.scandir(dir_path):
+        if filename.is_file() and filename.name.startswith("chunk_") and filename.name.endswith(".npz"):
+            os.remove(filename.path)
+
+    chunk = 0
+    for batch in batches:
+        chunk_path = dir_path + "/chunk_" + str(chunk).zfill(5) + ".npz"
+        np.savez(chunk_path, **{c: batch[c] for c in columns})
+        chunk += 1
+
+    if chunk == 0:
+        print("Error: no rows to write to " + str(dir_path))
+        return -1
+
+    return 0
+
+
+# writes batches of columns in one of the output formats, as [file_path].csv, [file_path].parquet, or [file_path]_npz
+# inputs: batches - iterable of dictionaries mapping column names to equal-length arrays
+#         file_path - path of the file to create, without the extension
+#         columns - the order of the columns in the file
+#         fmt - list of the printf-style format of each column, used for the .csv
+#         output_format - "csv" (default), "parquet", or "npz"
+# output: 0 if the file was written, -1 if not
+def write_batches(batches, file_path, columns, fmt, output_format="csv"):
+    if output_format == "csv":
+        return write_csv(batches, file_path + ".csv", columns, fmt)
+    elif output_format == "parquet":
+        return write_parquet(batches, file_path + ".parquet", columns)
+    elif output_format == "npz":
+        return write_npz(batches, file_path + "_npz", columns)
+
+    print("Error: output format " + str(output_format) + " not recognized, must be one of: [csv, parquet, npz]")
+    return -1
+
+
+# loads a folder of .npz chunks written by write_npz back into single arrays
+# input: dir_path - path to the folder containing the .npz chunks
+# output: dictionary mapping each column name to the concatenated array, or -1 if no chunks were found
+def load_npz(dir_path):
+    chunk_list = sorted(f.path for f in os.scandir(dir_path)
+                        if f.is_file() and f.name.startswith("chunk_") and f.name.endswith(".npz"))
+    if not chunk_list:
+        print("Error: no .npz chunks found in " + str(dir_path))
+        return -1
+
+    columns = {}
+    for chunk_path in chunk_list:
+        with np.load(chunk_path) as chunk:
+            for c in chunk.files:
+                columns.setdefault(c, []).append(chunk[c])
+
+    return {c: np.concatenate(arrays) for c, arrays in columns.items()}
@@ -0,0 +1,206 @@
+# Chloe Fugle (chloe.m.fugle.23@dartmouth.edu)
+# 10/19/2026
+# Bio97 Thesis Project
+# Links the cells of every (t, z) frame in the dataset into global cells in one pass, as an alternative to tracking a
+# t video and z videos with the cv2 trackers
+# Every cell in every frame is a node, and candidate links join the cells of adjacent frames in t (same z) and in z
+# (same t) whose centers are within the jump limit. The links are accepted in increasing order of distance (a greedy
+# solution of the min-cost assignment), keeping each cell linked to at most one cell in each neighboring frame and
+# never joining two cells of the same frame into one global cell.
+
+import concurrent.futures
+import numpy as np
+
+import load_npy
+import DatasetGrid
+
+
+# loads the outlines of one frame and computes the center of each cell
+# input: file_name - the name of the .npy file
+# output: outlines - list of the pixels in the outline of each cell
+#         centers - float array of shape (cells, 2) of the mean (x, y) of each outline, NaN for empty outlines
+def load_frame(file_name):
+    outlines = load_npy.load_outlines(file_name)
+
+    centers = np.full((len(outlines), 2), np.nan)
+    for i in range(len(outlines)):
+        if len(outlines[i]) > 0:
+            centers[i] = np.asarray(outlines[i]).reshape(-1, 2).mean(axis=0)
+
+    return outlines, centers
+
+
+# finds the candidate links between the cells of two frames
+# the centers are bucketed into a grid of jump_limit sized squares and each cell in frame a is only compared to the
+# cells in the 3 x 3 squares around it, so the memory and time grow with the number of nearby pairs instead of with
+# cells_a * cells_b
+# inputs: centers_a, centers_b - (cells, 2) arrays of the cell centers in each frame
+#         jump_limit - maximum distance between linked cell centers
+# output: (a, b, cost) - arrays of the cell index in each frame and the distance between their centers, in order of a
+#         then b
+def candidate_links(centers_a, centers_b, jump_limit):
+    empty = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0))
+    index_a = np.flatnonzero(~np.isnan(centers_a).any(axis=1))     # NaN centers (empty outlines) are never linked
+    index_b = np.flatnonzero(~np.isnan(centers_b).any(axis=1))
+    if len(index_a) == 0 or len(index_b) == 0:
+        return empty
+
+    # grid square of each center, shifted so the squares around every center have non-negative coordinates
+    size = jump_limit if jump_limit > 0 else 1.0
+    square_a = np.floor(centers_a[index_a] / size).astype(np.int64)
+    square_b = np.floor(centers_b[index_b] / size).astype(np.int64)
+    low = np.minimum(square_a.min(axis=0), square_b.min(axis=0)) - 1
+    square_a -= low
+    square_b -= low
+    width = int(max(square_a[:, 1].max(), square_b[:, 1].max())) + 2
+    key_b = square_b[:, 0] * width + square_b[:, 1]
+    order_b = np.argsort(key_b, kind="stable")
+    key_b = key_b[order_b]
+
+    a_list = []
+    b_list = []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            key = (square_a[:, 0] + dx) * width + square_a[:, 1] + dy
+            lo = np.searchsorted(key_b, key, side="left")
+            counts = np.searchsorted(key_b, key, side="right") - lo
+            total = int(counts.sum())
+            if total == 0:
+                continue
+            # position in key_b of every cell of frame b in the square, for each cell of frame a
+            starts = np.repeat(lo - np.cumsum(counts) + counts, counts) + np.arange(total)
+            a_list.append(np.repeat(index_a, counts))
+            b_list.append(index_b[order_b[starts]])
+    if not a_list:
+        return empty
+
+    a = np.concatenate(a_list)
+    b = np.concatenate(b_list)
+    distance = np.hypot(centers_a[a, 0] - centers_b[b, 0], centers_a[a, 1] - centers_b[b, 1])
+    near = distance <= jump_limit
+    order = np.lexsort((b[near], a[near]))      # same order as comparing every pair
+
+    return a[near][order], b[near][order], distance[near][order]
+
+
+# links the cells in every frame of the dataset into global cells and adds them to the FrameConnector
+# inputs: manifest - dataset manifest mapping each frame_id to the PATH of its .npy (see dataset_manifest)
+#         frame_connector - empty FrameConnector to add the linked cells to
+#         jump_limit - the maximum distance a cell center can move between adjacent frames in t or z
+#         min_frames - cells present in fewer frames than this are not added to the FrameConnector, defaults to 1
+#         workers - number of processes used to load the frames, defaults to 1
+# output: the filled FrameConnector, cell IDs are in order of the first frame (by t, then z) each cell appears in
+def link(manifest, frame_connector, jump_limit, min_frames=1, workers=1):
+    grid = DatasetGrid.DatasetGrid(list(manifest))
+    frame_list = [grid.frame_ids[i] for i in grid.index[grid.index >= 0]]    # frames in order of t, then z
+
+    # load the outlines and cell centers of every frame
+    print("Loading " + str(len(frame_list)) + " frames...")
+    path_list = [manifest[f] for f in frame_list]
+    if workers > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            loaded = list(executor.map(load_frame, path_list, chunksize=8))
+    else:
+        loaded = [load_frame(path) for path in path_list]
+
+    # number every cell in every frame as a node
+    frame_start = np.zeros(len(frame_list) + 1, dtype=np.int64)
+    frame_start[1:] = np.cumsum([len(outlines) for outlines, centers in loaded])
+    frame_pos = {frame_list[i]: i for i in range(len(frame_list))}
+    node_frame = np.repeat(np.arange(len(frame_list)), np.diff(frame_start))
+
+    # find the candidate links between adjacent frames in t and in z
+    print("Finding candidate links...")
+    link_u = []
+    link_v = []
+    link_cost = []
+    link_axis = []      # 0 for links in t, 1 for links in z
+    for t_i in range(len(grid.t_values)):
+        for z_i in range(len(grid.z_values)):
+            if grid.index[t_i, z_i] < 0:
+                continue
+            f = frame_pos[grid.frame_ids[grid.index[t_i, z_i]]]
+
+            neighbors = []
+            if t_i + 1 < len(grid.t_values) and grid.index[t_i + 1, z_i] >= 0:
+                neighbors.append((0, frame_pos[grid.frame_ids[grid.index[t_i + 1, z_i]]]))
+            if z_i + 1 < len(grid.z_values) and grid.index[t_i, z_i + 1] >= 0:
+                neighbors.append((1, frame_pos[grid.frame_ids[grid.index[t_i, z_i + 1]]]))
+
+            for axis, g in neighbors:
+                a, b, cost = candidate_links(loaded[f][1], loaded[g][1], jump_limit)
+                link_u.append(a + frame_start[f])
+                link_v.append(b + frame_start[g])
+                link_cost.append(cost)
+                link_axis.append(np.full(len(a), axis, dtype=np.int8))
+
+    if link_u:
+        link_u = np.concatenate(link_u)
+        link_v = np.concatenate(link_v)
+        link_cost = np.concatenate(link_cost)
+        link_axis = np.concatenate(link_axis)
+    order = np.argsort(link_cost, kind="stable") if len(link_u) else []
+
+    # accept links in order of increasing cost
+    print("Linking " + str(frame_start[-1]) + " cells with " + str(len(order)) + " candidate links...")
+    num_nodes = int(frame_start[-1])
+    parent = np.arange(num_nodes)
+    comp_frames = {}        # root node -> set of the frames in the global cell, only stored for cells of size > 1
+    has_next = np.zeros((2, num_nodes), dtype=bool)     # node already linked to the next frame in t/z
+    has_prev = np.zeros((2, num_nodes), dtype=bool)     # node already linked to the previous frame in t/z
+
+    def find(node):
+        root = node
+        while parent[root] != root:
+            root = parent[root]
+        while parent[node] != root:     # path compression
+            parent[node], node = root, parent[node]
+        return root
+
+    for k in order:
+        u, v, axis = link_u[k], link_v[k], link_axis[k]
+        if has_next[axis, u] or has_prev[axis, v]:
+            continue
+        root_u = find(u)
+        root_v = find(v)
+        if root_u == root_v:
+            continue
+
+        frames_u = comp_frames.get(root_u, {node_frame[u]})
+        frames_v = comp_frames.get(root_v, {node_frame[v]})
+        if not frames_u.isdisjoint(frames_v):      # would join two cells of the same frame
+            continue
+
+        # merge the smaller global cell into the larger
+        if len(frames_u) < len(frames_v):
+            root_u, root_v, frames_u, frames_v = root_v, root_u, frames_v, frames_u
+        frames_u.update(frames_v)
+        parent[root_v] = root_u
+        comp_frames[root_u] = frames_u
+        comp_frames.pop(root_v, None)
+        has_next[axis, u] = True
+        has_prev[axis, v] = True
+
+    # assign global cell IDs in order of each cell's first node
+    roots = np.array([find(node) for node in range(num_nodes)], dtype=np.int64)
+    unique_roots, first_node, sizes = np.unique(roots, return_index=True, return_counts=True)
+    keep = sizes >= min_frames
+    order = np.argsort(first_node[keep])
+    cell_of_root = {int(r): i for i, r in enumerate(unique_roots[keep][order])}
+
+    # add the linked cells to the FrameConnector, in order of global cell ID then frame
+    node_order = sorted((cell_of_root[int(roots[n])], n) for n in range(num_nodes) if int(roots[n]) in cell_of_root)
+    first_vid_list = []
+    for cell_id, node in node_order:
+        f = node_frame[node]
+        cell = node - frame_start[f]
+        if cell_id == len(first_vid_list):      # first frame of the cell
+            center = loaded[f][1][cell]
+            first_vid_list.append((int(round(center[0])), int(round(center[1]))) if not np.isnan(center).any()
+                                  else None)
+        frame_connector.add_cell(cell_id, frame_list[f], loaded[f][0][cell])
+
+    frame_connector.set_first_vid_list(first_vid_list)
+    print(str(len(first_vid_list)) + " global cells linked")
+
+    return frame_connector
@@ -0,0 +1,106 @@
+# Chloe Fugle (chloe.m.fugle.23@dartmouth.edu)
+# 10/19/2026
+# Bio97 Thesis Project
+# Measures the time to import each module of the CPTracker in a fresh interpreter and checks it against a budget, so
+# the core data path (CPFrame, FrameConnector, matching, export) stays fast to start in the worker processes and batch
+# jobs: each module is imported in its own process (as a worker would), and the heavy libraries it loads are reported
+# The plotting, GUI, Cellpose, and pandas libraries are imported inside the functions that use them, so a core module
+# that loads one of its deferred libraries when imported fails the check even if it is within its time budget
+# run with: python import_budget.py --repeat 5
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# libraries only loaded when used, not when a core module is imported
+DEFERRED = ["matplotlib", "pandas", "shapely", "cv2", "PyQt5", "cellpose"]
+
+# module -> (seconds, libraries it must not load when imported)
+# note: the times include numpy (about 0.03 s), main.py loads cv2 for the tracker videos
+BUDGETS = {"CPFrame": (0.15, DEFERRED),
+           "FrameConnector": (0.15, DEFERRED),
+           "match_coords": (0.15, DEFERRED),
+           "export_output": (0.15, DEFERRED),
+           "ResultsStore": (0.15, DEFERRED),
+           "kinematics": (0.15, DEFERRED),
+           "checkpoint": (0.15, DEFERRED),
+           "dataset_manifest": (0.15, DEFERRED),
+           "data_analysis": (0.15, DEFERRED),
+           "main": (0.3, ["matplotlib", "pandas", "shapely", "PyQt5", "cellpose"])}
+
+# run in the fresh interpreter: imports the module and prints the seconds and the libraries loaded as .json
+MEASURE_CODE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "loaded": sorted(sys.modules)}}))
+"""
+
+
+# imports a module in a fresh interpreter and measures the time of the import
+# inputs: module - name of the module
+#         repeat - number of times the module is imported, each in a new process, the fastest is kept (default 5)
+# output: (seconds, loaded) - fastest import time and the list of the DEFERRED libraries loaded, or -1 if the module
+#         could not be imported
+def measure_import(module, repeat=5):
+    best = None
+    loaded = []
+    for r in range(repeat):
+        proc = subprocess.run([sys.executable, "-c", MEASURE_CODE.format(module=module)],
+                              cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True)
+        if proc.returncode != 0:
+            print("Error: could not import " + module + "\n" + proc.stderr.strip())
+            return -1
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        if best is None or result["seconds"] < best:
+            best = result["seconds"]
+        loaded = [lib for lib in DEFERRED if lib in result["loaded"]]
+
+    return best, loaded
+
+
+# measures every module in BUDGETS and prints its import time against its budget
+# inputs: repeat - see measure_import
+#         scale - factor the budgets are multiplied by, for slower machines (default 1)
+# output: failures - list of (module, reason) of the modules over their budget, that loaded a library they must not
+#         load, or that could not be imported
+def check_budgets(repeat=5, scale=1.0):
+    failures = []
+    print("module".ljust(20) + "import".rjust(10) + "budget".rjust(10) + "   deferred libraries loaded")
+    for module, (budget, deferred) in BUDGETS.items():
+        measured = measure_import(module, repeat=repeat)
+        if measured == -1:
+            failures.append((module, "import failed"))
+            continue
+        seconds, loaded = measured
+
+        flag = ""
+        if seconds > budget * scale:
+            flag = "  OVER BUDGET"
+            failures.append((module, "over budget"))
+        not_deferred = [lib for lib in loaded if lib in deferred]
+        if not_deferred:
+            flag += "  NOT DEFERRED"
+            failures.append((module, "loads " + ", ".join(not_deferred)))
+
+        print(module.ljust(20) + (str(round(seconds, 3)) + " s").rjust(10) + (str(round(budget * scale, 3))
+              + " s").rjust(10) + "   " + (", ".join(loaded) or "-") + flag)
+
+    return failures
+
+
+# run the check
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Checks the import time of the CPTracker modules against a budget.")
+    parser.add_argument("--repeat", type=int, default=5, help="number of imports of each module, the fastest is kept")
+    parser.add_argument("--scale", type=float, default=1.0, help="factor the budgets are multiplied by")
+    args = parser.parse_args()
+
+    found = check_budgets(repeat=args.repeat, scale=args.scale)
+    if found:
+        print("\n" + str(len(found)) + " import budget failures: " + "; ".join(m + " " + r for m, r in found))
+        raise SystemExit(1)
+    print("\nAll modules within their import budget")
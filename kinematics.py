@@ -0,0 +1,220 @@
+# Chloe Fugle (chloe.m.fugle.23@dartmouth.edu)
+# 10/19/2026
+# Bio97 Thesis Project
+# Computes the trajectory kinematics of every tracked cell from the FrameConnector centroids: the displacement and
+# speed of each cell between its frames, its mean squared displacement (MSD) at each time lag, and its directional
+# persistence (cosine of the turning angle between steps, and the straightness of the whole trajectory)
+# Every quantity is computed for all cells at once with array operations over the (cell, t) table sorted by cell and t,
+# and the MSD over a dense (cells, t) position array, so there are no per-cell loops
+# note: distances are in pixels and times in t values, so speeds are in pixels per t
+
+import numpy as np
+
+import export_output
+
+FRAME_COLUMNS = ["cell", "t", "x", "y", "dx", "dy", "displacement", "speed", "net_displacement", "turn_cos"]
+FRAME_FMT = ["%d", "%d", "%.2f", "%.2f", "%.2f", "%.2f", "%.3f", "%.3f", "%.3f", "%.4f"]
+CELL_COLUMNS = ["cell", "t_first", "t_last", "frames", "path_length", "net_displacement", "mean_speed", "max_speed",
+                "straightness", "mean_turn_cos"]
+CELL_FMT = ["%d", "%d", "%d", "%d", "%.3f", "%.3f", "%.3f", "%.3f", "%.4f", "%.4f"]
+MSD_COLUMNS = ["cell", "lag", "msd", "count"]        # cell 0 is the MSD of all cells together
+MSD_FMT = ["%d", "%d", "%.3f", "%d"]
+MAX_LAG = 20        # default largest time lag the MSD is computed at
+
+
+# returns the centroid of every cell at every t in the FrameConnector
+# inputs: frame_connector - filled FrameConnector
+#         zvalue - optional, only the frames at this z value are used (e.g. the t video at ZVALUE), if None the
+#                  centroid at each t is the mean of the centroids of the cell in every z slice it was found in
+# output: dictionary of "cell", "t" (int32), "x", and "y" (float64) arrays with one row per (cell, t), sorted by cell
+#         and t, cells start from 1
+def frame_connector_centroids(frame_connector, zvalue=None):
+    cell_list = []
+    t_list = []
+    x_list = []
+    y_list = []
+    for batch in export_output.iter_summary_batches(frame_connector):
+        keep = batch["t"] >= 0
+        if zvalue is not None:
+            keep &= batch["z"] == zvalue
+        cell_list.append(batch["cell"][keep])
+        t_list.append(batch["t"][keep])
+        x_list.append(batch["centroid_x"][keep])
+        y_list.append(batch["centroid_y"][keep])
+
+    cell = np.concatenate(cell_list + [np.zeros(0, dtype=np.int32)]).astype(np.int32)
+    t = np.concatenate(t_list + [np.zeros(0, dtype=np.int32)]).astype(np.int32)
+    x = np.concatenate(x_list + [np.zeros(0)])
+    y = np.concatenate(y_list + [np.zeros(0)])
+
+    # average the slices of each (cell, t)
+    order = np.lexsort((t, cell))
+    cell, t, x, y = cell[order], t[order], x[order], y[order]
+    new = np.ones(len(cell), dtype=bool)
+    new[1:] = (cell[1:] != cell[:-1]) | (t[1:] != t[:-1])
+    if new.all():
+        return {"cell": cell, "t": t, "x": x, "y": y}
+    starts = np.flatnonzero(new)
+    counts = np.diff(np.r_[starts, len(cell)])
+
+    return {"cell": cell[starts], "t": t[starts], "x": np.add.reduceat(x, starts) / counts,
+            "y": np.add.reduceat(y, starts) / counts}
+
+
+# computes the kinematics of every cell from its centroid at each t
+# inputs: cell, t, x, y - arrays with one row per (cell, t), (cell, t) pairs must be unique but need not be sorted
+#         max_lag - largest time lag (in t values) the MSD is computed at, defaults to MAX_LAG, None for every lag
+# output: (frames, cells, msd) - dictionaries of columns (see FRAME_COLUMNS, CELL_COLUMNS, and MSD_COLUMNS), or -1 if a
+#         (cell, t) pair is not unique
+#         frames - one row per (cell, t), sorted by cell and t:
+#                  dx, dy, displacement - movement since the previous t the cell was found at (NaN at its first t)
+#                  speed - displacement divided by the number of t values since the previous t it was found at
+#                  net_displacement - distance from the position of the cell at its first t
+#                  turn_cos - cosine of the angle between this step and the previous step, 1 for a cell moving in a
+#                             straight line and -1 for a cell reversing (NaN if either step is missing or zero)
+#         cells - one row per cell: t_first, t_last, frames, path_length (sum of the displacements), net_displacement
+#                 (from the first to the last position), mean_speed and max_speed, straightness (net_displacement /
+#                 path_length), and mean_turn_cos
+#         msd - one row per (cell, lag) with the mean of the squared displacement over every pair of t values lag
+#               apart the cell was found at both, and the number of pairs, plus rows with cell 0 for all cells together
+def compute(cell, t, x, y, max_lag=MAX_LAG):
+    cell = np.asarray(cell, dtype=np.int64)
+    t = np.asarray(t, dtype=np.int64)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    order = np.lexsort((t, cell))
+    cell, t, x, y = cell[order], t[order], x[order], y[order]
+    n = len(cell)
+
+    # step from the previous row of the same cell
+    same = np.zeros(n, dtype=bool)
+    same[1:] = cell[1:] == cell[:-1]
+    dx = np.full(n, np.nan)
+    dy = np.full(n, np.nan)
+    dt = np.full(n, np.nan)
+    dx[1:] = np.where(same[1:], x[1:] - x[:-1], np.nan)
+    dy[1:] = np.where(same[1:], y[1:] - y[:-1], np.nan)
+    dt[1:] = np.where(same[1:], t[1:] - t[:-1], np.nan)
+    if (dt == 0).any():
+        print("Error: a cell has more than one centroid at the same t")
+        return -1
+    displacement = np.hypot(dx, dy)
+    speed = displacement / dt
+
+    # cosine of the turning angle, between the step into this row and the step into the previous row
+    turn_cos = np.full(n, np.nan)
+    if n > 1:
+        dot = dx[1:] * dx[:-1] + dy[1:] * dy[:-1]
+        norm = displacement[1:] * displacement[:-1]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            turn_cos[1:] = np.where(same[1:] & (norm > 0), dot / norm, np.nan)
+
+    # first and last row of each cell
+    starts = np.flatnonzero(~same)
+    ends = np.r_[starts[1:], n] - 1
+    first = np.repeat(starts, ends - starts + 1)
+    net_displacement = np.hypot(x - x[first], y - y[first])
+
+    frames = {"cell": cell.astype(np.int32), "t": t.astype(np.int32), "x": x, "y": y, "dx": dx, "dy": dy,
+              "displacement": displacement, "speed": speed, "net_displacement": net_displacement, "turn_cos": turn_cos}
+
+    # per-cell reductions, ignoring the NaN at the first row of each cell
+    row_counts = ends - starts + 1
+    step_counts = row_counts - 1
+    turn_counts = np.add.reduceat((~np.isnan(turn_cos)).astype(np.int64), starts)
+    path_length = np.add.reduceat(np.nan_to_num(displacement), starts)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_speed = np.where(step_counts > 0, np.add.reduceat(np.nan_to_num(speed), starts) / step_counts, np.nan)
+        max_speed = np.where(step_counts > 0, np.maximum.reduceat(np.nan_to_num(speed, nan=-np.inf), starts), np.nan)
+        straightness = np.where(path_length > 0, net_displacement[ends] / path_length, np.nan)
+        mean_turn_cos = np.where(turn_counts > 0, np.add.reduceat(np.nan_to_num(turn_cos), starts) / turn_counts,
+                                 np.nan)
+
+    cells = {"cell": cell[starts].astype(np.int32), "t_first": t[starts].astype(np.int32),
+             "t_last": t[ends].astype(np.int32), "frames": row_counts, "path_length": path_length,
+             "net_displacement": net_displacement[ends], "mean_speed": mean_speed, "max_speed": max_speed,
+             "straightness": straightness, "mean_turn_cos": mean_turn_cos}
+
+    return frames, cells, compute_msd(cell, t, x, y, starts, max_lag)
+
+
+# computes the MSD of every cell at each time lag over a dense (cells, t) position array, NaN where a cell was not
+# found, so each lag is one array operation over all cells
+# inputs: cell, t, x, y - arrays sorted by cell and t (see compute)
+#         starts - index of the first row of each cell
+#         max_lag - largest time lag, None for every lag
+# output: msd - dictionary of the MSD_COLUMNS, lags without any pair of t values are left out
+def compute_msd(cell, t, x, y, starts, max_lag):
+    empty = {"cell": np.zeros(0, dtype=np.int32), "lag": np.zeros(0, dtype=np.int32), "msd": np.zeros(0),
+             "count": np.zeros(0, dtype=np.int64)}
+    if len(cell) == 0:
+        return empty
+
+    t_min = int(t.min())
+    t_span = int(t.max()) - t_min + 1
+    if max_lag is None or max_lag > t_span - 1:
+        max_lag = t_span - 1
+    if max_lag < 1:
+        return empty
+
+    row = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, len(cell)]))
+    pos_x = np.full((len(starts), t_span), np.nan)
+    pos_y = np.full((len(starts), t_span), np.nan)
+    pos_x[row, t - t_min] = x
+    pos_y[row, t - t_min] = y
+
+    cell_list = []
+    lag_list = []
+    sum_list = []
+    count_list = []
+    for lag in range(1, max_lag + 1):
+        sq = (pos_x[:, lag:] - pos_x[:, :-lag]) ** 2 + (pos_y[:, lag:] - pos_y[:, :-lag]) ** 2
+        found = ~np.isnan(sq)
+        cell_list.append(cell[starts])
+        lag_list.append(np.full(len(starts), lag))
+        sum_list.append(np.where(found, sq, 0).sum(axis=1))
+        count_list.append(found.sum(axis=1))
+
+    cell_arr = np.concatenate(cell_list)
+    lag_arr = np.concatenate(lag_list)
+    sum_arr = np.concatenate(sum_list)
+    count_arr = np.concatenate(count_list)
+
+    # MSD of all cells together at each lag
+    all_sum = np.array([s.sum() for s in sum_list])
+    all_count = np.array([c.sum() for c in count_list])
+
+    keep = count_arr > 0
+    all_keep = all_count > 0
+    order = np.lexsort((lag_arr[keep], cell_arr[keep]))
+    return {"cell": np.r_[np.zeros(all_keep.sum(), dtype=np.int64), cell_arr[keep][order]].astype(np.int32),
+            "lag": np.r_[np.arange(1, max_lag + 1)[all_keep], lag_arr[keep][order]].astype(np.int32),
+            "msd": np.r_[all_sum[all_keep] / all_count[all_keep], (sum_arr[keep] / count_arr[keep])[order]],
+            "count": np.r_[all_count[all_keep], count_arr[keep][order]].astype(np.int64)}
+
+
+# computes the kinematics of the cells in a FrameConnector and writes the frame, cell, and MSD tables to
+# kinematics_frames, kinematics_cells, and kinematics_msd in the output folder
+# inputs: frame_connector - filled FrameConnector
+#         dir_path - PATH of the folder to write the tables to
+#         zvalue - optional, only the frames at this z value are used (see frame_connector_centroids)
+#         max_lag - largest MSD time lag (see compute)
+#         output_format - "csv" (default), "parquet", or "npz", as in main.format_output
+# output: (frames, cells, msd) from compute, or -1 if the FrameConnector has no centroids or a table was not written
+def analyze_frame_connector(frame_connector, dir_path, zvalue=None, max_lag=MAX_LAG, output_format="csv"):
+    centroids = frame_connector_centroids(frame_connector, zvalue=zvalue)
+    if len(centroids["cell"]) == 0:
+        print("Error: no cell centroids to compute the kinematics of" + ("" if zvalue is None else
+                                                                         " at z = " + str(zvalue)))
+        return -1
+
+    tables = compute(centroids["cell"], centroids["t"], centroids["x"], centroids["y"], max_lag=max_lag)
+    if tables == -1:
+        return -1
+    for table, name, columns, fmt in zip(tables, ["frames", "cells", "msd"], [FRAME_COLUMNS, CELL_COLUMNS, MSD_COLUMNS],
+                                         [FRAME_FMT, CELL_FMT, MSD_FMT]):
+        if export_output.write_batches([table], dir_path + "/kinematics_" + name, columns, fmt, output_format) == -1:
+            return -1
+
+    return tables
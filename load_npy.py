@@ -6,21 +6,27 @@
 # Code modified from code in Cellpose documentation (https://cellpose.readthedocs.io/en/latest/outputs.html#seg-npy-output)
 
 # import packages
+import os
 import numpy as np
-from matplotlib import pyplot as plt
 import cv2
 from CPFrame import CPFrame
 
 # loads a .npy file and saves a PNG with cell boundary outlines shown as a red line, outputs name of file and
 # an array with the coordinates of the boundaries of each cell
 # note: this function will override any files named [file_name].png
-# inputs: file_name - the name of the .npy file
+# inputs: file_name - the name of the .npy file, or the segmentation itself (a dictionary with the "img" and "masks"
+#                     of a _seg.npy, see read_seg)
+#         png_generated - boolean; if True, the PNG already exists and is not saved again
+#         png_name - optional, PATH of the PNG, defaults to [file_name].png
+#         frame_id - optional, frame_id of the CPFrame, defaults to the name of the file without the file type
 # output: png_name - name of the file containing the PNG
 #         cell_boundaries - pandas dataframe containing a column of cell temp_ids and a column of the coordinates
 #                           of their outlines from the .npy file
-def load(file_name, png_generated=False):
+def load(file_name, png_generated=False, png_name=None, frame_id=None):
     # load numpy file
-    file = np.load(file_name, allow_pickle=True).item()
+    file = read_seg(file_name)
+    if isinstance(file_name, dict):     # segmentation handed over in memory, named after its frame_id
+        file_name = str(frame_id if frame_id is not None else file.get("filename", "segmentation"))
 
     # get list of pixels containing the outlines from file
     outlines = outlines_list(file['masks'])
@@ -31,23 +37,31 @@ def load(file_name, png_generated=False):
     #     plt.plot(o[:, 0], o[:, 1], color='r')
     # plt.show()
 
-    png_name = file_name + ".png"
+    if png_name is None:
+        png_name = file_name + ".png"
     image_array = file['img']
 
     if not png_generated:
-        # save plot as PNG
-        plt.imsave(png_name, arr=image_array)
+        # save plot as PNG, written to a temporary file first so that videos loaded at the same time in different
+        # processes never read a partially written PNG
+        from matplotlib import image     # only the image module, so pyplot is not loaded in the processes that load .npys
 
-        # clear the figure from the plot
-        plt.clf()
+        tmp_name = png_name + "." + str(os.getpid()) + ".tmp"
+        image.imsave(tmp_name, arr=image_array, format="png")
+        os.replace(tmp_name, png_name)
+        # note: imsave does not draw on the current pyplot figure, so there is no figure to clear, and the .npys can
+        #       be loaded in a background thread (see run_tracker.prefetch_videos)
 
     # get dimensions of the image
     max_y, max_x = image_array.shape
     size = (max_x, max_y)
 
     # get name of file without file type
-    temp = file_name.split(sep="/")[-1]
-    short_fn = temp.split(sep=".")[0]
+    if frame_id is None:
+        temp = file_name.split(sep="/")[-1]
+        short_fn = temp.split(sep=".")[0]
+    else:
+        short_fn = frame_id
 
     # create data structure of cell temp_ids and the coordinates of the cell outlines
     cpframe = create_cpframe(outlines, size, short_fn)
@@ -56,6 +70,24 @@ def load(file_name, png_generated=False):
     return png_name, cpframe
 
 
+# loads only the cell outlines from a .npy file, without saving a PNG or creating a CPFrame
+# input: file_name - the name of the .npy file, or the segmentation itself (see read_seg)
+# output: list of the pixels in the outline of each cell in the masks (see outlines_list)
+def load_outlines(file_name):
+    file = read_seg(file_name)
+    return outlines_list(file['masks'])
+
+
+# returns the contents of a Cellpose _seg.npy file
+# input: file_name - the name of the .npy file, or a dictionary with the same keys (at least "img" and "masks"), e.g.
+#                    from segmentation run in the same process (see CPLoop.py), which is returned as is
+# output: dictionary of the segmentation
+def read_seg(file_name):
+    if isinstance(file_name, dict):
+        return file_name
+    return np.load(file_name, allow_pickle=True).item()
+
+
 # create an array of the cells (distinguished by cell_temp_id) and the coordinates of their outline
 # input: outlines - list of cell outlines coordinates from .npy file
 #        size - dimensions of frame from image.shape() function
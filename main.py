@@ -5,11 +5,20 @@
 
 import os
 import re
-import shutil
-import pandas as pd
 
 import run_tracker
 import FrameConnector
+import export_output
+import checkpoint
+import dataset_manifest
+import DatasetGrid
+import global_linker
+import watch_folder
+import metrics
+import data_analysis
+import kinematics
+import morphology
+import ResultsStore
 
 #######################################################################################################################
 #######################################################################################################################
@@ -28,6 +37,52 @@ JUMP_LIMIT = 20                 # the user-selected threshold for the maximum di
 RANDNUM = None                  # specify a number of cells to be tracked, cells are selected randomly
                                 # set to None for all cells to be tracked
 
+OUTPUT_FORMAT = "csv"           # format of the tracking output: "csv" (default), "parquet" (requires pyarrow), or "npz"
+                                # (folder of .npz chunks), the binary formats store int32 columns cell, x, y, z, t
+                                # "store" writes an indexed store of the outlines that can be queried by cell, t, and z
+                                # (see ResultsStore.py), it is only used for the outline output
+OUTPUT_MODE = "outline"         # "outline" (default) writes every outline pixel, "summary" writes one row per cell per
+                                # (t, z) with the centroid, area, and bounding box of the cell
+SAVE_PLOTS = False              # if True, the cell tracker plot after each video is saved to cell_plot_xxx.png in the
+                                # generated folder instead of displayed, so the program does not wait for the plot
+                                # window to be closed
+LINK_MODE = "tracker"           # "tracker" (default) tracks the t video at ZVALUE and the z videos at each TVALUE with the
+                                # cv2 trackers, "global" instead links the segmented cells of every adjacent (t, z)
+                                # frame pair in one pass (see global_linker.py), ZVALUE and TVALUE are not used
+WORKERS = 1                     # number of processes to run the z videos in at the same time once the t video is
+                                # complete, 1 runs every video one after another (the tracking video is only displayed
+                                # for videos that are not run in parallel)
+CHECKPOINT = True               # if True, the FrameConnector is saved after every video to
+                                # __checkpoints__ in the generated folder
+RESUME = False                  # if True, resume from the checkpoint of a previous (interrupted) run, skipping the
+                                # videos it completed -- the dataset and the inputs above must not have changed
+WORK_DIR = None                 # folder the .pngs, videos, and output are generated in, if None (default) they are
+                                # generated in __CPTracker_folder__ in FOLDER_NAME
+DISPLAY = True                  # if False, the tracking videos are not shown while tracking (for runs without a display,
+                                # e.g. batch_runner.py)
+PREFETCH = True                 # if True, the .npys of the next video are loaded (and its .mp4 written) while the current
+                                # video is tracked and matched, the videos are then saved as cell_tracker_video_xxx.mp4
+WRITE_OUTPUT = True             # if False, the coordinates output (see OUTPUT_FORMAT) is not written, e.g. when only the
+                                # summary is needed
+ANALYZE = False                 # if True, the summary of each cell (t range and z range at each TVALUE, see
+                                # data_analysis.py) is computed from the FrameConnector and saved to cptracker_summary.csv
+KINEMATICS = False              # if True, the displacement, speed, MSD, and directional persistence of each cell (see
+                                # kinematics.py) are computed from the FrameConnector and saved to kinematics_xxx in the
+                                # generated folder, in the OUTPUT_FORMAT
+MORPHOLOGY = False              # if True, the volume, surface area, z extent, and 3D centroid of each cell at each t (see
+                                # morphology.py) are saved to cptracker_morphology in the generated folder, in the
+                                # OUTPUT_FORMAT
+VOXEL_SIZE = (1.0, 1.0)         # (pixel width, distance between z slices) used for the morphology, (1, 1) gives voxels
+METRICS = False                 # if True, the time of each stage, match hit rate, tracker counts, and peak memory are
+                                # saved to cptracker_metrics.json and cptracker_metrics.prom in the generated folder
+WATCH = False                   # if True, watch FOLDER_NAME while the .npys are still being written, tracking each t as
+                                # soon as its z-stack is complete and appending to the .csv output (see
+                                # watch_folder.py), the output is written again in OUTPUT_FORMAT when watching stops
+                                # note: LINK_MODE, WORKERS, CHECKPOINT, and RESUME are not used when watching
+WATCH_Z_COUNT = None            # number of z slices in a complete z-stack when watching, if None a z-stack is complete
+                                # once a .npy of the next t is written
+WATCH_IDLE_TIMEOUT = 600        # stop watching after this many seconds without a new .npy, None to watch until 'Ctrl+C'
+
 # algorithm used for tracker
 TRACKER_TYPE = "TrackerCSRT"    # recommended algorithm
 # tracker_type = "TrackerKCF"
@@ -39,43 +94,89 @@ TRACKER_TYPE = "TrackerCSRT"    # recommended algorithm
 # for every timepoint (from ZVALUE to 0 and ZVALUE to the bottom), then, initializes an empty FrameConnector and
 # runs the tracker on every video
 # inputs: user-specified inputs at top of file
-# outputs: the FrameConnector containing the coordinates contained within each cell at each timepoint
-def main():
-
-    # generate folder with correctly-named copies of the .npy files
-    gen_dir_name = "__CPTracker_folder__"      # CPTracker generates folder with correctly-named .npys to cycle through
-    dir_path = FOLDER_NAME + '/' + gen_dir_name
+#         resume - boolean; if True, resume from the last checkpoint (see RESUME)
+#         workers - number of processes to run the z videos in (see WORKERS), or to load the frames in when
+#                   link_mode is "global"
+#         link_mode - "tracker" or "global" (see LINK_MODE)
+#         watch - boolean; if True, watch the folder for new .npys instead (see WATCH)
+#         segmentations - optional, dictionary mapping each frame_id (txxx_zxxx) to its segmentation (a dictionary with
+#                         the "img" and "masks" of a _seg.npy) handed over in memory by CPLoop.py, if given the .npys
+#                         in FOLDER_NAME are not read (FOLDER_NAME is only where the generated folder is created)
+# outputs: the output of the coordinates contained within each cell at each timepoint (see format_output), returns 0
+#          if successful, -1 if not
+def main(resume=RESUME, workers=WORKERS, link_mode=LINK_MODE, watch=WATCH, segmentations=None):
+
+    # generate folder for the .pngs, videos, and output created by CPTracker
+    gen_dir_name = "__CPTracker_folder__"      # CPTracker generates folder with the files it creates
+    if WORK_DIR is None:
+        dir_path = FOLDER_NAME + '/' + gen_dir_name
+        manifest_path = FOLDER_NAME + "/" + dataset_manifest.MANIFEST_NAME
+    else:       # separate workspace, so runs on the same folder do not write to the same files
+        dir_path = WORK_DIR
+        manifest_path = WORK_DIR + "/" + dataset_manifest.MANIFEST_NAME
 
     if os.path.exists(dir_path) and os.path.isdir(dir_path):    # if generated folder exists
         print("exists")
     else:   # generate CPTracker folder
         os.makedirs(dir_path)
 
-    # cycle through the folders and extract the txxzxx name
-    file_list = []  # list of all of the generated file names
-
-    for filename in os.scandir(FOLDER_NAME):
-        if filename.is_file() and os.path.splitext(filename)[1] == ".npy":      # if the file is a .npy
-            match = re.search(r't[0-9]{3}_z[0-9]{3}', filename.path)
-            if match:
-                new_filename = dir_path + "/" + str(match.group(0)) + ".npy"
-                shutil.copy(filename.path, new_filename)
-                file_list.append(str(match.group(0)))
-            else:
-                print("Error: file name " + filename.path + " not formatted correctly")
-                print("Please include txxx_zxxx in the filename, where xxx are three integers,\n"
-                      "with txxx representing the t_value of the frame and zxxx representing the z-value of the frame")
-                continue
+    if METRICS:
+        metrics.reset()
+        metrics.enable()
+
+    # track the dataset as it is written, then write the output of the cells tracked as for a finished dataset
+    if watch:
+        frame_connector = watch_folder.watch(FOLDER_NAME, ZVALUE, TVALUE, JUMP_LIMIT, TRACKER_TYPE,
+                                             z_count=WATCH_Z_COUNT, idle_timeout=WATCH_IDLE_TIMEOUT,
+                                             video_fps=VIDEO_FPS, rand_num=RANDNUM, dir_path=dir_path)
+        return finish(frame_connector, dir_path, zvalue=ZVALUE)
+
+    if segmentations is None:
+        # scan the folder once and map the txxx_zxxx name of each .npy to its PATH, the .npys are read in place
+        manifest = dataset_manifest.build_manifest(FOLDER_NAME)
+        dataset_manifest.save_manifest(manifest, manifest_path)
+        source_list = list(manifest.values())    # list of the PATHs of the original .npy files
+        fingerprint = checkpoint.dataset_fingerprint(source_list)
+    else:       # the segmentations are used in place of the .npys they would have been saved as
+        manifest = dict(sorted(segmentations.items()))
+        fingerprint = checkpoint.segmentation_fingerprint(manifest)
+    file_list = list(manifest)      # list of the txxx_zxxx names of the .npy files
+
+    # link every frame in one pass instead of running the tracker on videos
+    if link_mode == "global" and len(file_list) > 0:
+        frame_connector = FrameConnector.FrameConnector()
+        with metrics.timer("global_linker.link"):
+            global_linker.link(manifest, frame_connector, JUMP_LIMIT, workers=workers)
+        return finish(frame_connector, dir_path)
 
     if len(file_list) > 0:      # if any files match the correct formatting
-        vids_list = generate_video_lists(file_list, ZVALUE, TVALUE, dir_path)     # generate lists of .npys to create videos with
+        vids_list = generate_video_lists(file_list, ZVALUE, TVALUE)     # generate lists of .npys to create videos with
         print(vids_list)
     else:
         print("\nError: No files could be processed. Please check filename format and try again.")
         return -1
 
-    # cycle through lists of .npys and run the tracker program
+    # load the checkpoint of the previous run if resuming
+    checkpoint_dir = dir_path + "/" + checkpoint.CHECKPOINT_DIR_NAME
+    params = {"zvalue": ZVALUE, "tvalue": TVALUE, "jump_limit": JUMP_LIMIT, "rand_num": RANDNUM,
+              "tracker_type": TRACKER_TYPE, "vids_list": vids_list}
+    completed = []      # indexes of the videos that have been completed
+
     frame_connector = FrameConnector.FrameConnector()       # initialize FrameConnector object
+    if resume:
+        loaded = checkpoint.load_checkpoint(checkpoint_dir, fingerprint, params)
+        if loaded == -1:
+            return -1
+        elif loaded[0] is None:
+            print("No checkpoint found, starting from the first video")
+        else:
+            frame_connector, completed = loaded
+            print("Resuming from checkpoint, " + str(len(completed)) + " of " + str(len(vids_list))
+                  + " videos already completed")
+
+    # cycle through lists of .npys and plan the videos to run
+    serial_jobs = []        # (index, video, first video) of the videos to run one after another
+    parallel_jobs = []      # (index, video) of the z videos to run in parallel after the t video
     i = 0
     for v in range(len(vids_list)):
         video = vids_list[v]
@@ -88,70 +189,142 @@ def main():
         else:
             first_video_bool = False
 
-        run_tracker.run_tracker(video, TRACKER_TYPE, frame_connector, JUMP_LIMIT, dir_path,
-                               video_fps=VIDEO_FPS, first_video=first_video_bool, overwrite_image=False, rand_num=RANDNUM)
+        if v in completed:      # video was completed before the run was resumed
+            pass
+        elif workers > 1 and i > 0:     # z video, run in parallel below
+            parallel_jobs.append((v, video))
+        else:
+            serial_jobs.append((v, video, first_video_bool))
         i += 1
 
-    format_output(frame_connector, dir_path)
+    # load the .npys of the next video in the background while the current video is tracked and matched
+    if PREFETCH and len(serial_jobs) > 1:
+        video_names = ["cell_tracker_video_" + str(v).zfill(3) for v, video, first in serial_jobs]
+        prepared_videos = run_tracker.prefetch_videos([video for v, video, first in serial_jobs], video_names, dir_path,
+                                                      video_fps=VIDEO_FPS, overwrite_image=False, manifest=manifest)
+    else:
+        video_names = ["cell_tracker_video"] * len(serial_jobs)
+        prepared_videos = iter([None] * len(serial_jobs))
+
+    # run the tracker program on each video
+    for n in range(len(serial_jobs)):
+        v, video, first_video_bool = serial_jobs[n]
+        prepared = next(prepared_videos)
+
+        if SAVE_PLOTS:
+            plot_file = dir_path + "/cell_plot_" + str(v).zfill(3) + ".png"
+        else:
+            plot_file = None
+
+        run_tracker.run_tracker(video, TRACKER_TYPE, frame_connector, JUMP_LIMIT, dir_path,
+                               video_fps=VIDEO_FPS, first_video=first_video_bool, overwrite_image=False, rand_num=RANDNUM,
+                               plot_file=plot_file, manifest=manifest, display=DISPLAY,
+                               video_name=video_names[n], prepared=prepared)
+
+        if CHECKPOINT:
+            completed = checkpoint.write_checkpoint(checkpoint_dir, v, frame_connector, fingerprint, params, completed)
+
+    # run the z videos in parallel, adding their matches to the FrameConnector in video order so the FrameConnector is
+    # the same as when the videos are run one after another
+    if parallel_jobs:
+        with metrics.timer("match_videos_parallel"):     # the stages in the worker processes are not counted
+            results = run_tracker.match_videos_parallel(parallel_jobs, TRACKER_TYPE,
+                                                        frame_connector.get_first_vid_list(),
+                                                        JUMP_LIMIT, dir_path, workers, video_fps=VIDEO_FPS,
+                                                        overwrite_image=False, rand_num=RANDNUM,
+                                                        first_video=frame_connector.is_empty(),
+                                                        manifest=manifest)
+            for v, records in results:
+                for cell_id, frame, coords in records:
+                    frame_connector.add_cell(cell_id, frame, coords)
+                print("Video " + str(v) + " matched")
+
+                if SAVE_PLOTS:
+                    frame_connector.save_plot(dir_path + "/cell_plot_" + str(v).zfill(3) + ".png")
+                if CHECKPOINT:
+                    completed = checkpoint.write_checkpoint(checkpoint_dir, v, frame_connector, fingerprint, params,
+                                                            completed)
+
+    return finish(frame_connector, dir_path, zvalue=ZVALUE)
+
+
+# writes the output of the run, the summary of each cell, and the metrics, if selected
+# inputs: frame_connector - filled frame connector
+#         dir_path - path to the generated folder
+#         zvalue - optional, z value of the t video, the kinematics are computed from the cell centroids at this z
+#                  value, if None (global linking) from the centroids of every z slice
+# output: 0 if the output was written, -1 if not (see format_output)
+def finish(frame_connector, dir_path, zvalue=None):
+    ret = 0
+    table_format = "csv" if OUTPUT_FORMAT == "store" else OUTPUT_FORMAT     # format of the morphology and kinematics
+    if WRITE_OUTPUT:
+        with metrics.timer("format_output"):
+            ret = format_output(frame_connector, dir_path, output_format=OUTPUT_FORMAT, mode=OUTPUT_MODE)
+
+    if ANALYZE:
+        with metrics.timer("analyze_data"):
+            if data_analysis.analyze_frame_connector(frame_connector, TVALUE,
+                                                     output_path=dir_path + "/cptracker_summary.csv") == -1:
+                ret = -1
+
+    if MORPHOLOGY:
+        with metrics.timer("morphology"):
+            if morphology.write_morphology(frame_connector, dir_path, pixel_size=VOXEL_SIZE[0], z_step=VOXEL_SIZE[1],
+                                           output_format=table_format) == -1:
+                ret = -1
+
+    if KINEMATICS:
+        with metrics.timer("kinematics"):
+            if kinematics.analyze_frame_connector(frame_connector, dir_path,
+                                                  zvalue=zvalue,
+                                                  output_format=table_format) == -1:
+                ret = -1
+
+    if metrics.ENABLED:
+        metrics.save_json(dir_path + "/cptracker_metrics.json")
+        metrics.save_prometheus(dir_path + "/cptracker_metrics.prom", labels={"dataset": FOLDER_NAME})
+        metrics.enable(False)
+        print("Metrics saved to " + dir_path + "/cptracker_metrics.json")
+
+    return ret
 
 # generate list of filenames for each video to run -- one z-constant video at the user-specified ZVALUE,
 # and then t-constant videos for each user-specified TVALUE
-# inputs: gen_file_list -- a list of the files in the generated directory with correctly named .npy files
+# inputs: gen_file_list -- a list of the txxx_zxxx names (frame_ids) of the .npy files in the dataset manifest
 #         zvalues -- user-specified value to split the z-stack (t-constant) videos at and create t-constant video at
 #         tvalue -- user-specififed values to create t-constant (z-stack) videos of
-#         dir_path -- the path to the directory containing the images
-# output: vids_list -- nested list of file names that belonging to first, the t (z-constant) video, then
+# output: vids_list -- nested list of frame_ids that belonging to first, the t (z-constant) video, then
 #                      each z-stack (t-constant) video in the user-specified order, split at the TVALUE, with
 #                      lists in order [upper z0, lower z0, upper z1, lower z1, ... upper zn, lower zn]
-def generate_video_lists(gen_file_list, zvalue, tvalues, dir_path):
+#                      note: frame_ids are resolved to the PATHs of the .npys through the dataset manifest
+def generate_video_lists(gen_file_list, zvalue, tvalues):
 
     vids_list = []      # output nested list of files in t- and z-constant videos
 
-    # get maximum z and t to create dataframe
-    z_max = 0
-    t_max = 0
-    for file in gen_file_list:
-        z_num = int(re.search(r'z[0-9]{3}', file).group(0)[1:])
-        if z_num > z_max:
-            z_max = z_num
-        t_num = int(re.search(r't[0-9]{3}', file).group(0)[1:])
-        if t_num > t_max:
-            t_max = t_num
-
-    frame_df = pd.DataFrame(index=range(z_max),columns=range(t_max))            # create dataframe with time as columns
-                                                                                # and z as rows
-    # add filenames to their appropriate cell in the dataframe
-    for file in gen_file_list:
-        z_num = int(re.search(r'z[0-9]{3}', file).group(0)[1:])
-        t_num = int(re.search(r't[0-9]{3}', file).group(0)[1:])
-        frame_df.at[z_num, t_num] = file
+    grid = DatasetGrid.DatasetGrid(gen_file_list)     # index of the frames by (t, z)
 
     # extract (t) z-constant video file names
-    t_list = frame_df.loc[[zvalue]].to_numpy()[0]
-    t_list = list(t_list[~pd.isna(t_list)])  # remove NaNs and append to video list
+    t_list = grid.t_video(zvalue)
     if not len(t_list) == 0:
-        path_t_list = []
-        for i in t_list:
-            path_t_list.append(dir_path + "/" + str(i) + ".npy")  # add full path to file names
-        vids_list.append(path_t_list)
+        vids_list.append(t_list)
+    missing = grid.missing_frames(z=zvalue)
+    if missing:
+        print("Warning: the t video at z = " + str(zvalue) + " is missing frames " + str(missing))
 
     # extract upper and lower (z) t-constant video file names
     for z in tvalues:
-        upper_z_list = frame_df.loc[0:zvalue][z].to_numpy()
-        upper_z_list = upper_z_list[~pd.isna(upper_z_list)]     # remove NaNs and append to video list
+        if z not in grid.t_values:
+            print("Warning: there are no frames at t = " + str(z) + ", the z videos at that t will not be run")
+            continue
+        missing = grid.missing_frames(t=z)
+        if missing:
+            print("Warning: the z videos at t = " + str(z) + " are missing frames " + str(missing))
+
+        upper_z_list, lower_z_list = grid.z_video(z, zvalue)
         if not len(upper_z_list) == 0:
-            path_upper_z_list = []
-            for i in upper_z_list:
-                path_upper_z_list.append(dir_path + "/" + str(i) + ".npy")     # add full path to file names
-            vids_list.append(path_upper_z_list)
-
-        lower_z_list = frame_df.loc[zvalue:z_max][z].to_numpy()
-        lower_z_list = lower_z_list[~pd.isna(lower_z_list)]
+            vids_list.append(upper_z_list)
         if not len(lower_z_list) == 0:
-            path_lower_z_list = []
-            for i in lower_z_list:
-                path_lower_z_list.append(dir_path + "/" + str(i) + ".npy")  # add full path to file names
-            vids_list.append(path_lower_z_list)
+            vids_list.append(lower_z_list)
 
     return vids_list
 
@@ -160,8 +333,15 @@ def generate_video_lists(gen_file_list, zvalue, tvalues, dir_path):
 # z oordinate (starting from 1), and frame number (time, starting from 1)
 # inputs: frame_connector - filled frame connector
 #         file_path - path to the folder the file will be created in
-# output: csv containing information retrieved from FrameConnector
-def format_output(frame_connector, file_path):
+#         output_format - "csv" (default), "parquet" for a single cptracker_output.parquet file, or "npz" for a
+#                         cptracker_output_npz folder of .npz chunks, the binary formats contain the same columns as
+#                         the csv stored as int32 and are written in vectorized batches, or "store" for an indexed
+#                         cptracker_store folder (see ResultsStore.py, outline mode only)
+#         mode - "outline" (default) to write every outline coordinate, or "summary" to write cptracker_summary_output
+#                with one row per cell per (t, z) with columns: cell, t, z, centroid_x, centroid_y, area, min_x, min_y,
+#                max_x, max_y (see export_output.iter_summary_batches)
+# output: csv (or .parquet/.npz) containing information retrieved from FrameConnector
+def format_output(frame_connector, file_path, output_format="csv", mode="outline"):
 
     if frame_connector.is_empty():
         print("Error: FrameConnector is empty")
@@ -170,6 +350,36 @@ def format_output(frame_connector, file_path):
         print("Error: could not find folder " + str(file_path))
         return -1
 
+    if mode == "summary":
+        summary_path = file_path + "/cptracker_summary_output"
+        batches = export_output.iter_summary_batches(frame_connector)
+        if output_format == "csv":
+            return export_output.write_csv(batches, summary_path + ".csv", export_output.SUMMARY_COLUMNS,
+                                           export_output.SUMMARY_FMT)
+        elif output_format == "parquet":
+            return export_output.write_parquet(batches, summary_path + ".parquet", export_output.SUMMARY_COLUMNS)
+        elif output_format == "npz":
+            return export_output.write_npz(batches, summary_path + "_npz", export_output.SUMMARY_COLUMNS)
+        elif output_format == "store":
+            print("Error: the store output format is only used for the outline output mode")
+            return -1
+    elif mode != "outline":
+        print("Error: output mode " + str(mode) + " not recognized, must be one of: [outline, summary]")
+        return -1
+
+    if output_format == "parquet":
+        return export_output.write_parquet(export_output.iter_outline_batches(frame_connector),
+                                           file_path + "/cptracker_output.parquet")
+    elif output_format == "npz":
+        return export_output.write_npz(export_output.iter_outline_batches(frame_connector),
+                                       file_path + "/cptracker_output_npz")
+    elif output_format == "store":
+        return ResultsStore.write_store(frame_connector, file_path + "/" + ResultsStore.STORE_DIR_NAME)
+    elif output_format != "csv":
+        print("Error: output format " + str(output_format) + " not recognized, must be one of: [csv, parquet, npz, "
+              "store]")
+        return -1
+
     coord_file_loc = file_path + "/cptracker_output.csv"
     coord_fp = open(coord_file_loc, "w")
 
@@ -4,8 +4,7 @@
 # Matches the cells tracked by each tracker to their global ID and puts their coordinates in a global FrameConnector
 # data structure
 import math
-from shapely.geometry import Point
-from shapely.geometry.polygon import Polygon
+import metrics
 
 # matches the cells tracked by each tracker to their global_id and adds them to the FrameConnector
 # inputs: cpframe_list - list of the CPFrame data structures extracted from the .npy images
@@ -16,8 +15,29 @@ from shapely.geometry.polygon import Polygon
 # output: None
 def match(cpframe_list, frame_connector, coords_list):
 
+    # the first video in the list (the time/z-constant video) is matched when the FrameConnector is empty
+    records = match_records(cpframe_list, frame_connector.get_first_vid_list(), coords_list,
+                            frame_connector.is_empty())
+
+    for cell_id, frame, coords in records:
+        frame_connector.add_cell(cell_id, frame, coords)
+
+
+# matches the cells tracked by each tracker to their global_id without adding them to a FrameConnector, so matching
+# can be run in a separate process and the results added to the FrameConnector later, in the same order
+# inputs: cpframe_list - list of the CPFrame data structures extracted from the .npy images
+#         first_vid_list - the first video cell center list from the FrameConnector
+#         coords_list - list of lists containing the center coordinate information of each tracker for each
+#                       frame in the video (see match)
+#         first_video - boolean; True if this is the first video (the time/z-constant video), which assigns the
+#                       global IDs
+# output: records - list of (cell_id, frame_id, coords) in the order they are added to the FrameConnector
+def match_records(cpframe_list, first_vid_list, coords_list, first_video):
+    from shapely.geometry import Point, Polygon     # loaded when matching, not when the module is imported
+    records = []
+
     # list the cell coordinates in the global order of the cell trackers
-    if frame_connector.is_empty():      # this is the first video in the list (the time/z-constant video)
+    if first_video:      # this is the first video in the list (the time/z-constant video)
         new_coords_list = coords_list
 
     else:     # this is a z (time-constant) video
@@ -27,9 +47,12 @@ def match(cpframe_list, frame_connector, coords_list):
         new_coords_list = []
 
         # match center coordinates of trackers at first frame of first video to trackers in first frame of current video
-        first_vid_cells_list = frame_connector.get_first_vid_list()
+        first_vid_cells_list = first_vid_list
 
         for coord in first_vid_cells_list:
+            if coord is None:       # cell has no center in the first video (e.g. its tracker left the frame)
+                new_coords_list.append(None)
+                continue
             coord = tuple(coord)
             near_point = near(coord, center_coords_list, 10)     # if point is nearby a point in the list, Euclidean distance 5
             if near_point:
@@ -37,8 +60,10 @@ def match(cpframe_list, frame_connector, coords_list):
                 new_coords_list.append(coords_list[c_index])        # coordinates of the cell the tracker is tracking
             else:
                 new_coords_list.append(None)
+                metrics.count("match_unmatched_trackers")
 
     # for each frame, match center coordinate of ordered trackers to cell and add to FrameConnector
+    attempts = 0        # number of tracker coordinates looked up, for the match hit rate
     for i in range(len(cpframe_list)):
         frame = cpframe_list[i].get_frame_id()
 
@@ -56,12 +81,18 @@ def match(cpframe_list, frame_connector, coords_list):
             elif not new_coords_list[j][i]:     # coordinate is None, tracker was aborted before the video completed
                 continue
 
+            attempts += 1
             cell_center = Point(new_coords_list[j][i])     # the cell center of the tracker at the given frame
             # get the coordinates in the outline of the cell containing the given point, if this cell exists
             coords = get_cell_containing_point(poly_list, outlines_list, cell_center)
             if coords is not None:
                 # coords_list = [new_coords_list[j][i], coords]       # cell center first for easier debugging
-                frame_connector.add_cell(j, frame, coords)
+                records.append((j, frame, coords))
+
+    metrics.count("match_hits", len(records))
+    metrics.count("match_misses", attempts - len(records))
+
+    return records
 
 
 # return the outline of a cell that contains a point, if one exists
@@ -0,0 +1,187 @@
+# Chloe Fugle (chloe.m.fugle.23@dartmouth.edu)
+# 10/19/2026
+# Bio97 Thesis Project
+# Instrumentation of the CPTracker stages: wall time and number of calls of each stage, event counters (e.g. match
+# hits and misses, .png cache hits), per-frame tracker counts, and peak memory, exported as .json and as a Prometheus
+# text file
+# Metrics are only collected after enable() is called, when disabled every function returns immediately and timer()
+# returns a shared context that does nothing, so the instrumented code runs at the same speed
+# note: metrics are collected per process, the z videos run in parallel worker processes (main.WORKERS > 1) are only
+#       counted in the time of the match_videos_parallel stage
+
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+
+ENABLED = False
+
+_stage_seconds = {}     # stage name -> total wall time in seconds
+_stage_calls = {}       # stage name -> number of calls
+_counters = {}          # counter name -> value
+_series = {}            # series name -> list of dictionaries, one per frame
+_start = time.time()
+_lock = threading.Lock()    # metrics are also collected in the prefetch thread (see run_tracker)
+
+_NULL_TIMER = contextlib.nullcontext()
+
+
+# turns the collection of metrics on or off
+# input: enabled - boolean, defaults to True
+# output: None
+def enable(enabled=True):
+    global ENABLED
+    ENABLED = enabled
+
+
+# clears every metric collected
+def reset():
+    global _start
+    _stage_seconds.clear()
+    _stage_calls.clear()
+    _counters.clear()
+    _series.clear()
+    _start = time.time()
+
+
+# times a stage, use as: with metrics.timer("stage name"): ...
+# input: stage - name of the stage
+# output: context manager that adds its wall time to the stage
+def timer(stage):
+    if not ENABLED:
+        return _NULL_TIMER
+    return _Timer(stage)
+
+
+class _Timer:
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        add_time(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+# adds time to a stage
+# inputs: stage - name of the stage
+#         seconds - wall time in seconds
+#         calls - number of calls to add, defaults to 1
+# output: None
+def add_time(stage, seconds, calls=1):
+    if not ENABLED:
+        return
+    with _lock:
+        _stage_seconds[stage] = _stage_seconds.get(stage, 0.0) + seconds
+        _stage_calls[stage] = _stage_calls.get(stage, 0) + calls
+
+
+# adds to a counter
+# inputs: name - name of the counter
+#         value - amount to add, defaults to 1
+# output: None
+def count(name, value=1):
+    if not ENABLED:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+# adds a row to a series (e.g. the number of live trackers in each frame)
+# inputs: name - name of the series
+#         row - dictionary of the values of the row
+# output: None
+def record(name, row):
+    if not ENABLED:
+        return
+    with _lock:
+        _series.setdefault(name, []).append(row)
+
+
+# returns the peak resident memory of this process and of its finished child processes, in bytes, or (None, None)
+# where the resource module is not available (Windows)
+def peak_rss():
+    try:
+        import resource     # Unix only, imported here so the instrumented modules still import on Windows
+    except ImportError:
+        return None, None
+
+    scale = 1 if sys.platform == "darwin" else 1024      # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+    return own, children
+
+
+# returns every metric collected
+# output: dictionary of the stages (seconds, calls, seconds per call), counters, rates derived from the counters
+#         (frames per second of the trackers, match hit rate, .png cache hit rate), series, and peak memory
+def report():
+    stages = {}
+    for stage in _stage_seconds:
+        stages[stage] = {"seconds": _stage_seconds[stage], "calls": _stage_calls[stage],
+                         "per_call": _stage_seconds[stage] / max(_stage_calls[stage], 1)}
+
+    rates = {}
+    if _stage_seconds.get("tracker.update", 0) > 0:
+        rates["tracker_fps"] = _stage_calls["tracker.update"] / _stage_seconds["tracker.update"]
+    if _counters.get("match_hits", 0) + _counters.get("match_misses", 0) > 0:
+        rates["match_hit_rate"] = _counters.get("match_hits", 0) / (_counters.get("match_hits", 0)
+                                                                    + _counters.get("match_misses", 0))
+    if _counters.get("png_cache_hits", 0) + _counters.get("png_cache_misses", 0) > 0:
+        rates["png_cache_hit_rate"] = _counters.get("png_cache_hits", 0) / (_counters.get("png_cache_hits", 0)
+                                                                            + _counters.get("png_cache_misses", 0))
+
+    own, children = peak_rss()
+    return {"version": 1, "elapsed_seconds": time.time() - _start, "stages": stages, "counters": dict(_counters),
+            "rates": rates, "peak_rss_bytes": own, "peak_rss_children_bytes": children,
+            "series": {name: list(rows) for name, rows in _series.items()}}
+
+
+# saves the metrics as .json
+# input: file_path - PATH of the .json file
+# output: None
+def save_json(file_path):
+    with open(file_path, "w") as fp:
+        json.dump(report(), fp, indent=1)
+
+
+# saves the metrics in the Prometheus text format (e.g. for the node_exporter textfile collector), the series are only
+# saved in the .json
+# inputs: file_path - PATH of the .prom file
+#         labels - optional, dictionary of labels added to every metric (e.g. {"dataset": FOLDER_NAME})
+# output: None
+def save_prometheus(file_path, labels=None):
+    data = report()
+    base = [(k, v) for k, v in (labels or {}).items()]
+    lines = []
+
+    def add(name, kind, help_text, rows):
+        lines.append("# HELP cptracker_" + name + " " + help_text)
+        lines.append("# TYPE cptracker_" + name + " " + kind)
+        for extra, value in rows:
+            label_str = ",".join(k + '="' + str(v).replace("\\", "\\\\").replace('"', '\\"') + '"'
+                                 for k, v in base + extra)
+            lines.append("cptracker_" + name + ("{" + label_str + "}" if label_str else "") + " " + repr(float(value)))
+
+    add("stage_seconds_total", "counter", "Wall time spent in each stage.",
+        [([("stage", s)], v["seconds"]) for s, v in data["stages"].items()])
+    add("stage_calls_total", "counter", "Number of calls of each stage.",
+        [([("stage", s)], v["calls"]) for s, v in data["stages"].items()])
+    add("events_total", "counter", "Number of events of each kind.",
+        [([("event", c)], v) for c, v in data["counters"].items()])
+    for rate, value in data["rates"].items():
+        add(rate, "gauge", "Rate derived from the stage timings and counters.", [([], value)])
+    if data["peak_rss_bytes"] is not None:
+        add("peak_rss_bytes", "gauge", "Peak resident memory of the CPTracker process.", [([], data["peak_rss_bytes"])])
+    add("elapsed_seconds", "gauge", "Wall time since the metrics were reset.", [([], data["elapsed_seconds"])])
+
+    # written to a temporary file first so a collector never reads a partial file
+    tmp_file = file_path + "." + str(os.getpid()) + ".tmp"
+    with open(tmp_file, "w") as fp:
+        fp.write("\n".join(lines) + "\n")
+    os.replace(tmp_file, file_path)
@@ -0,0 +1,140 @@
+# Chloe Fugle (chloe.m.fugle.23@dartmouth.edu)
+# 10/19/2026
+# Bio97 Thesis Project
+# Reconstructs the 3D shape of every linked cell at each t from its outlines in the FrameConnector: the outlines of each
+# z slice are filled into a (z, y, x) label stack of the t, and the volume, surface area, z extent, and 3D centroid of
+# every cell are computed from the whole stack at once with bincounts (voxels and coordinates) and face counting
+# (surface area), rather than cell by cell or pixel by pixel
+# note: where the filled outlines of two cells overlap in a slice, the pixels belong to the cell with the higher ID
+
+import cv2
+import numpy as np
+
+import export_output
+from FrameConnector import frame_tz_arrays
+
+MORPHOLOGY_COLUMNS = ["cell", "t", "volume", "surface_area", "z_min", "z_max", "z_extent", "slices", "centroid_x",
+                      "centroid_y", "centroid_z"]
+MORPHOLOGY_FMT = ["%d", "%d", "%.2f", "%.2f", "%d", "%d", "%.2f", "%d", "%.2f", "%.2f", "%.2f"]
+
+
+# groups the outlines of the FrameConnector by t
+# input: frame_connector - filled FrameConnector
+# output: dictionary of t -> list of (label, z, outline) with the global cell id + 1 as the label and the outline as an
+#         int32 array of shape (pixels, 2), in order of t, outlines that are empty or have no t and z are left out
+def outlines_by_t(frame_connector):
+    cell_ids, frame_ids, offsets, coords = frame_connector.get_outline_arrays()
+
+    t_arr, z_arr = frame_tz_arrays(frame_ids)
+
+    by_t = {}
+    for i in np.flatnonzero((np.diff(offsets) > 0) & (t_arr >= 0)):
+        by_t.setdefault(int(t_arr[i]), []).append((int(cell_ids[i]) + 1, int(z_arr[i]),
+                                                   coords[offsets[i]:offsets[i + 1]]))
+
+    return {t: by_t[t] for t in sorted(by_t)}
+
+
+# fills the outlines of one t into a (z, y, x) label stack covering the bounding box of the outlines
+# input: records - list of (label, z, outline) of the t (see outlines_by_t)
+# output: (stack, origin, labels) - int32 label stack with 0 for no cell and i + 1 for the cell labels[i], origin is the
+#         (z, y, x) of stack[0, 0, 0], and labels the sorted cell labels in the stack
+def fill_stack(records):
+    z_arr = np.array([z for label, z, outline in records])
+    all_coords = np.concatenate([outline for label, z, outline in records])
+    x0, y0 = all_coords.min(axis=0)
+    x1, y1 = all_coords.max(axis=0)
+    z0 = int(z_arr.min())
+
+    # labels are renumbered from 1 within the stack so the bincounts are only as long as the number of cells at the t
+    labels = np.unique([label for label, z, outline in records])
+    stack = np.zeros((int(z_arr.max()) - z0 + 1, int(y1 - y0) + 1, int(x1 - x0) + 1), dtype=np.int32)
+    for label, z, outline in sorted(records, key=lambda r: r[0]):
+        points = (outline - np.array([x0, y0], dtype=outline.dtype)).astype(np.int32).reshape(-1, 1, 2)
+        cv2.fillPoly(stack[z - z0], [points], int(np.searchsorted(labels, label)) + 1)
+
+    return stack, (z0, int(y0), int(x0)), labels
+
+
+# measures every cell in a label stack
+# inputs: stack, origin, labels - see fill_stack
+#         pixel_size - width of a pixel in x and y, defaults to 1 (volume in voxels)
+#         z_step - distance between z slices, defaults to 1
+# output: dictionary of the MORPHOLOGY_COLUMNS other than cell and t, one value per label
+#         volume - number of voxels of the cell times the voxel volume
+#         surface_area - area of the voxel faces between the cell and any other label or the background, counting
+#                        the x and y faces as pixel_size * z_step and the z faces as pixel_size ** 2
+#         z_min, z_max, slices - lowest and highest z value of the cell and the number of slices it is in
+#         z_extent - (z_max - z_min + 1) * z_step
+#         centroid_x, centroid_y, centroid_z - mean pixel coordinates and z value of the voxels of the cell
+def measure_stack(stack, origin, labels, pixel_size=1.0, z_step=1.0):
+    length = len(labels) + 1
+    flat = stack.ravel()
+    counts = np.bincount(flat, minlength=length)
+
+    zz, yy, xx = np.indices(stack.shape, sparse=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        centroid_z = np.bincount(flat, weights=np.broadcast_to(zz, stack.shape).ravel(), minlength=length) / counts
+        centroid_y = np.bincount(flat, weights=np.broadcast_to(yy, stack.shape).ravel(), minlength=length) / counts
+        centroid_x = np.bincount(flat, weights=np.broadcast_to(xx, stack.shape).ravel(), minlength=length) / counts
+
+    # voxels of each label in each slice, to find the slices each cell is in
+    slice_counts = np.bincount((flat + length * np.repeat(np.arange(stack.shape[0]), stack[0].size)),
+                               minlength=length * stack.shape[0]).reshape(stack.shape[0], length)
+    present = slice_counts > 0
+    z_min = np.argmax(present, axis=0)
+    z_max = stack.shape[0] - 1 - np.argmax(present[::-1], axis=0)
+
+    # faces between different labels along each axis, padded with background so the faces at the edges are counted
+    padded = np.pad(stack, 1)
+    faces = np.zeros(length)
+    for axis, face_area in ((0, pixel_size * pixel_size), (1, pixel_size * z_step), (2, pixel_size * z_step)):
+        low = padded[tuple(slice(None, -1) if a == axis else slice(None) for a in range(3))]
+        high = padded[tuple(slice(1, None) if a == axis else slice(None) for a in range(3))]
+        differ = low != high
+        faces += face_area * (np.bincount(low[differ], minlength=length) + np.bincount(high[differ], minlength=length))
+
+    return {"volume": counts[1:] * pixel_size * pixel_size * z_step,
+            "surface_area": faces[1:],
+            "z_min": z_min[1:] + origin[0],
+            "z_max": z_max[1:] + origin[0],
+            "z_extent": (z_max[1:] - z_min[1:] + 1) * z_step,
+            "slices": present[:, 1:].sum(axis=0),
+            "centroid_x": centroid_x[1:] + origin[2],
+            "centroid_y": centroid_y[1:] + origin[1],
+            "centroid_z": centroid_z[1:] + origin[0]}
+
+
+# measures the 3D shape of every cell in the FrameConnector at each t, one t at a time
+# inputs: frame_connector - filled FrameConnector
+#         pixel_size, z_step - see measure_stack
+# output: generator of dictionaries mapping each column in MORPHOLOGY_COLUMNS to an array, one batch per t, that can be
+#         written with export_output.write_csv, write_parquet, or write_npz
+#         note: cells start from 1, cells whose outlines are all covered by other cells are left out, and at t values
+#               without a z video (tracker mode) each cell has a single slice
+def iter_morphology_batches(frame_connector, pixel_size=1.0, z_step=1.0):
+    for t, records in outlines_by_t(frame_connector).items():
+        stack, origin, labels = fill_stack(records)
+        batch = measure_stack(stack, origin, labels, pixel_size=pixel_size, z_step=z_step)
+
+        keep = batch["slices"] > 0
+        batch = {column: values[keep] for column, values in batch.items()}
+        batch["cell"] = labels[keep].astype(np.int32)
+        batch["t"] = np.full(len(batch["cell"]), t, dtype=np.int32)
+        yield batch
+
+
+# measures the 3D shape of every cell in the FrameConnector and writes it to cptracker_morphology in the output folder
+# inputs: frame_connector - filled FrameConnector
+#         dir_path - PATH of the folder to write the table to
+#         pixel_size, z_step - see measure_stack
+#         output_format - "csv" (default), "parquet", or "npz", as in main.format_output
+# output: 0 if the table was written, -1 if not
+def write_morphology(frame_connector, dir_path, pixel_size=1.0, z_step=1.0, output_format="csv"):
+    if frame_connector.is_empty():
+        print("Error: FrameConnector is empty")
+        return -1
+
+    return export_output.write_batches(iter_morphology_batches(frame_connector, pixel_size=pixel_size, z_step=z_step),
+                                       dir_path + "/cptracker_morphology", MORPHOLOGY_COLUMNS, MORPHOLOGY_FMT,
+                                       output_format)
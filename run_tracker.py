@@ -8,7 +8,11 @@ import load_npy
 import frames_to_video
 import tracker
 import match_coords
+import metrics
+import concurrent.futures
 import os
+import queue
+import threading
 
 # convert a list of .npy images to an .mp4 video, then runs the cell tracker for that video
 # input: image_list - list of all .npy images in the order of the video
@@ -20,29 +24,112 @@ import os
 #        video_fps - int; frames per second of output .mp4 created from the .npys (not tracking video), default is 4
 #        overwrite_images - boolean; if True, .pngs generated from .npys will be overwritten (if present), if False,
 #                           .pngs will not be re-generated
+#        plot_file - optional, path of an image file to save the cell tracker plot to (offscreen, does not block),
+#                    if None the plot is displayed and the program waits for the plot window to be closed
+#        manifest - optional, dataset manifest (see dataset_manifest.build_manifest), if given image_list is a list of
+#                   frame_ids (txxx_zxxx) that are resolved to the PATHs of the .npys through the manifest, and the
+#                   .pngs are saved in folder_name as [frame_id].npy.png
+#        display - boolean; if True (default), the tracking video is shown while tracking
+#        video_name - name of the .mp4 video, defaults to cell_tracker_video (see track_video)
+#        prepared - optional, the video prepared ahead of time by prefetch_videos (see track_video)
 # output: none
 def run_tracker(image_list, tracker_type, frame_connector, jump_limit, folder_name,
-                first_video=False, video_fps=4, overwrite_image=False, rand_num=None):
+                first_video=False, video_fps=4, overwrite_image=False, rand_num=None, plot_file=None,
+                manifest=None, display=True, video_name="cell_tracker_video", prepared=None):
+
+    cpframe_list, coords_list = track_video(image_list, tracker_type, jump_limit, folder_name, video_fps=video_fps,
+                                            overwrite_image=overwrite_image, rand_num=rand_num, video_name=video_name,
+                                            display=display, manifest=manifest, prepared=prepared)
+    if first_video:
+        ff_coords_list = [x for x in coords_list if x]         # remove empty lists
+        ff_coords_list = [x[0] for x in ff_coords_list]        # coordinates in the first frame
+        frame_connector.set_first_vid_list(ff_coords_list)
+
+
+    # match trackers to cells and add their coordinates to FrameConnector
+    print("Matching trackers...\n\n")
+    with metrics.timer("match_coords.match"):
+        match_coords.match(cpframe_list, frame_connector, coords_list)
+
+    # cell tracker plot for each video -- good for checking tracking accuracy
+    with metrics.timer("plot"):
+        if plot_file:
+            frame_connector.save_plot(plot_file)
+        else:
+            frame_connector.plot_cells()
+
+    # frame_connector.print_FC_simple()
+
+    return frame_connector
+
+
+# convert a list of .npy images to an .mp4 video and runs the cell tracker on it, without matching
+# inputs: see run_tracker
+#         video_name - name of the .mp4 video (and .avi tracking video) written to folder_name, must be unique for
+#                      videos that are tracked at the same time
+#         display - boolean; if True (default), the tracking video is shown while tracking
+#         prepared - optional, (cpframe_list, video_file_path) of the video from prepare_video, if given the .npys are
+#                    not loaded again
+# output: cpframe_list - list of the CPFrames of each frame in the video
+#         coords_list - list of lists containing the center coordinate information of each tracker for each frame
+def track_video(image_list, tracker_type, jump_limit, folder_name, video_fps=4, overwrite_image=False, rand_num=None,
+                video_name="cell_tracker_video", display=True, manifest=None, prepared=None):
+
+    if prepared is None:
+        prepared = prepare_video(image_list, folder_name, video_fps=video_fps, overwrite_image=overwrite_image,
+                                 video_name=video_name, manifest=manifest)
+    cpframe_list, video_file_path = prepared
+    frame_num = len(cpframe_list)
+
+    # run the tracker program on the video
+    if video_name == "cell_tracker_video":
+        output_path = None      # tracking video saved as [tracker_type].avi
+    else:
+        output_path = folder_name + "/" + video_name + "_" + tracker_type + ".avi"
+    with metrics.timer("tracker.track"):
+        coords_list = tracker.track(video_file_path, frame_num, tracker_type, cpframe_list[0], jump_limit,
+                                    rand_num=rand_num, display=display, output_path=output_path)
+
+    return cpframe_list, coords_list
+
+
+# loads the .npys of a video, generating their .pngs, and converts the .pngs to an .mp4 video to be tracked
+# inputs: see run_tracker and track_video
+# output: cpframe_list - list of the CPFrames of each frame in the video
+#         video_file_path - PATH of the .mp4 video, folder_name/[video_name].mp4
+def prepare_video(image_list, folder_name, video_fps=4, overwrite_image=False, video_name="cell_tracker_video",
+                  manifest=None):
 
     # convert all .npy in folder to pngs
     png_list = []
     cpframe_list = []
-    frame_num = 0
     for npy in image_list:
 
+        # resolve the frame_id to the .npy through the manifest, if given
+        if manifest:
+            frame_id = npy
+            npy = manifest[frame_id]
+            png_name = folder_name + "/" + frame_id + ".npy.png"
+        else:
+            frame_id = None
+            png_name = npy + ".png"
+
         # check to see if the png already exists, if so, don't create again
-        png_name = npy + ".png"
         if os.path.exists(png_name):
             # if overwrite_image == True, force-generate pngs by setting png_generate = False
             bool = not overwrite_image
 
             # load information contained in .npys, generate pngs only if png_generated == False
-            png, cpframe = load_npy.load(npy, png_generated=bool)
+            with metrics.timer("load_npy.load"):
+                png, cpframe = load_npy.load(npy, png_generated=bool, png_name=png_name, frame_id=frame_id)
+            metrics.count("png_cache_hits" if bool else "png_cache_misses")
             print(png + " found")
 
         # create png and load information from .npy
         else:
-            png, cpframe = load_npy.load(npy)
+            with metrics.timer("load_npy.load"):
+                png, cpframe = load_npy.load(npy, png_name=png_name, frame_id=frame_id)
+            metrics.count("png_cache_misses")
             if not png:
                 print("Error:" + npy + " could not be converted to a PNG. "
                                        "Please check the format and restart the program.")
@@ -51,30 +138,108 @@ def run_tracker(image_list, tracker_type, frame_connector, jump_limit, folder_na
 
         png_list.append(png)
         cpframe_list.append(cpframe)
-        frame_num += 1
 
     # convert pngs to mp4 video
-    video_file_path = folder_name + "/cell_tracker_video.mp4"
-    frames_to_video.write_video(video_file_path, png_list, video_fps)
+    video_file_path = folder_name + "/" + video_name + ".mp4"
+    with metrics.timer("frames_to_video.write_video"):
+        frames_to_video.write_video(video_file_path, png_list, video_fps)
 
-    # run the tracker program on the video
-    coords_list = tracker.track(video_file_path, frame_num, tracker_type, cpframe_list[0], jump_limit, rand_num=rand_num)
-    if first_video:
-        ff_coords_list = [x for x in coords_list if x]         # remove empty lists
-        ff_coords_list = [x[0] for x in ff_coords_list]        # coordinates in the first frame
-        frame_connector.set_first_vid_list(ff_coords_list)
+    return cpframe_list, video_file_path
 
 
-    # match trackers to cells and add their coordinates to FrameConnector
-    print("Matching trackers...\n\n")
-    match_coords.match(cpframe_list, frame_connector, coords_list)
+# prepares videos (see prepare_video) in a background thread, one or more videos ahead of the video being tracked,
+# so the .npys of the next video are loaded while the current video is tracked and matched
+# inputs: video_list - list of the lists of .npy images (or frame_ids) of each video, in the order they are tracked
+#         video_names - list of the unique name of each video (see track_video)
+#         folder_name, video_fps, overwrite_image, manifest - see run_tracker
+#         depth - maximum number of prepared videos waiting to be tracked, defaults to 1
+# output: generator of the (cpframe_list, video_file_path) of each video, in the order of video_list
+def prefetch_videos(video_list, video_names, folder_name, video_fps=4, overwrite_image=False, manifest=None, depth=1):
+    prepared_queue = queue.Queue(maxsize=depth)      # bounded, so loading never gets more than depth videos ahead
+    stop = threading.Event()
 
-    # uncomment below for the cell tracker plot to display for each video -- good for checking tracking accuracy
-    frame_connector.plot_cells()
+    def producer():
+        for video, video_name in zip(video_list, video_names):
+            try:
+                item = prepare_video(video, folder_name, video_fps=video_fps, overwrite_image=overwrite_image,
+                                     video_name=video_name, manifest=manifest)
+            except Exception as e:      # raised in the consumer instead
+                item = e
 
-    # frame_connector.print_FC_simple()
+            while not stop.is_set():
+                try:
+                    prepared_queue.put(item, timeout=0.5)
+                    break
+                except queue.Full:
+                    continue
+            if stop.is_set() or isinstance(item, Exception):
+                return
 
-    return frame_connector
+    thread = threading.Thread(target=producer, daemon=True)
+    thread.start()
+    try:
+        for i in range(len(video_list)):
+            item = prepared_queue.get()
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()      # the consumer stopped early, stop preparing videos
+
+
+# tracks and matches one z (time-constant) video, returning the matches instead of adding them to a FrameConnector
+# used as the worker for match_videos_parallel, the tracking video is not displayed
+# inputs: see run_tracker and track_video
+#         first_vid_list - the first video cell center list from the FrameConnector
+#         first_video - boolean; True if the FrameConnector is still empty (see match_coords.match_records)
+# output: records - list of (cell_id, frame_id, coords) to add to the FrameConnector, in order
+def match_video(image_list, tracker_type, first_vid_list, jump_limit, folder_name, video_fps=4, overwrite_image=False,
+                rand_num=None, video_name="cell_tracker_video", first_video=False, manifest=None):
+
+    cpframe_list, coords_list = track_video(image_list, tracker_type, jump_limit, folder_name, video_fps=video_fps,
+                                            overwrite_image=overwrite_image, rand_num=rand_num, video_name=video_name,
+                                            display=False, manifest=manifest)
+
+    return match_coords.match_records(cpframe_list, first_vid_list, coords_list, first_video)
+
+
+# tracks and matches z (time-constant) videos concurrently in a pool of processes, after the time video has set the
+# first video cell center list, and returns the matches of each video in the order of video_jobs so that adding them
+# to the FrameConnector in that order gives the same FrameConnector as running the videos one after another
+# inputs: video_jobs - list of (video index, list of .npy images in the order of the video) to run
+#         tracker_type, jump_limit, folder_name, video_fps, overwrite_image, rand_num - see run_tracker
+#         first_vid_list - the first video cell center list from the FrameConnector
+#         workers - number of processes to run at once
+#         first_video - boolean; True if the FrameConnector is still empty (see match_coords.match_records)
+#         manifest - optional, dataset manifest to resolve frame_ids through (see run_tracker)
+# output: generator of (video index, records) for each video, in the order of video_jobs, where records is the list
+#         of (cell_id, frame_id, coords) to add to the FrameConnector
+def match_videos_parallel(video_jobs, tracker_type, first_vid_list, jump_limit, folder_name, workers, video_fps=4,
+                          overwrite_image=False, rand_num=None, first_video=False, manifest=None):
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = []
+        for v, video in video_jobs:
+            video_name = "cell_tracker_video_" + str(v).zfill(3)     # unique name, videos are written at the same time
+            future = executor.submit(match_video, video, tracker_type, first_vid_list, jump_limit, folder_name,
+                                     video_fps=video_fps, overwrite_image=overwrite_image, rand_num=rand_num,
+                                     video_name=video_name, first_video=first_video,
+                                     manifest=video_manifest(manifest, video))
+            futures.append((v, future))
+
+        for v, future in futures:
+            yield v, future.result()
+
+
+# returns the part of the manifest a video uses, so a job sent to a worker process only carries its own frames (the
+# manifest can hold the segmentations themselves, see main.main)
+# inputs: manifest - dataset manifest, or None
+#         video - list of the frame_ids of the video
+# output: dictionary of the frame_ids of the video and their entries in the manifest, or None if manifest is None
+def video_manifest(manifest, video):
+    if manifest is None:
+        return None
+    return {frame_id: manifest[frame_id] for frame_id in video}
 
 
 # unit test
@@ -0,0 +1,143 @@
+# Chloe Fugle (chloe.m.fugle.23@dartmouth.edu)
+# 10/19/2026
+# Bio97 Thesis Project
+# Generates synthetic (t, z) datasets of Cellpose _seg.npy files, for testing and benchmarking the CPTracker without
+# microscopy data
+# Each cell is an ellipsoid that moves in x and y between timepoints (a random walk with an optional drift), and is cut
+# by every z slice it spans, giving a mask and a shaded image for every (t, z)
+
+import argparse
+import os
+import numpy as np
+
+MIN_AREA = 25       # minimum number of pixels of a cell in a slice
+
+
+# writes a synthetic dataset of _seg.npy files named [prefix]_txxx_zxxx_seg.npy
+# inputs: folder_name - PATH of the folder to write the .npys to, created if it does not exist
+#         t_count - number of timepoints, t values start at 1
+#         z_count - number of z slices, z values start at 1
+#         cell_count - number of cells
+#         size - (width, height) of each image in pixels, defaults to (256, 256)
+#         radius - (min, max) radius of the cells in pixels at their widest z slice, defaults to (8, 14)
+#         z_radius - (min, max) half-height of the cells in z slices, defaults to (2, 5)
+#         motion - standard deviation of the movement of each cell between timepoints in pixels, defaults to 1.5
+#         drift - (x, y) movement of every cell between timepoints in pixels, defaults to (0, 0)
+#         seed - seed of the random number generator, the same seed gives the same dataset
+#         prefix - start of the file names, defaults to "synthetic"
+# output: ground_truth - int array of shape (t_count, cell_count, 3) of the (x, y, z) center of each cell at each t,
+#         the mask label of cell i is i + 1 in every frame it appears in
+def generate(folder_name, t_count, z_count, cell_count, size=(256, 256), radius=(8, 14), z_radius=(2, 5), motion=1.5,
+             drift=(0, 0), seed=0, prefix="synthetic"):
+    if not os.path.isdir(folder_name):
+        os.makedirs(folder_name)
+
+    rng = np.random.default_rng(seed)
+    width, height = size
+    margin = radius[1] + 1
+
+    # cell shapes and starting positions
+    r_xy = rng.uniform(radius[0], radius[1], cell_count)
+    r_z = rng.uniform(z_radius[0], z_radius[1], cell_count)
+    center_z = rng.uniform(1, z_count, cell_count)
+    position = np.column_stack((rng.uniform(margin, width - margin, cell_count),
+                                rng.uniform(margin, height - margin, cell_count)))
+
+    ground_truth = np.zeros((t_count, cell_count, 3), dtype=np.int64)
+    for t in range(1, t_count + 1):
+        if t > 1:       # move the cells, reflecting them off the edges of the image
+            position += rng.normal(0, motion, position.shape) + np.asarray(drift, dtype=float)
+            for axis, limit in ((0, width), (1, height)):
+                low = position[:, axis] < margin
+                position[low, axis] = 2 * margin - position[low, axis]
+                high = position[:, axis] > limit - margin
+                position[high, axis] = 2 * (limit - margin) - position[high, axis]
+        ground_truth[t - 1] = np.column_stack((np.round(position), np.round(center_z)))
+
+        for z in range(1, z_count + 1):
+            masks, img = render_slice(position, r_xy, r_z, center_z, z, size)
+            file_name = prefix + "_t" + str(t).zfill(3) + "_z" + str(z).zfill(3) + "_seg.npy"
+            np.save(folder_name + "/" + file_name, seg_dict(masks, img, file_name, float(2 * r_xy.mean())))
+
+    return ground_truth
+
+
+# draws the cells cut by one z slice
+# inputs: position - float array of shape (cells, 2) of the (x, y) center of each cell
+#         r_xy - radius of each cell in x and y
+#         r_z - half-height of each cell in z
+#         center_z - z center of each cell
+#         z - the z value of the slice
+#         size - (width, height) of the image
+# output: masks - uint16 array of shape (height, width) with 0 for no cell and i + 1 for cell i, where cells overlap
+#                 the cell with the lower label is kept
+#         img - float32 image of the slice, with each cell shaded brighter toward its center
+#         note: cells with fewer than MIN_AREA pixels in the slice are left out
+def render_slice(position, r_xy, r_z, center_z, z, size):
+    width, height = size
+    masks = np.zeros((height, width), dtype=np.uint16)
+    img = np.zeros((height, width), dtype=np.float32)
+
+    # radius of each cell in this slice, 0 for cells the slice does not cut
+    dz = (z - center_z) / r_z
+    r_slice = r_xy * np.sqrt(np.clip(1 - dz * dz, 0, None))
+
+    for i in np.nonzero(r_slice >= 3)[0]:
+        x0 = max(int(position[i, 0] - r_slice[i]), 0)
+        x1 = min(int(position[i, 0] + r_slice[i]) + 2, width)
+        y0 = max(int(position[i, 1] - r_slice[i]), 0)
+        y1 = min(int(position[i, 1] + r_slice[i]) + 2, height)
+        yy, xx = np.mgrid[y0:y1, x0:x1]
+        distance = np.hypot(xx - position[i, 0], yy - position[i, 1]) / r_slice[i]
+
+        inside = (distance <= 1) & (masks[y0:y1, x0:x1] == 0)
+        masks[y0:y1, x0:x1][inside] = i + 1
+        img[y0:y1, x0:x1][inside] = 0.4 + 0.6 * np.cos(distance[inside] * np.pi / 2)
+
+    # remove the slivers left of cells mostly covered by other cells, Cellpose does not segment cells this small
+    counts = np.bincount(masks.ravel(), minlength=len(position) + 1)
+    small = counts < MIN_AREA
+    small[0] = False
+    masks[small[masks]] = 0
+    img[masks == 0] = 0
+
+    return masks, img
+
+
+# creates the dictionary saved in a Cellpose _seg.npy file
+# inputs: masks - the label image
+#         img - the image
+#         file_name - name of the image
+#         diameter - the estimated cell diameter
+# output: dictionary with the keys read from _seg.npy files (see load_npy.load)
+def seg_dict(masks, img, file_name, diameter):
+    # outlines are the mask pixels with a neighbor of a different label
+    outlines = np.zeros_like(masks)
+    edge = np.zeros(masks.shape, dtype=bool)
+    edge[1:, :] |= masks[1:, :] != masks[:-1, :]
+    edge[:-1, :] |= masks[:-1, :] != masks[1:, :]
+    edge[:, 1:] |= masks[:, 1:] != masks[:, :-1]
+    edge[:, :-1] |= masks[:, :-1] != masks[:, 1:]
+    outlines[edge & (masks > 0)] = masks[edge & (masks > 0)]
+
+    return {"img": img, "masks": masks, "outlines": outlines, "chan_choose": [0, 0],
+            "ismanual": np.zeros(int(masks.max()), dtype=bool), "filename": file_name, "flows": [],
+            "est_diam": diameter}
+
+
+# generate a dataset from the command line
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Writes a synthetic dataset of Cellpose _seg.npy files.")
+    parser.add_argument("folder_name", help="folder to write the .npys to")
+    parser.add_argument("--t", type=int, default=10, help="number of timepoints")
+    parser.add_argument("--z", type=int, default=8, help="number of z slices")
+    parser.add_argument("--cells", type=int, default=50, help="number of cells")
+    parser.add_argument("--size", type=int, nargs=2, default=[256, 256], help="width and height of the images")
+    parser.add_argument("--radius", type=float, nargs=2, default=[8, 14], help="min and max cell radius in pixels")
+    parser.add_argument("--motion", type=float, default=1.5, help="standard deviation of the movement per timepoint")
+    parser.add_argument("--drift", type=float, nargs=2, default=[0, 0], help="x and y movement per timepoint")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    args = parser.parse_args()
+
+    generate(args.folder_name, args.t, args.z, args.cells, size=tuple(args.size), radius=tuple(args.radius),
+             motion=args.motion, drift=tuple(args.drift), seed=args.seed)
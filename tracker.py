@@ -7,6 +7,7 @@ import cv2
 import os
 import math
 import TrackerDS
+import metrics
 import numpy as np
 
 # sets automatics bounding boxes, tracks the cells contained within the bounding boxes during the video
@@ -17,11 +18,16 @@ import numpy as np
 #         jump_limit - how far the tracker is allowed to move between frames
 #         set_bounds - whether the user will be prompted to manually set the bounds of the embryo, defaults to False
 #         rand_num - randomly select user-specified number of cells to track
+#         display - whether the tracking video is shown in a window, defaults to True, set to False when tracking
+#                   without a display or in a worker process ('ESC' can only be used to exit when displayed)
+#         output_path - PATH of the .avi video of the tracking results, defaults to [tracker_type].avi in the
+#                       current folder
 # output: center_coords_list - list of lists containing the center coordinate information of each tracker for each
 #         frame in the video, in form:
 #        [[tracker 1 center_coord frame 0, 1, 2, ...], [tracker 2 center_coord frame 0, 1, 2...]. ...]
 
-def track(video_file_path, frame_num, tracker_type, init_cpframe, jump_limit, set_bounds=False, rand_num=None):
+def track(video_file_path, frame_num, tracker_type, init_cpframe, jump_limit, set_bounds=False, rand_num=None,
+          display=True, output_path=None):
 
     # set speed of tracking video
     # to freeze at first frame, set speed to 0 (can move through frames by pressing space)
@@ -43,7 +49,9 @@ def track(video_file_path, frame_num, tracker_type, init_cpframe, jump_limit, se
     # initialize video display
     frame_height, frame_width = frame.shape[:2]     # resize the video for a more convenient view
     # initialize video output
-    output = cv2.VideoWriter(f'{tracker_type}.avi',     # initialize video writer to save the results
+    if output_path is None:
+        output_path = f'{tracker_type}.avi'
+    output = cv2.VideoWriter(output_path,     # initialize video writer to save the results
                              cv2.VideoWriter_fourcc(*'XVID'), 60.0,
                              (frame_width, frame_height), True)
     if not ret:
@@ -63,6 +71,75 @@ def track(video_file_path, frame_num, tracker_type, init_cpframe, jump_limit, se
     print("\nInitializing tracker...")
     print("Press 'ESC' at any time to exit.")
 
+    multi_tracker = init_trackers(frame, init_cpframe, tracker_type, rand_num=rand_num)
+
+    fps = 0
+
+    # start tracking frame-by-frame
+    for i in range(frame_num - 1):
+        ret, frame = video.read()
+        if not ret:     # error with video reading
+            print("Video could not be read to tracker.")
+            break
+
+        timer = cv2.getTickCount()      # for calculation of frames per second
+
+        # bounding boxes are drawn on a copy of the frame, so the trackers are not affected by the (randomly colored)
+        # boxes of the trackers updated before them
+        display_frame = frame.copy()
+
+        # multi_tracker cycles through every tracker and updates each tracker individually
+        update_trackers(multi_tracker, frame, display_frame, jump_limit, init_cpframe=init_cpframe,
+                        set_bounds=set_bounds)
+        fps = cv2.getTickFrequency() / (cv2.getTickCount() - timer)     # calculate FPS
+        if metrics.ENABLED:
+            metrics.add_time("tracker.update", 1 / fps)
+            removed = sum(1 for tracker in multi_tracker if tracker.removed())
+            metrics.record("trackers", {"video": os.path.basename(video_file_path), "frame": i + 1,
+                                        "live": len(multi_tracker) - removed, "removed": removed})
+
+        # if desired, display the user-selected ROI
+        if set_bounds:
+            cv2.rectangle(display_frame, embryo_bounds, (0, 150, 0), 2, 1)  # green box
+
+        # print frames per second on the tracking window
+        if fps < 1:
+            fps_str = "< 1"
+        else:
+            fps_str = str(int(fps))
+        cv2.putText(display_frame, "FPS : " + fps_str, (10, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (50, 170, 50), 2)
+
+        # show the updated frame
+        output.write(display_frame)
+        if not display:
+            continue
+        cv2.imshow("Tracking", display_frame)
+        k = cv2.waitKey(s) & 0xff
+        if k == 27:     # if 'ESC' is pressed
+            break
+        if k == 49:     # if 'SPACE' is pressed
+            continue
+
+    video.release()
+    output.release()
+    if display:
+        cv2.destroyAllWindows()
+
+    # create list of lists containing the center coordinate information of each tracker for each frame in the video
+    # [[tracker 1 center_coord center coord, [frame 0, 1, 2, ...], [tracker 2 center_coord frame 0, 1, 2...]. ...]
+    center_coords_list = get_center_coords(multi_tracker)
+
+    return center_coords_list
+
+
+# sets automatic bounding boxes around the cells in the first frame and creates a tracker for each cell
+# inputs: frame - the first frame (BGR image) of the video
+#         init_cpframe - the initialized CPFrame object for the first frame of the video
+#         tracker_type - cv2 tracker algorithm to use, "TrackerCSRT" is recommended
+#         rand_num - randomly select user-specified number of cells to track
+# output: multi_tracker - list of the TrackerDS of each tracker, in order of the cells in init_cpframe
+def init_trackers(frame, init_cpframe, tracker_type, rand_num=None):
+
     multi_tracker = []    # list of all the trackers
 
     # select given number of random cells to track
@@ -101,101 +178,84 @@ def track(video_file_path, frame_num, tracker_type, init_cpframe, jump_limit, se
 
         count += 1
 
-    fps = 0
+    return multi_tracker
 
-    # start tracking frame-by-frame
-    for i in range(frame_num - 1):
-        ret, frame = video.read()
-        if not ret:     # error with video reading
-            print("Video could not be read to tracker.")
-            break
 
-        timer = cv2.getTickCount()      # for calculation of frames per second
+# updates every tracker on the next frame, adding each tracker's center coordinate and removing trackers that have
+# left the frame or ROI or jumped too far
+# inputs: multi_tracker - list of the TrackerDS of each tracker
+#         frame - the next frame (BGR image) of the video
+#         display_frame - copy of the frame to draw the bounding boxes on
+#         jump_limit - how far the tracker is allowed to move between frames
+#         init_cpframe - the CPFrame of the first frame, holds the user-selected ROI if set_bounds is True
+#         set_bounds - whether the user has set the bounds of the embryo, defaults to False
+# output: None
+def update_trackers(multi_tracker, frame, display_frame, jump_limit, init_cpframe=None, set_bounds=False):
 
-        # multi_tracker cycles through every tracker and updates each tracker individually
-        for i in range(len(multi_tracker)):
-            tracker = multi_tracker[i]
-
-            if not multi_tracker[i]:
-                continue
-            elif tracker.removed() and not tracker.get_coords():     # tracker has been removed from video
-                continue
-            elif tracker.removed():     # tracker has been terminated but data is kept
-                tracker.add_coord(None)
-                continue
-
-            ret, bbox = tracker.tracker.update(frame)   # update individual cell tracker
-            fps = cv2.getTickFrequency() / (cv2.getTickCount() - timer)     # calculate FPS
-
-            # update displayed bounding box for next frame or remove tracker if bounding box is out of frame/ROI
-            if ret:
-                # calculate coordinates of bounding box
-                # bbox (bounding box): (upper left x, y, lower right x, y)
-                p1 = (int(bbox[0]), int(bbox[1]))                           # upper left side of bounding box
-                p2 = (int(bbox[0] + bbox[2]), int(bbox[1] + bbox[3]))       # lower right side
-
-                # update cell information in CPFrame based on new tracker location
-                # tracker_center is the integer center (rounded up) coordinate of the tracking box
-                tracker_center = (math.ceil(0.5 * int(p1[0]) + 0.5 * int(p2[0])), math.ceil(0.5 * int(p1[1]) + 0.5 * int(p2[1])))
-                tracker.add_coord(tracker_center)
-
-                # check if any part of the bounding box has exited frame or user-selected ROI
-                if p1[0] < 0 or p2[0] > frame_width or p1[1] < 0 or p2[1] > frame_height:
-                    cv2.rectangle(frame, p1, p2, (0, 0, 150), 2, 1)     # red box
-                    tracker.set_removed(True)   # remove tracker from list to be updated next frame
-
-                # if user has set boundaries, check that inside boundaries
-                elif set_bounds and not init_cpframe.check_boundaries(p1, p2):
-                    cv2.rectangle(frame, p1, p2, (0, 0, 150), 2, 1)     # red box
-                    tracker.set_removed(True)
-
-                # check if tracker has jumped too far between frames
-                elif tracker.check_jump(jump_limit):
-                    cv2.rectangle(frame, p1, p2, (0, 0, 150), 2, 1)  # red box
-                    tracker.set_removed(True, keep=True)
-
-                else:
-                    color = tracker.get_color()
-                    # cv2.rectangle(frame, p1, p2, (255, 0, 0), 2, 1)     # blue box
-                    cv2.rectangle(frame, p1, p2, color, 2, 1)  # multi-colored boxes
-
-            # if desired, display the user-selected ROI
-            if set_bounds:
-                cv2.rectangle(frame, embryo_bounds, (0, 150, 0), 2, 1)  # green box
-
-        # create list of lists containing the center coordinate information of each tracker for each frame in the video
-        # [[tracker 1 center_coord center coord, [frame 0, 1, 2, ...], [tracker 2 center_coord frame 0, 1, 2...]. ...]
-        center_coords_list = []
-        for i in range(len(multi_tracker)):
-            tracker = multi_tracker[i]
-
-            if not multi_tracker[i]:
-                continue
-            elif tracker.removed() and not tracker.get_coords():  # tracker has been removed from frame
-                continue
-
-            temp_list = tracker.get_coords()
-            center_coords_list.append(temp_list)
+    frame_height, frame_width = frame.shape[:2]
 
-        # print frames per second on the tracking window
-        if fps < 1:
-            fps_str = "< 1"
-        else:
-            fps_str = str(int(fps))
-        cv2.putText(frame, "FPS : " + fps_str, (10, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (50, 170, 50), 2)
+    for i in range(len(multi_tracker)):
+        tracker = multi_tracker[i]
 
-        # show the updated frame
-        cv2.imshow("Tracking", frame)
-        output.write(frame)
-        k = cv2.waitKey(s) & 0xff
-        if k == 27:     # if 'ESC' is pressed
-            break
-        if k == 49:     # if 'SPACE' is pressed
+        if not multi_tracker[i]:
+            continue
+        elif tracker.removed() and not tracker.get_coords():     # tracker has been removed from video
+            continue
+        elif tracker.removed():     # tracker has been terminated but data is kept
+            tracker.add_coord(None)
             continue
 
-    video.release()
-    output.release()
-    cv2.destroyAllWindows()
+        ret, bbox = tracker.tracker.update(frame)   # update individual cell tracker
+
+        # update displayed bounding box for next frame or remove tracker if bounding box is out of frame/ROI
+        if ret:
+            # calculate coordinates of bounding box
+            # bbox (bounding box): (upper left x, y, lower right x, y)
+            p1 = (int(bbox[0]), int(bbox[1]))                           # upper left side of bounding box
+            p2 = (int(bbox[0] + bbox[2]), int(bbox[1] + bbox[3]))       # lower right side
+
+            # update cell information in CPFrame based on new tracker location
+            # tracker_center is the integer center (rounded up) coordinate of the tracking box
+            tracker_center = (math.ceil(0.5 * int(p1[0]) + 0.5 * int(p2[0])), math.ceil(0.5 * int(p1[1]) + 0.5 * int(p2[1])))
+            tracker.add_coord(tracker_center)
+
+            # check if any part of the bounding box has exited frame or user-selected ROI
+            if p1[0] < 0 or p2[0] > frame_width or p1[1] < 0 or p2[1] > frame_height:
+                cv2.rectangle(display_frame, p1, p2, (0, 0, 150), 2, 1)     # red box
+                tracker.set_removed(True)   # remove tracker from list to be updated next frame
+
+            # if user has set boundaries, check that inside boundaries
+            elif set_bounds and not init_cpframe.check_boundaries(p1, p2):
+                cv2.rectangle(display_frame, p1, p2, (0, 0, 150), 2, 1)     # red box
+                tracker.set_removed(True)
+
+            # check if tracker has jumped too far between frames
+            elif tracker.check_jump(jump_limit):
+                cv2.rectangle(display_frame, p1, p2, (0, 0, 150), 2, 1)  # red box
+                tracker.set_removed(True, keep=True)
+
+            else:
+                color = tracker.get_color()
+                # cv2.rectangle(frame, p1, p2, (255, 0, 0), 2, 1)     # blue box
+                cv2.rectangle(display_frame, p1, p2, color, 2, 1)  # multi-colored boxes
+
+
+# returns the center coordinates of every tracker that has not been removed from the video
+# input: multi_tracker - list of the TrackerDS of each tracker
+# output: center_coords_list - list of lists containing the center coordinate information of each tracker for each
+#         frame, in form [[tracker 1 center_coord frame 0, 1, 2, ...], [tracker 2 center_coord frame 0, 1, 2...]. ...]
+def get_center_coords(multi_tracker):
+    center_coords_list = []
+    for i in range(len(multi_tracker)):
+        tracker = multi_tracker[i]
+
+        if not multi_tracker[i]:
+            continue
+        elif tracker.removed() and not tracker.get_coords():  # tracker has been removed from frame
+            continue
+
+        temp_list = tracker.get_coords()
+        center_coords_list.append(temp_list)
 
     return center_coords_list
 
@@ -0,0 +1,245 @@
+# Chloe Fugle (chloe.m.fugle.23@dartmouth.edu)
+# 10/19/2026
+# Bio97 Thesis Project
+# Online mode of the CPTracker: watches the dataset folder while Cellpose is still writing .npys, and ingests each
+# timepoint as soon as its z-stack is complete
+# The trackers of the t video (at ZVALUE) are kept between timepoints and updated with each new frame, the z videos
+# are run for each TVALUE once its z-stack is complete, and the new matches are appended to cptracker_output.csv
+# note: unlike the batch tracker, global cell IDs are the index of the tracker in the first frame (trackers that leave
+#       the frame keep their ID and the rows already written), and the rows of the output are in the order they were
+#       matched rather than grouped by cell
+
+import os
+import time
+import cv2
+
+import load_npy
+import tracker
+import match_coords
+import run_tracker
+import dataset_manifest
+import DatasetGrid
+import FrameConnector
+
+OUTPUT_NAME = "cptracker_output.csv"            # name of the output appended to in the generated folder
+FC_DIR_NAME = "watch_frame_connector"           # name of the folder the FrameConnector is saved to when stopped
+
+
+# returns the t values of the dataset whose z-stacks are complete, in order, after the last t value ingested
+# inputs: manifest - dataset manifest mapping each frame_id to the PATH of its .npy (see dataset_manifest)
+#         last_t - the last t value ingested, or None if no t value has been ingested
+#         z_count - number of z slices in a complete z-stack, if None a z-stack is complete once a .npy of a later t
+#                   has been written (the .npys are written in order of t)
+#         flush - boolean; if True, every remaining t value is treated as complete (used when the watch is stopped)
+# output: list of the t values that can be ingested, stops at the first t value that is not complete
+def complete_t_values(manifest, last_t, z_count=None, flush=False):
+    grid = DatasetGrid.DatasetGrid(list(manifest))
+    counts = (grid.index >= 0).sum(axis=1)
+
+    t_list = []
+    for t_i in range(len(grid.t_values)):
+        t = int(grid.t_values[t_i])
+        if last_t is not None and t <= last_t:
+            continue
+        if flush or (z_count and counts[t_i] >= z_count) or (not z_count and t_i < len(grid.t_values) - 1):
+            t_list.append(t)
+        else:
+            break
+
+    return t_list
+
+
+# scans the folder for .npys, leaving out files modified in the last settle_seconds (possibly still being written) and
+# files of t values that have already been ingested
+# inputs: folder_name - PATH to the folder containing the .npy files
+#         last_t - the last t value ingested, or None
+#         settle_seconds - how long a file must be unmodified before it is used
+# output: dataset manifest of the .npys that can be used
+def scan_folder(folder_name, last_t, settle_seconds):
+    now = time.time()
+    manifest = {}
+    for f, path in dataset_manifest.build_manifest(folder_name, verbose=False).items():
+        if last_t is not None and int(f[1:4]) <= last_t:
+            continue
+        try:
+            if now - os.path.getmtime(path) < settle_seconds:
+                continue
+        except OSError:     # file was removed or renamed since the scan
+            continue
+        manifest[f] = path
+
+    return manifest
+
+
+# appends the matched cells that have not been written yet to the output, in the same format as main.format_output
+# inputs: coord_fp - the open output file
+#         records - list of (cell_id, frame_id, coords) to write
+#         written - set of the (cell_id, frame_id) already written, updated with the records written
+# output: number of rows written
+def append_records(coord_fp, records, written):
+    rows = 0
+    for cell_id, frame, coords in records:
+        if (cell_id, frame) in written:      # frame at ZVALUE is in both the t video and the z video
+            continue
+        written.add((cell_id, frame))
+
+        t, z = FrameConnector.parse_frame_id(frame)
+        for n in coords:      # for each coordinate
+            coord_fp.write(str(cell_id + 1) + "," + str(n[0]) + "," + str(n[1]) + "," + str(z) + "," + str(t) + "\n")
+            rows += 1
+
+    coord_fp.flush()
+    return rows
+
+
+# watches a folder for new .npys and tracks each timepoint as its z-stack is completed, until no new .npy has been
+# written for idle_timeout seconds, stop_t has been ingested, or 'Ctrl+C' is pressed
+# inputs: folder_name - PATH to the folder the .npys are written to (named with txxx_zxxx)
+#         zvalue - the z value of the t video, and the z value to split the z videos at
+#         tvalues - the t values to run the z videos at
+#         jump_limit - how far the tracker is allowed to move between frames
+#         tracker_type - cv2 tracker algorithm to use, "TrackerCSRT" is recommended
+#         z_count - optional, number of z slices in a complete z-stack (see complete_t_values)
+#         poll_seconds - how often the folder is scanned, defaults to 5 seconds
+#         settle_seconds - how long a .npy must be unmodified before it is read, defaults to 2 seconds
+#         idle_timeout - optional, stop after this many seconds without a new .npy, defaults to None (no timeout)
+#         stop_t - optional, stop once this t value has been ingested
+#         video_fps - frames per second of the z video .mp4s
+#         rand_num - randomly select user-specified number of cells to track
+#         dir_path - optional, folder the .pngs, videos, and output are generated in, defaults to __CPTracker_folder__
+#                    in folder_name
+# output: the FrameConnector of the cells tracked, also saved to watch_frame_connector in the generated folder
+def watch(folder_name, zvalue, tvalues, jump_limit, tracker_type, z_count=None, poll_seconds=5, settle_seconds=2,
+          idle_timeout=None, stop_t=None, video_fps=4, rand_num=None, dir_path=None):
+
+    if dir_path is None:
+        dir_path = folder_name + "/__CPTracker_folder__"
+    if not os.path.isdir(dir_path):
+        os.makedirs(dir_path)
+
+    frame_connector = FrameConnector.FrameConnector()
+    coord_fp = open(dir_path + "/" + OUTPUT_NAME, "w")
+    written = set()
+
+    multi_tracker = None        # trackers of the t video, created at the first frame
+    prev_cpframe = None         # CPFrame of the last frame of the t video, matched with the next tracker update
+    step = 0                    # number of tracker updates
+    output = None               # .avi of the t video tracking results
+    pending_z = []              # t values whose z videos wait for the first video cell center list
+    manifest = {}               # .npys found so far
+    last_t = None
+    last_change = time.time()
+    num_files = 0
+
+    print("\nWatching " + folder_name + " for new .npys...")
+    print("Press 'Ctrl+C' at any time to stop.")
+    try:
+        stop = False
+        while not stop:
+            manifest.update(scan_folder(folder_name, last_t, settle_seconds))
+            if len(manifest) != num_files:
+                num_files = len(manifest)
+                last_change = time.time()
+
+            idle = idle_timeout is not None and time.time() - last_change >= idle_timeout
+            t_list = complete_t_values(manifest, last_t, z_count=z_count, flush=idle)
+
+            for t in t_list:
+                frame_id = dataset_manifest.frame_id(t, zvalue)
+                if frame_id not in manifest:
+                    print("Warning: the t video is missing frame " + frame_id + ", it will be skipped")
+                else:
+                    png_name = dir_path + "/" + frame_id + ".npy.png"
+                    png, cpframe = load_npy.load(manifest[frame_id], png_name=png_name, frame_id=frame_id)
+                    frame = cv2.imread(png)
+
+                    if multi_tracker is None:       # first frame of the t video
+                        print("\nInitializing tracker...")
+                        multi_tracker = tracker.init_trackers(frame, cpframe, tracker_type, rand_num=rand_num)
+                        output = cv2.VideoWriter(dir_path + "/watch_video_" + tracker_type + ".avi",
+                                                 cv2.VideoWriter_fourcc(*'XVID'), 60.0,
+                                                 (frame.shape[1], frame.shape[0]), True)
+                    else:
+                        display_frame = frame.copy()
+                        tracker.update_trackers(multi_tracker, frame, display_frame, jump_limit)
+                        output.write(display_frame)
+                        step += 1
+
+                        if step == 1:   # the cell centers of the first video are the trackers' first coordinates
+                            first_vid_list = []
+                            for tracker_ds in multi_tracker:
+                                coords = tracker_ds.get_coords()
+                                first_vid_list.append(coords[0] if coords else None)
+                            frame_connector.set_first_vid_list(first_vid_list)
+                            frame_connector.reserve_cells(len(multi_tracker))
+
+                        # match the previous frame with the coordinates of this update, pairing frames and tracker
+                        # coordinates the same way as the batch t video
+                        step_coords = []
+                        for tracker_ds in multi_tracker:
+                            coords = tracker_ds.get_coords()
+                            step_coords.append(coords[step - 1:step] if coords else None)
+                        records = match_coords.match_records([prev_cpframe], [], step_coords, True)
+                        for cell_id, frame_name, coords in records:
+                            frame_connector.add_cell(cell_id, frame_name, coords)
+                        append_records(coord_fp, records, written)
+
+                    prev_cpframe = cpframe
+
+                if t in tvalues:
+                    pending_z.append(t)
+                if frame_connector.get_first_vid_list():
+                    for z_t in pending_z:
+                        run_z_videos(z_t, manifest, frame_connector, coord_fp, written, zvalue, jump_limit,
+                                     tracker_type, dir_path, video_fps, rand_num)
+                    pending_z = []
+
+                last_t = t
+                print("t = " + str(t) + " ingested")
+                if stop_t is not None and t >= stop_t:
+                    stop = True
+                    break
+
+            if idle:
+                print("No new .npys for " + str(idle_timeout) + " seconds, stopping")
+                stop = True
+            elif not stop:
+                time.sleep(poll_seconds)
+
+    except KeyboardInterrupt:
+        print("\nStopping...")
+
+    if pending_z:
+        print("Warning: the z videos at t = " + str(pending_z) + " were not run, the t video has fewer than 2 frames")
+
+    coord_fp.close()
+    if output is not None:
+        output.release()
+    if not frame_connector.is_empty():
+        frame_connector.save(dir_path + "/" + FC_DIR_NAME)
+
+    return frame_connector
+
+
+# runs the upper and lower z videos at a given t and appends their matches to the output
+# inputs: t - the t value of the z videos
+#         manifest - dataset manifest containing the z-stack at t
+#         frame_connector - FrameConnector with the first video cell center list set
+#         coord_fp, written - see append_records
+#         other inputs - see watch
+# output: None
+def run_z_videos(t, manifest, frame_connector, coord_fp, written, zvalue, jump_limit, tracker_type, dir_path,
+                 video_fps, rand_num):
+    upper, lower = DatasetGrid.DatasetGrid(list(manifest)).z_video(t, zvalue)
+
+    # upper video runs from zvalue to the top of the z-stack, as in main.generate_video_lists
+    for video, name in ((upper[::-1], "upper"), (lower, "lower")):
+        if len(video) == 0:
+            continue
+        records = run_tracker.match_video(video, tracker_type, frame_connector.get_first_vid_list(), jump_limit,
+                                          dir_path, video_fps=video_fps, rand_num=rand_num,
+                                          video_name="watch_z_video_t" + str(t).zfill(3) + "_" + name,
+                                          first_video=False, manifest=manifest)
+        for cell_id, frame, coords in records:
+            frame_connector.add_cell(cell_id, frame, coords)
+        append_records(coord_fp, records, written)